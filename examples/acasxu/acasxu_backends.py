@@ -0,0 +1,86 @@
+'''
+Measurement script comparing the worker backends (Settings.WORKER_BACKEND) on ACAS Xu networks. Each instance is
+verified with worker processes and with worker threads, and a summary file is produced in the results folder.
+
+Worker threads only run GLPK LPs at the same time if GLPK was built with thread local storage, so otherwise both
+backends use HiGHS.
+
+usage: "python3 acasxu_backends.py [processes=<auto>] [timeout=60]"
+'''
+
+import sys
+import time
+from pathlib import Path
+
+from termcolor import cprint
+
+from nnenum.settings import Settings
+from nnenum.lpinstance_glpk import glpk_thread_safe
+
+# the LP solver is chosen when nnenum.lp_star is imported (see lpinstance_glpk.glpk_thread_safe())
+LP_SOLVER = 'GLPK' if glpk_thread_safe() else 'HiGHS'
+Settings.LP_SOLVER = LP_SOLVER
+
+from nnenum.nnenum import verify, load_network # pylint: disable=wrong-import-position
+
+def main():
+    'main entry point'
+
+    filename = 'results/backends_acasxu.dat'
+    processes = int(sys.argv[1]) if len(sys.argv) > 1 else None
+    timeout = float(sys.argv[2]) if len(sys.argv) > 2 else 60.0
+
+    # (a_prev, tau, spec), both safe and unsafe instances
+    instances = [["1", "1", "1"],
+                 ["1", "1", "2"],
+                 ["1", "1", "3"],
+                 ["1", "1", "4"],
+                 ["2", "1", "2"],
+                 ["3", "3", "1"],
+                 ["1", "1", "5"],
+                 ["1", "1", "6"],
+                 ["4", "5", "10"],
+                 ["3", "3", "9"]]
+
+    backends = [('processes', Settings.BACKEND_PROCESSES), ('threads', Settings.BACKEND_THREADS)]
+    totals = [0.0] * len(backends)
+
+    Path("./results").mkdir(parents=True, exist_ok=True)
+    print(f"LP solver: {LP_SOLVER}")
+
+    with open(filename, "w") as f:
+        f.write("net\tspec\t" + "\t".join(f"{name}_result\t{name}_secs" for name, _ in backends) + "\n")
+
+        for a_prev, tau, spec in instances:
+            cprint(f"\nRunning net {a_prev}-{tau} with spec {spec}", "grey", "on_green")
+
+            onnx_path = f'./data/ACASXU_run2a_{a_prev}_{tau}_batch_2000.onnx'
+            spec_path = f'./data/prop_{spec}.vnnlib'
+            network = load_network(onnx_path)
+
+            s = f"{a_prev}_{tau}\t{spec}"
+
+            for i, (name, backend) in enumerate(backends):
+                Settings.reset()
+                Settings.LP_SOLVER = LP_SOLVER
+                Settings.PRINT_OUTPUT = False
+                Settings.WORKER_BACKEND = backend
+
+                if processes is not None:
+                    Settings.NUM_PROCESSES = processes
+
+                start = time.perf_counter()
+                res_str = verify(onnx_path, spec_path, timeout, network=network)
+                secs = time.perf_counter() - start
+
+                totals[i] += secs
+                s += f"\t{res_str}\t{round(secs, 3)}"
+
+            f.write(s + "\n")
+            f.flush()
+            print(s)
+
+    print("\nTotal: " + ", ".join(f"{name} {round(t, 3)} sec" for (name, _), t in zip(backends, totals)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+'''
+Measurement script comparing the LP solver backends (Settings.LP_SOLVER) on ACAS Xu networks. Each instance is verified
+with GLPK, Gurobi and HiGHS, and a summary file is produced in the results folder. Backends whose python package is not
+installed (gurobipy, highspy) are skipped.
+
+The backend is chosen when nnenum.lp_star is imported, so each backend runs all the instances in its own python
+process (this script, run with --child <backend>).
+
+usage: "python3 acasxu_lp_solvers.py [processes=<auto>] [timeout=60]"
+'''
+
+import sys
+import time
+import json
+import subprocess
+import importlib.util
+from pathlib import Path
+
+from termcolor import cprint
+
+# (name, python package needed)
+SOLVERS = [('GLPK', 'swiglpk'), ('Gurobi', 'gurobipy'), ('HiGHS', 'highspy')]
+
+# (a_prev, tau, spec), both safe and unsafe instances
+INSTANCES = [["1", "1", "1"],
+             ["1", "1", "2"],
+             ["1", "1", "3"],
+             ["1", "1", "4"],
+             ["2", "1", "2"],
+             ["3", "3", "1"],
+             ["1", "1", "5"],
+             ["4", "5", "10"],
+             ["3", "3", "9"]]
+
+def run_child(solver, processes, timeout):
+    'verify all the instances with one lp solver, printing a json list of (result, secs) as the last line'
+
+    from nnenum.settings import Settings
+
+    Settings.LP_SOLVER = solver
+
+    from nnenum.nnenum import verify, load_network # imports lp_star, which selects the backend
+
+    rv = []
+
+    for a_prev, tau, spec in INSTANCES:
+        onnx_path = f'./data/ACASXU_run2a_{a_prev}_{tau}_batch_2000.onnx'
+        spec_path = f'./data/prop_{spec}.vnnlib'
+        network = load_network(onnx_path)
+
+        Settings.reset()
+        Settings.LP_SOLVER = solver
+        Settings.PRINT_OUTPUT = False
+
+        if processes is not None:
+            Settings.NUM_PROCESSES = processes
+
+        start = time.perf_counter()
+        res_str = verify(onnx_path, spec_path, timeout, network=network)
+        secs = time.perf_counter() - start
+
+        print(f"{solver} {a_prev}_{tau} spec {spec}: {res_str} in {round(secs, 3)} sec", file=sys.stderr)
+        rv.append((res_str, secs))
+
+    print(json.dumps(rv))
+
+def main():
+    'main entry point'
+
+    if sys.argv[1:2] == ['--child']:
+        processes = None if sys.argv[3] == 'None' else int(sys.argv[3])
+        run_child(sys.argv[2], processes, float(sys.argv[4]))
+        return
+
+    filename = 'results/lp_solvers_acasxu.dat'
+    processes = int(sys.argv[1]) if len(sys.argv) > 1 else None
+    timeout = float(sys.argv[2]) if len(sys.argv) > 2 else 60.0
+
+    solvers = []
+    results = []
+
+    for solver, package in SOLVERS:
+        if importlib.util.find_spec(package) is None:
+            print(f"Skipping {solver}: python package {package} is not installed")
+            continue
+
+        cprint(f"\nRunning all instances with {solver}", "grey", "on_green")
+
+        args = [sys.executable, __file__, '--child', solver, str(processes), str(timeout)]
+        output = subprocess.run(args, stdout=subprocess.PIPE, check=True, text=True).stdout
+
+        solvers.append(solver)
+        results.append(json.loads(output.strip().splitlines()[-1]))
+
+    Path("./results").mkdir(parents=True, exist_ok=True)
+
+    with open(filename, "w") as f:
+        f.write("net\tspec\t" + "\t".join(f"{name}_result\t{name}_secs" for name in solvers) + "\n")
+
+        for i, (a_prev, tau, spec) in enumerate(INSTANCES):
+            s = f"{a_prev}_{tau}\t{spec}"
+
+            for res in results:
+                res_str, secs = res[i]
+                s += f"\t{res_str}\t{round(secs, 3)}"
+
+            if len({res[i][0] for res in results}) > 1:
+                s += "\tMISMATCH"
+
+            f.write(s + "\n")
+            print(s)
+
+    totals = [sum(secs for _, secs in res) for res in results]
+    print("\nTotal: " + ", ".join(f"{name} {round(t, 3)} sec" for name, t in zip(solvers, totals)))
+
+if __name__ == '__main__':
+    main()
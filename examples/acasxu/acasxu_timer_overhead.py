@@ -0,0 +1,126 @@
+'''
+Measurement script for the overhead of the timers. First, the per-call cost of timing a trivial function is measured
+with no timers, hot timers (Settings.HOT_TIMERS) and the detailed Timers (Settings.TIMING_STATS). Then ACAS Xu
+instances are verified with and without hot timers, and a summary file is produced in the results folder.
+
+usage: "python3 acasxu_timer_overhead.py [processes=<auto>] [timeout=60]"
+'''
+
+import sys
+import time
+from pathlib import Path
+
+from termcolor import cprint
+
+from nnenum.settings import Settings
+from nnenum.timerutil import Timers, HotTimers, hot_timed
+from nnenum.nnenum import verify, load_network
+
+# (name, HOT_TIMERS, TIMING_STATS)
+CONFIGS = [('none', False, False), ('hot', True, False), ('timing_stats', True, True)]
+
+def noop():
+    'untimed function'
+
+@hot_timed('noop')
+def timed_noop():
+    'function with a hot timer'
+
+def measure_call_ns(func, num_calls):
+    'get the nanoseconds per call of func'
+
+    start = time.perf_counter_ns()
+
+    for _ in range(num_calls):
+        func()
+
+    return (time.perf_counter_ns() - start) / num_calls
+
+def measure_overhead(num_calls=10**6):
+    'print the per-call overhead of each timer configuration'
+
+    base_ns = measure_call_ns(noop, num_calls)
+    print(f"Untimed call: {round(base_ns, 1)} ns")
+
+    for name, hot_timers, timing_stats in CONFIGS:
+        Timers.reset()
+        HotTimers.reset()
+        HotTimers.enabled = hot_timers
+
+        if timing_stats:
+            Timers.enable()
+            Timers.tic('measure_overhead') # timers are nested in a top-level timer, like in the workers
+        else:
+            Timers.disable()
+
+        ns = measure_call_ns(timed_noop, num_calls)
+
+        if timing_stats:
+            Timers.toc('measure_overhead')
+
+        print(f"Overhead with {name}: {round(ns - base_ns, 1)} ns per call")
+
+    Timers.enable()
+    HotTimers.enabled = True
+
+def main():
+    'main entry point'
+
+    filename = 'results/timer_overhead_acasxu.dat'
+    processes = int(sys.argv[1]) if len(sys.argv) > 1 else None
+    timeout = float(sys.argv[2]) if len(sys.argv) > 2 else 60.0
+
+    measure_overhead()
+
+    # (a_prev, tau, spec), both safe and unsafe instances
+    instances = [["1", "1", "1"],
+                 ["1", "1", "2"],
+                 ["1", "1", "3"],
+                 ["1", "1", "4"],
+                 ["2", "1", "2"],
+                 ["3", "3", "1"],
+                 ["1", "1", "5"],
+                 ["4", "5", "10"],
+                 ["3", "3", "9"]]
+
+    # the control settings preset used for ACAS Xu disables TIMING_STATS, so only HOT_TIMERS is compared
+    backends = [('none', False), ('hot', True)]
+    totals = [0.0] * len(backends)
+
+    Path("./results").mkdir(parents=True, exist_ok=True)
+
+    with open(filename, "w") as f:
+        f.write("net\tspec\t" + "\t".join(f"{name}_result\t{name}_secs" for name, _ in backends) + "\n")
+
+        for a_prev, tau, spec in instances:
+            cprint(f"\nRunning net {a_prev}-{tau} with spec {spec}", "grey", "on_green")
+
+            onnx_path = f'./data/ACASXU_run2a_{a_prev}_{tau}_batch_2000.onnx'
+            spec_path = f'./data/prop_{spec}.vnnlib'
+            network = load_network(onnx_path)
+
+            s = f"{a_prev}_{tau}\t{spec}"
+
+            for i, (_, hot_timers) in enumerate(backends):
+                Settings.reset()
+                Settings.PRINT_OUTPUT = False
+                Settings.HOT_TIMERS = hot_timers
+
+                if processes is not None:
+                    Settings.NUM_PROCESSES = processes
+
+                start = time.perf_counter()
+                res_str = verify(onnx_path, spec_path, timeout, network=network)
+                secs = time.perf_counter() - start
+
+                totals[i] += secs
+                s += f"\t{res_str}\t{round(secs, 3)}"
+
+            f.write(s + "\n")
+            f.flush()
+            print(s)
+
+    print("\nTotal: " + ", ".join(f"{name} {round(t, 3)} sec" for (name, _), t in zip(backends, totals)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+'''
+Benchmark of LpInstance.serialize() and deserialize() against the LP size. For each size, a random LP shaped like a
+star's LP is created, and the average time of each operation and the pickled size of the serialized LP are printed.
+
+usage: "python3 lp_serialize.py [repeats=20]"
+'''
+
+import sys
+import time
+import pickle
+
+import numpy as np
+
+from nnenum.settings import Settings
+from nnenum.lpinstance_glpk import LpInstanceGLPK as LpInstance
+
+# (rows, cols)
+SIZES = [(20, 5), (100, 20), (300, 50), (1000, 100), (3000, 300)]
+
+def make_lp(num_rows, num_cols, rng):
+    'make a random lp with double-bounded columns and dense <= rows, which is feasible at the origin'
+
+    lpi = LpInstance()
+    lpi.add_double_bounded_cols([f"i{n}" for n in range(num_cols)], -1, 1)
+
+    for _ in range(num_rows):
+        lpi.add_dense_row(rng.normal(size=num_cols), rng.uniform(0.1, 1.0))
+
+    return lpi
+
+def main():
+    'main entry point'
+
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    rng = np.random.default_rng(0)
+
+    Settings.TIMING_STATS = False
+
+    print("rows\tcols\tserialize_ms\tdeserialize_ms\tpickled_kb")
+
+    for num_rows, num_cols in SIZES:
+        lpi = make_lp(num_rows, num_cols, rng)
+        direction = np.ones(num_cols)
+        expected = direction.dot(lpi.minimize(direction))
+
+        serialize_secs = deserialize_secs = 0.0
+
+        for _ in range(repeats):
+            start = time.perf_counter()
+            lpi.serialize()
+            serialize_secs += time.perf_counter() - start
+
+            num_bytes = len(pickle.dumps(lpi.lp, protocol=5))
+
+            start = time.perf_counter()
+            lpi.deserialize()
+            deserialize_secs += time.perf_counter() - start
+
+        # the lp is unchanged
+        assert abs(direction.dot(lpi.minimize(direction)) - expected) < 1e-6
+
+        print(f"{num_rows}\t{num_cols}\t{round(1000 * serialize_secs / repeats, 3)}\t" + \
+              f"{round(1000 * deserialize_secs / repeats, 3)}\t{round(num_bytes / 1024, 1)}")
+
+if __name__ == '__main__':
+    main()
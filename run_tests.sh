@@ -18,4 +18,27 @@ python3 -m nnenum.nnenum examples/cifar2020/cifar10_2_255_simplified.onnx exampl
 
 python3 -m nnenum.nnenum examples/cifar2020/cifar10_2_255_simplified.onnx examples/cifar2020/cifar10_spec_idx_3_eps_0.00784_n1.vnnlib 60 /dev/null
 
+# worker threads on a property that needs many lps at the same time (see lpinstance_glpk.glpk_thread_safe())
+python3 -m nnenum.nnenum examples/acasxu/data/ACASXU_run2a_1_1_batch_2000.onnx examples/acasxu/data/prop_4.vnnlib 300 out.txt 4 exact --threads
+grep "holds" out.txt
+
+# multi-node smoke test: a coordinator and two workers on localhost (see nnenum/distributed.py)
+export NNENUM_AUTHKEY=nnenum_test
+PORT=15731
+
+python3 -m nnenum.distributed coordinator 127.0.0.1:$PORT 2 examples/test/test_unsat.onnx examples/test/test_prop.vnnlib 60 out.txt &
+COORDINATOR_PID=$!
+
+# wait for the coordinator to listen, since workers don't retry the connection
+until (echo > /dev/tcp/127.0.0.1/$PORT) 2>/dev/null; do
+    sleep 0.2
+done
+
+python3 -m nnenum.distributed worker 127.0.0.1:$PORT 1 &
+python3 -m nnenum.distributed worker 127.0.0.1:$PORT 1 &
+
+wait $COORDINATOR_PID
+wait
+grep "holds" out.txt
+
 echo "Passed all tests."
@@ -0,0 +1,173 @@
+'''
+Checkpoints of the enumeration frontier
+
+A checkpoint directory contains one frontier file per worker, plus one for the stars that were in the global work
+queue, and a json manifest. Each frontier file is a pickled dict with the pending LpStarState objects (with their
+lps serialized) and the worker's statistics that had not yet been added to the shared state, followed by one pickle
+per star that was spilled to disk (see frontier.SpillFrontier), copied from the spill file. The manifest has the
+shared statistics and is written last, so that it always refers to a complete set of frontier files.
+
+Checkpoints are written by the workers (see Worker.save_checkpoint) if Settings.CHECKPOINT_DIR is set, and loaded by
+enumerate_network() if Settings.CHECKPOINT_RESUME is also set.
+
+Stanley Bak
+'''
+
+import os
+import json
+import pickle
+import hashlib
+
+import numpy as np
+
+from nnenum.timerutil import Timers
+from nnenum.lp_star_state import StarRecipe
+
+MANIFEST_FILENAME = 'manifest.json'
+
+# statistics saved in checkpoints, used to initialize the shared values of the same name when resuming
+STAT_NAMES = ['finished_stars', 'finished_approx_stars', 'finished_work_frac', 'num_lps', 'num_lps_enum',
+              'num_offloaded']
+
+def make_key(init_box, spec):
+    'get the string that identifies the verification problem of a checkpoint'
+
+    h = hashlib.sha256()
+    h.update(np.array(init_box, dtype=float).tobytes())
+    h.update(pickle.dumps(spec))
+
+    return h.hexdigest()
+
+def frontier_filename(dirname, checkpoint_id, name):
+    'get the path of a frontier file'
+
+    return os.path.join(dirname, f'frontier_{checkpoint_id}_{name}.pkl')
+
+def write_atomic(filename, data, mode='wb', more_data=()):
+    '''write a file by writing a temporary file and renaming it
+
+    more_data is an iterable of more chunks to write after data
+    '''
+
+    tmp_filename = filename + '.tmp'
+
+    with open(tmp_filename, mode) as f:
+        f.write(data)
+
+        for chunk in more_data:
+            f.write(chunk)
+
+    os.replace(tmp_filename, filename)
+
+def save_frontier(dirname, checkpoint_id, name, ss_list, stats, spilled_records=()):
+    '''save a list of LpStarState objects and a dict of statistics to a frontier file
+
+    spilled_records is an iterable of already pickled stars (see SpillFrontier.spilled_records()), which are copied
+    to the file one at a time
+    '''
+
+    Timers.tic('save_frontier')
+
+    # StarRecipes (see Settings.COMPACT_FRONTIER) are saved as they are, and share their snapshots in the file
+    full_stars = [ss for ss in ss_list if not isinstance(ss, StarRecipe)]
+
+    for ss in full_stars:
+        ss.star.lpi.serialize()
+
+    try:
+        data = {'checkpoint_id': checkpoint_id, 'stars': ss_list, 'stats': stats}
+        write_atomic(frontier_filename(dirname, checkpoint_id, name), pickle.dumps(data), more_data=spilled_records)
+    finally:
+        for ss in full_stars:
+            ss.star.lpi.deserialize()
+
+    Timers.toc('save_frontier')
+
+def save_manifest(dirname, manifest):
+    'save the manifest, which completes a checkpoint, and delete frontier files of other checkpoints'
+
+    write_atomic(os.path.join(dirname, MANIFEST_FILENAME), json.dumps(manifest, indent=2), mode='w')
+
+    keep = {os.path.basename(frontier_filename(dirname, manifest['checkpoint_id'], name))
+            for name in manifest['frontier_names']}
+
+    for filename in os.listdir(dirname):
+        if filename.startswith('frontier_') and filename not in keep:
+            os.remove(os.path.join(dirname, filename))
+
+def discard_frontier(dirname, checkpoint_id):
+    'delete the frontier files of an abandoned checkpoint'
+
+    prefix = f'frontier_{checkpoint_id}_'
+
+    for filename in os.listdir(dirname):
+        if filename.startswith(prefix):
+            os.remove(os.path.join(dirname, filename))
+
+def load_manifest(dirname):
+    'load the manifest dict, or return None if dirname has no complete checkpoint'
+
+    rv = None
+    filename = os.path.join(dirname, MANIFEST_FILENAME)
+
+    if os.path.exists(filename):
+        with open(filename) as f:
+            rv = json.load(f)
+
+    return rv
+
+def load_checkpoint(dirname, key):
+    '''load the frontier and statistics of the checkpoint in dirname
+
+    returns a tuple (ss_list, stats, manifest), or None if dirname has no checkpoint for key
+    '''
+
+    manifest = load_manifest(dirname)
+
+    if manifest is None or manifest['key'] != key:
+        return None
+
+    Timers.tic('load_checkpoint')
+
+    ss_list = []
+    stats = dict(manifest['stats'])
+
+    for name in manifest['frontier_names']:
+        with open(frontier_filename(dirname, manifest['checkpoint_id'], name), 'rb') as f:
+            data = pickle.load(f)
+            file_ss_list = data['stars']
+
+            # stars that were spilled to disk follow the dict
+            while True:
+                try:
+                    file_ss_list.append(pickle.load(f))
+                except EOFError:
+                    break
+
+        assert data['checkpoint_id'] == manifest['checkpoint_id']
+
+        for ss in file_ss_list:
+            if not isinstance(ss, StarRecipe):
+                ss.star.lpi.deserialize()
+
+            ss_list.append(ss)
+
+        for stat_name, val in data['stats'].items():
+            stats[stat_name] += val
+
+    assert len(ss_list) == manifest['num_stars'], \
+        f"checkpoint has {len(ss_list)} stars, manifest expected {manifest['num_stars']}"
+
+    Timers.toc('load_checkpoint')
+
+    return ss_list, stats, manifest
+
+def clear_checkpoint(dirname, key):
+    'delete the checkpoint in dirname if it is for key (after that enumeration completed)'
+
+    manifest = load_manifest(dirname)
+
+    if manifest is not None and manifest['key'] == key:
+        for filename in os.listdir(dirname):
+            if filename == MANIFEST_FILENAME or filename.startswith('frontier_'):
+                os.remove(os.path.join(dirname, filename))
@@ -0,0 +1,123 @@
+'''
+nnenum verification daemon client
+
+usage: "python3 -m nnenum.client <socket_file> <onnx_file> <vnnlib_file> [timeout=None] [outfile=None] [settings=auto]"
+or:    "python3 -m nnenum.client <socket_file> --ping|--shutdown"
+
+Submits a job to a running nnenum.server and prints (or writes to outfile) the result string. This module only
+imports the standard library, so it starts quickly.
+
+The exit code is 2 if the server could not be reached (so the job can be run directly instead), 1 if the result is
+"error", and 0 otherwise.
+
+Stanley Bak
+'''
+
+import sys
+import os
+import json
+import socket
+
+CONNECT_TIMEOUT = 5.0 # secs
+
+# extra secs to wait for a reply after the job's timeout (loading the network, starting the workers)
+REPLY_TIMEOUT_MARGIN = 60.0
+
+class ServerUnavailableError(ConnectionError):
+    'the server could not be reached, or closed the connection without replying'
+
+def submit(socket_filename, request, timeout=None):
+    '''send a request dict to the server and wait for the reply
+
+    timeout is the max secs to wait for the reply (None waits forever), and raises socket.timeout
+
+    returns the reply dict
+    '''
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(CONNECT_TIMEOUT)
+
+        try:
+            sock.connect(socket_filename)
+        except OSError as e:
+            raise ServerUnavailableError(f"cannot connect to server at {socket_filename}: {e}") from e
+
+        sock.settimeout(timeout)
+
+        with sock.makefile('rw') as f:
+            f.write(json.dumps(request) + "\n")
+            f.flush()
+
+            line = f.readline()
+
+    if not line:
+        raise ServerUnavailableError("server closed the connection without replying")
+
+    return json.loads(line)
+
+def verify(socket_filename, onnx_filename, vnnlib_filename, timeout=None, settings_str="auto"):
+    '''submit a verification job
+
+    returns the result string: "holds", "violated", "timeout", "error", ...
+    '''
+
+    request = {'onnx': os.path.abspath(onnx_filename),
+               'vnnlib': os.path.abspath(vnnlib_filename),
+               'timeout': timeout,
+               'settings': settings_str}
+
+    reply_timeout = None if timeout is None else timeout + REPLY_TIMEOUT_MARGIN
+
+    try:
+        reply = submit(socket_filename, request, reply_timeout)
+        rv = reply['result']
+    except socket.timeout:
+        print(f"server did not reply within {reply_timeout} secs")
+        rv = 'timeout'
+
+    return rv
+
+def main():
+    'main entry point'
+
+    if len(sys.argv) == 3 and sys.argv[2] in ['--ping', '--shutdown']:
+        command = sys.argv[2][2:]
+
+        try:
+            reply = submit(sys.argv[1], {'command': command}, timeout=5.0)
+        except (OSError, ValueError) as e:
+            print(f"server at {sys.argv[1]} is not responding: {e}")
+            sys.exit(1)
+
+        print(reply['result'])
+        sys.exit(0)
+
+    if len(sys.argv) < 4:
+        print('usage: "python3 -m nnenum.client <socket_file> <onnx_file> <vnnlib_file> [timeout=None] ' + \
+              '[outfile=None] [settings=auto]"')
+        sys.exit(1)
+
+    socket_filename = sys.argv[1]
+    onnx_filename = sys.argv[2]
+    vnnlib_filename = sys.argv[3]
+    timeout = float(sys.argv[4]) if len(sys.argv) >= 5 else None
+    outfile = sys.argv[5] if len(sys.argv) >= 6 else None
+    settings_str = sys.argv[6] if len(sys.argv) >= 7 else "auto"
+
+    try:
+        result_str = verify(socket_filename, onnx_filename, vnnlib_filename, timeout, settings_str)
+    except ServerUnavailableError as e:
+        print(e)
+        sys.exit(2)
+
+    if outfile is not None:
+        with open(outfile, 'w') as f:
+            f.write(result_str)
+    else:
+        print(result_str)
+
+    if result_str == 'error':
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,413 @@
+'''
+Multi-node distributed enumeration
+
+A coordinator process owns the global work queue and the termination counters (stars_created,
+finished_work_frac, ...) and serves them over TCP with a multiprocessing manager. Worker processes on any number of
+hosts connect to it and build a SharedState whose members are proxies to the coordinator's objects, and then run
+the usual Worker.main_loop. Idle workers steal stars from other workers, which send them serialized through the
+coordinator's per-worker queues.
+
+usage (coordinator): "python3 -m nnenum.distributed coordinator <host:port> <num_workers> <onnx_file> <vnnlib_file>
+                      [timeout=None] [outfile=None] [settings=auto]"
+usage (workers):     "python3 -m nnenum.distributed worker <host:port> [processes=<auto>]"
+
+The coordinator listens on host:port, which must be an address that the workers can reach, and waits for num_workers
+worker processes to connect before it starts. The environment variable NNENUM_AUTHKEY must be set to the same secret
+for the coordinator and the workers, since the connection exchanges pickled objects. Worker hosts should export
+OPENBLAS_NUM_THREADS=1 and OMP_NUM_THREADS=1. To test on a single machine, run the coordinator and several worker
+commands with a localhost address.
+
+Stanley Bak
+'''
+
+import sys
+import os
+import time
+import socket
+import threading
+import multiprocessing
+from multiprocessing.managers import BaseManager, BaseProxy, AcquirerProxy, ValueProxy, ListProxy
+
+from nnenum.settings import Settings
+from nnenum.timerutil import Timers
+from nnenum.util import Freezable, check_openblas_threads
+from nnenum.syncutil import ProcessSync, ServedSync
+from nnenum.enumerate import SharedState, Enumerator, pool_worker_func
+from nnenum.nnenum import load_network, verify
+
+class ArrayProxy(BaseProxy):
+    'proxy to a list served as a shared array; iterating fetches a single copy rather than one item per request'
+
+    _exposed_ = ('__len__', '__getitem__', '__setitem__', 'copy', 'add')
+
+    def __len__(self):
+        return self._callmethod('__len__')
+
+    def __getitem__(self, key):
+        return self._callmethod('__getitem__', (key,))
+
+    def __setitem__(self, key, value):
+        return self._callmethod('__setitem__', (key, value))
+
+    def __iter__(self):
+        return iter(self._callmethod('copy'))
+
+    def add(self, key, amount):
+        'add to an item with a single request (see syncutil.ServedArray)'
+
+        return self._callmethod('add', (key, amount))
+
+# typeid -> proxy type for the objects served by the coordinator (None = AutoProxy)
+PROXY_TYPES = {'get_lock': AcquirerProxy,
+               'get_queue': None,
+               'get_value': ValueProxy,
+               'get_array': ArrayProxy,
+               'get_list': ListProxy,
+               'get_board': None}
+
+class CoordinatorManager(BaseManager):
+    'serves the coordinator objects, callables are registered by DistributedEnumerator'
+
+class WorkerManager(BaseManager):
+    'client connection to a CoordinatorManager'
+
+for _typeid, _proxytype in PROXY_TYPES.items():
+    WorkerManager.register(_typeid, proxytype=_proxytype)
+
+class WorkerBoard(Freezable):
+    'registry of the connected workers, owned by the coordinator'
+
+    def __init__(self, num_workers, setup):
+        self.num_workers = num_workers
+        self.setup = setup # (num_workers, network, settings snapshot, sync counts), sent to each new worker
+
+        self.hosts = [] # (hostname, pid) of each registered worker, in worker index order
+        self.last_heartbeat = {} # worker index -> time.monotonic() of its last heartbeat, for connected workers
+        self.lock = threading.Lock()
+
+        self.freeze_attrs()
+
+    def register(self, hostname, pid):
+        '''register a worker process
+
+        returns the worker index, or -1 if all workers are already registered
+        '''
+
+        with self.lock:
+            if len(self.hosts) >= self.num_workers:
+                rv = -1
+            else:
+                rv = len(self.hosts)
+                self.hosts.append((hostname, pid))
+                self.last_heartbeat[rv] = time.monotonic()
+
+        return rv
+
+    def unregister(self, index):
+        'a worker is disconnecting normally'
+
+        self.last_heartbeat.pop(index, None)
+
+    def get_setup(self):
+        'get the setup tuple: (num_workers, network, settings snapshot, sync counts)'
+
+        return self.setup
+
+    def heartbeat(self, index):
+        'a worker is still running'
+
+        self.last_heartbeat[index] = time.monotonic()
+
+    def num_registered(self):
+        'get the number of workers that have registered'
+
+        return len(self.hosts)
+
+    def num_connected(self):
+        'get the number of registered workers that have not disconnected'
+
+        return len(self.last_heartbeat)
+
+    def lost_workers(self, timeout):
+        'get the indices of connected workers that have not sent a heartbeat in timeout seconds'
+
+        now = time.monotonic()
+
+        return [i for i, t in list(self.last_heartbeat.items()) if now - t > timeout]
+
+class RemoteSync(ProcessSync):
+    '''creates proxies to the objects of the coordinator's ServedSync
+
+    Objects are matched by creation order, so a SharedState built with this refers to the coordinator's SharedState,
+    as long as both were created with the same Settings.
+    '''
+
+    same_host = False
+
+    def __init__(self, client):
+        self.client = client # connected WorkerManager
+
+        super().__init__()
+
+    def Lock(self):
+        rv = self.client.get_lock(len(self.locks))
+        self.locks.append(rv)
+
+        return rv
+
+    def Queue(self):
+        rv = self.client.get_queue(len(self.queues))
+        self.queues.append(rv)
+
+        return rv
+
+    def Value(self, typecode, value=0):
+        rv = self.client.get_value(len(self.values))
+        self.values.append(rv)
+
+        return rv
+
+    def Array(self, typecode, size, lock=True):
+        rv = self.client.get_array(len(self.arrays))
+        self.arrays.append(rv)
+
+        return rv
+
+    def list(self):
+        rv = self.client.get_list(len(self.lists))
+        self.lists.append(rv)
+
+        return rv
+
+class DistributedEnumerator(Enumerator):
+    '''Enumerator whose workers are remote processes that connect over TCP
+
+    address is the (host, port) to listen on. With port 0, a free port is chosen (see the address attribute).
+    Only one DistributedEnumerator can exist per process.
+    '''
+
+    def __init__(self, network, num_workers, address, authkey):
+        self.sync = ServedSync()
+        self.board = None
+        self.server = None
+        self.address = None
+
+        super().__init__(network, num_workers)
+
+        self.shared = SharedState(network, None, self.num_workers, time.perf_counter(), sync=self.sync)
+        self.shared.make_job_queues()
+
+        setup = (self.num_workers, network, Settings.snapshot(), self.sync.counts())
+        self.board = WorkerBoard(self.num_workers, setup)
+
+        sync = self.sync
+        CoordinatorManager.register('get_lock', callable=lambda i: sync.locks[i], proxytype=AcquirerProxy)
+        CoordinatorManager.register('get_queue', callable=lambda i: sync.queues[i])
+        CoordinatorManager.register('get_value', callable=lambda i: sync.values[i], proxytype=ValueProxy)
+        CoordinatorManager.register('get_array', callable=lambda i: sync.arrays[i], proxytype=ArrayProxy)
+        CoordinatorManager.register('get_list', callable=lambda i: sync.lists[i], proxytype=ListProxy)
+        CoordinatorManager.register('get_board', callable=lambda: self.board)
+
+        # serve from a thread of this process, so the served objects are the ones in self.shared
+        self.server = CoordinatorManager(address=address, authkey=authkey).get_server()
+        self.address = self.server.address
+
+        thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        thread.start()
+
+    def uses_pool(self):
+        return True
+
+    def wait_for_workers(self):
+        'block until all the workers have connected'
+
+        printed = False
+
+        while self.board.num_registered() < self.num_workers:
+            if not printed and Settings.PRINT_OUTPUT:
+                num = self.num_workers - self.board.num_registered()
+                host, port = self.address
+                print(f"Waiting for {num} of {self.num_workers} workers to connect to {host}:{port}", flush=True)
+                printed = True
+
+            time.sleep(0.1)
+
+    def start_job(self, spec, start_time):
+        Timers.tic('start_job')
+
+        assert self.server is not None, "DistributedEnumerator was closed"
+        self.wait_for_workers()
+
+        if self.board.lost_workers(Settings.DISTRIBUTED_WORKER_TIMEOUT):
+            raise RuntimeError("a distributed worker was lost during an earlier job")
+
+        assert len(self.shared.timer_secs) == len(Settings.RESULT_SAVE_TIMERS), \
+            "Settings.RESULT_SAVE_TIMERS cannot change while using a DistributedEnumerator"
+
+        self.shared.reset_for_job(spec, start_time)
+
+        Timers.toc('start_job')
+
+        return self.shared
+
+    def job_settings(self):
+        rv = Settings.snapshot()
+        rv['NUM_PROCESSES'] = self.num_workers
+
+        return rv
+
+    def check_workers(self):
+        lost = self.board.lost_workers(Settings.DISTRIBUTED_WORKER_TIMEOUT)
+        rv = not lost
+
+        if not rv:
+            hosts = [self.board.hosts[i] for i in lost]
+            print(f"Error: lost distributed workers {lost} (hostname, pid): {hosts}")
+
+            self.shared.had_exception.value = 1
+            self.shared.should_exit.value = 1
+
+        return rv
+
+    def close(self):
+        'tell the workers to exit and stop serving'
+
+        if self.server is not None:
+            for index in range(self.board.num_registered()):
+                self.shared.job_queues[index].put(None)
+
+            # give workers a chance to get the exit message before the server stops
+            deadline = time.perf_counter() + 5.0
+
+            while self.board.num_connected() > 0 and time.perf_counter() < deadline:
+                time.sleep(0.05)
+
+            self.server.stop_event.set()
+            self.server = None
+            self.shared = None
+
+def send_heartbeats(board, index, stop_event, interval=1.0):
+    'heartbeat thread of a remote worker'
+
+    while not stop_event.wait(interval):
+        try:
+            board.heartbeat(index)
+        except (EOFError, OSError):
+            break
+
+def run_worker(address, authkey):
+    'connect to a coordinator and run its jobs until it shuts down'
+
+    client = WorkerManager(address=address, authkey=authkey)
+    client.connect()
+
+    board = client.get_board()
+    index = board.register(socket.gethostname(), os.getpid())
+
+    if index < 0:
+        print(f"Coordinator at {address[0]}:{address[1]} already has all of its workers; exiting")
+        return
+
+    num_workers, network, settings, counts = board.get_setup()
+    Settings.restore(settings)
+
+    if Settings.CHECK_SINGLE_THREAD_BLAS:
+        check_openblas_threads()
+
+    sync = RemoteSync(client)
+    shared = SharedState(network, None, num_workers, time.perf_counter(), sync=sync)
+    shared.make_job_queues()
+
+    assert sync.counts() == counts, f"shared object counts {sync.counts()} differ from the coordinator's {counts}"
+
+    stop_event = threading.Event()
+    thread = threading.Thread(target=send_heartbeats, args=(board, index, stop_event), daemon=True)
+    thread.start()
+
+    try:
+        pool_worker_func(index, shared)
+    except (EOFError, OSError):
+        print(f"Worker {index}: lost connection to the coordinator")
+    else:
+        board.unregister(index)
+    finally:
+        stop_event.set()
+
+def parse_address(address_str):
+    'parse "host:port" into a (host, port) tuple'
+
+    host, port = address_str.rsplit(':', 1)
+
+    return host, int(port)
+
+def get_authkey():
+    'get the connection authentication key from the NNENUM_AUTHKEY environment variable'
+
+    key = os.environ.get('NNENUM_AUTHKEY')
+
+    if not key:
+        print("Error: set the NNENUM_AUTHKEY environment variable to the same secret on the coordinator and workers")
+        sys.exit(1)
+
+    return key.encode()
+
+def coordinator_main(args):
+    'run the coordinator from command-line arguments'
+
+    address = parse_address(args[0])
+    num_workers = int(args[1])
+    onnx_filename = args[2]
+    vnnlib_filename = args[3]
+    timeout = float(args[4]) if len(args) >= 5 else None
+    outfile = args[5] if len(args) >= 6 else None
+    settings_str = args[6] if len(args) >= 7 else "auto"
+
+    network = load_network(onnx_filename)
+
+    with DistributedEnumerator(network, num_workers, address, get_authkey()) as enumerator:
+        enumerator.wait_for_workers()
+
+        result_str = verify(onnx_filename, vnnlib_filename, timeout, settings_str, network=network,
+                            enumerator=enumerator)
+
+    if outfile is not None:
+        with open(outfile, 'w') as f:
+            f.write(result_str)
+    else:
+        print(result_str)
+
+    if result_str == 'error':
+        sys.exit(1)
+
+def worker_main(args):
+    'run worker processes from command-line arguments'
+
+    address = parse_address(args[0])
+    num_processes = int(args[1]) if len(args) >= 2 else Settings.NUM_PROCESSES
+    authkey = get_authkey()
+
+    processes = []
+
+    for _ in range(num_processes):
+        p = multiprocessing.Process(target=run_worker, args=(address, authkey))
+        p.start()
+        processes.append(p)
+
+    for p in processes:
+        p.join()
+
+def main():
+    'main entry point'
+
+    if len(sys.argv) >= 6 and sys.argv[1] == 'coordinator':
+        coordinator_main(sys.argv[2:])
+    elif len(sys.argv) >= 3 and sys.argv[1] == 'worker':
+        worker_main(sys.argv[2:])
+    else:
+        print('usage: "python3 -m nnenum.distributed coordinator <host:port> <num_workers> <onnx_file> ' + \
+              '<vnnlib_file> [timeout=None] [outfile=None] [settings=auto]"')
+        print('   or: "python3 -m nnenum.distributed worker <host:port> [processes=<auto>]"')
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -6,24 +6,36 @@ Enmeration functions for Neural Network Analysis
 the method you probably want to use is enumerate_network()
 '''
 
+import os
+import copy
 import multiprocessing
+import threading
 import time
 import queue
 import traceback
 
 import numpy as np
 
-from nnenum.timerutil import Timers
-from nnenum.lp_star import LpStar
-from nnenum.lp_star_state import LpStarState
+from nnenum.timerutil import Timers, HotTimers, merge_timer_dicts, merge_hot_timer_stats
+from nnenum.lp_star import LpStar, LpInstance
+from nnenum.lp_star_state import LpStarState, StarRecipe, SnapshotCache
 from nnenum.util import Freezable, FakeQueue, to_time_str, check_openblas_threads
 from nnenum.settings import Settings
 from nnenum.result import Result
 from nnenum.network import NeuralNetwork, nn_flatten
 from nnenum.worker import Worker
 from nnenum.overapprox import try_quick_overapprox
+from nnenum.shm_transfer import StarDescriptor, TransferStats, timed_pack, timed_unpack
+from nnenum.syncutil import ProcessSync, ThreadSync, ShardedCounter
+from nnenum.checkpoint import make_key, load_checkpoint, clear_checkpoint
+from nnenum.frontier import make_frontier
+from nnenum.treesize import TreeSizeStats
+from nnenum.replay import ReplayRecorder, load_replay, merge_record
+from nnenum.metrics import METRIC_NAMES, metrics_enabled, start_metrics
+from nnenum.trace import start_recording, save_part, write_trace
 
 from nnenum.prefilter import LpCanceledException
+from nnenum.lputil import SIMPLEX_STATS, close_lp_pool
 
 def make_init_ss(init, network, spec, start_time):
     'make the initial star state'
@@ -69,7 +81,7 @@ def make_init_ss(init, network, spec, start_time):
 
     return ss
 
-def enumerate_network(init, network, spec=None):
+def enumerate_network(init, network, spec=None, enumerator=None, stop_flag=None):
     '''enumerate the branches in the network
 
     init can either be a 2-d list or an lp_star or an lp_star_state
@@ -77,6 +89,11 @@ def enumerate_network(init, network, spec=None):
     settings are controlled by assigning directly to the class Settings, for example "Settings.timeout = 10"
     if spec is not None, a verification problem will be considered for the provided Specification object
 
+    if enumerator is not None, its already-running worker processes are used instead of starting new ones
+
+    if stop_flag is not None, it's a shared value (such as a multiprocessing.RawValue) that ends the enumeration like
+    a timeout when it becomes nonzero. This is not supported with an enumerator.
+
     the output is an instance of Result
     '''
 
@@ -88,8 +105,13 @@ def enumerate_network(init, network, spec=None):
 
     Timers.reset()
 
-    if not Settings.TIMING_STATS:
+    if Settings.TIMING_STATS:
+        Timers.enable() # may have been disabled by an earlier call
+    else:
         Timers.disable()
+
+    enable_hot_timers()
+    SIMPLEX_STATS.reset()
     
     Timers.tic('enumerate_network')
     start = time.perf_counter()
@@ -103,13 +125,19 @@ def enumerate_network(init, network, spec=None):
     assert not Settings.RESULT_SAVE_TIMERS or Settings.TIMING_STATS, \
         "RESULT_SAVE_TIMERS cannot be used if TIMING_STATS is False"
 
+    assert Settings.TRACE_FILE is None or Settings.TIMING_STATS, "TRACE_FILE cannot be used if TIMING_STATS is False"
+
+    assert not Settings.TIMING_STATS or Settings.WORKER_BACKEND != Settings.BACKEND_THREADS, \
+        "TIMING_STATS cannot be used with BACKEND_THREADS (Timers are shared by the whole process)"
+
     init_ss = None
     concrete_io_tuple = None
+    proven_safe = False
+    checkpoint_info, resume = get_checkpoint_info(init, spec)
     
-    if time.perf_counter() - start < Settings.TIMEOUT:
+    if resume is None and time.perf_counter() - start < Settings.TIMEOUT:
         init_ss = make_init_ss(init, network, spec, start) # returns None if timeout
 
-        proven_safe = False
         try_quick = Settings.TRY_QUICK_OVERAPPROX or Settings.SINGLE_SET
 
         if init_ss is not None and try_quick and spec is not None:
@@ -125,7 +153,7 @@ def enumerate_network(init, network, spec=None):
 
         rv.cinput = concrete_io_tuple[0]
         rv.coutput = concrete_io_tuple[1]
-    elif init_ss is None or time.perf_counter() - start > Settings.TIMEOUT:
+    elif resume is None and (init_ss is None or time.perf_counter() - start > Settings.TIMEOUT):
         if Settings.PRINT_OUTPUT:
             print(f"Timeout before enumerate, init_ss is None: {init_ss is None}")
             
@@ -145,15 +173,39 @@ def enumerate_network(init, network, spec=None):
             rv = Result(network, quick=True)
             rv.result_str = 'none'
         else:
-            num_workers = 1 if Settings.NUM_PROCESSES < 1 else Settings.NUM_PROCESSES
-
-            shared = SharedState(network, spec, num_workers, start)
-            shared.push_init(init_ss)
+            replay = None if Settings.REPLAY_LOG is None else load_replay(Settings.REPLAY_LOG, init, spec)
+            pooled = enumerator is not None and enumerator.uses_pool() and replay is None
+            assert stop_flag is None or not pooled, "stop_flag is not supported with pooled workers"
+
+            if pooled:
+                assert enumerator.network is network, "enumerator was created for a different network"
+                num_workers = enumerator.num_workers
+                shared = enumerator.start_job(spec, start)
+            else:
+                # replays are single-threaded so that they are deterministic
+                num_workers = 1 if Settings.NUM_PROCESSES < 1 or replay is not None else Settings.NUM_PROCESSES
+                shared = SharedState(network, spec, num_workers, start, sync=make_sync(num_workers))
+
+            shared.checkpoint_info = checkpoint_info
+            shared.stop_flag = stop_flag
+            shared.replay = replay
+
+            if resume is None:
+                shared.push_init(init_ss)
+            else:
+                ss_list, stats, manifest = resume
+                shared.push_checkpoint(ss_list, stats, manifest['checkpoint_id'])
 
             if shared.result.result_str != 'safe': # easy specs can be proven safe in push_init()
                 Timers.tic('run workers')
+                exporter = start_metrics(shared)
 
-                if num_workers == 1:
+                if pooled:
+                    if Settings.PRINT_OUTPUT:
+                        print(f"Running in parallel with {num_workers} pooled {worker_kind()}")
+
+                    enumerator.run_job()
+                elif num_workers == 1:
                     if Settings.PRINT_OUTPUT:
                         print("Running single-threaded")
 
@@ -162,24 +214,36 @@ def enumerate_network(init, network, spec=None):
                     processes = []
 
                     if Settings.PRINT_OUTPUT:
-                        print(f"Running in parallel with {num_workers} processes")
+                        print(f"Running in parallel with {num_workers} {worker_kind()}")
 
-                    for index in range(Settings.NUM_PROCESSES):
-                        p = multiprocessing.Process(target=worker_func, args=(index, shared))
+                    for index in range(num_workers):
+                        p = make_worker(worker_func, (index, shared))
                         p.start()
                         processes.append(p)
 
                     for p in processes:
                         p.join()
 
+                if exporter is not None:
+                    exporter.stop()
+
                 Timers.toc('run workers')
 
+                if Settings.REPLAY_RECORD is not None:
+                    merge_record(Settings.REPLAY_RECORD, num_workers, init, spec)
+
             assert shared.more_work_queue.empty()
 
             rv = shared.result
             rv.total_secs = time.perf_counter() - start
             process_result(shared)
 
+            if Settings.TRACE_FILE is not None:
+                write_trace(Settings.TRACE_FILE, num_workers, rv.worker_timer_trees)
+
+            if checkpoint_info is not None and rv.result_str != 'timeout':
+                # the checkpoint is no longer needed
+                clear_checkpoint(Settings.CHECKPOINT_DIR, checkpoint_info[0])
             
 
     if rv.total_secs is None:
@@ -192,6 +256,95 @@ def enumerate_network(init, network, spec=None):
 
     return rv
 
+def enable_hot_timers():
+    'reset the hot timers, and enable them if Settings.HOT_TIMERS is set'
+
+    HotTimers.reset()
+
+    # like the Timers, hot timers are per process and can't be used with worker threads
+    HotTimers.enabled = Settings.HOT_TIMERS and Settings.WORKER_BACKEND != Settings.BACKEND_THREADS
+
+def make_sync(num_workers):
+    '''get the factory for SharedState\'s shared objects for Settings.WORKER_BACKEND (None = the default)
+
+    num_workers is the number of workers that will use the shared objects
+    '''
+
+    rv = None
+
+    if Settings.WORKER_BACKEND == Settings.BACKEND_THREADS:
+        check_lp_solver_threads(num_workers)
+        rv = ThreadSync()
+
+    return rv
+
+def check_lp_solver_threads(num_workers):
+    '''warn if the lps of num_workers worker threads can't run at the same time
+
+    glpk builds without thread local storage share one environment and memory allocator between all threads (see
+    lpinstance_glpk.glpk_thread_safe()), so all glpk calls hold the GIL and the lps run one at a time
+    '''
+
+    # LpInstance is the backend that Settings.LP_SOLVER selected when nnenum.lp_star was imported
+    if num_workers > 1 and LpInstance.__module__ == 'nnenum.lpinstance_glpk' and Settings.PRINT_OUTPUT:
+        from nnenum.lpinstance_glpk import glpk_thread_safe
+
+        if not glpk_thread_safe():
+            print("Warning: glpk was built without thread local storage, so LPs in worker threads run one at a " +
+                  "time (use worker processes, or Settings.LP_SOLVER = 'HiGHS')")
+
+def make_worker(target, args):
+    'create (but don\'t start) a worker process, or a worker thread with Settings.BACKEND_THREADS'
+
+    if Settings.WORKER_BACKEND == Settings.BACKEND_THREADS:
+        rv = threading.Thread(target=target, args=args, daemon=True)
+    else:
+        rv = multiprocessing.Process(target=target, args=args)
+
+    return rv
+
+def worker_kind():
+    'get the name of the workers for printing ("processes" or "threads")'
+
+    return "threads" if Settings.WORKER_BACKEND == Settings.BACKEND_THREADS else "processes"
+
+def get_checkpoint_info(init, spec):
+    '''get the checkpoint information for an enumeration, if Settings.CHECKPOINT_DIR is set
+
+    returns a pair (checkpoint_info, resume). checkpoint_info is None (no checkpoints) or a tuple (key, prior_secs).
+    resume is None or the (ss_list, stats, manifest) tuple of the loaded checkpoint if Settings.CHECKPOINT_RESUME
+    is set and the checkpoint is for the same problem.
+    '''
+
+    checkpoint_info = None
+    resume = None
+
+    if Settings.CHECKPOINT_DIR is not None:
+        if isinstance(init, (list, tuple, np.ndarray)):
+            os.makedirs(Settings.CHECKPOINT_DIR, exist_ok=True)
+            key = make_key(init, spec)
+
+            if Settings.CHECKPOINT_RESUME:
+                resume = load_checkpoint(Settings.CHECKPOINT_DIR, key)
+
+            if resume is None:
+                prior_secs = 0
+            else:
+                manifest = resume[2]
+                prior_secs = manifest['total_secs']
+
+                if Settings.PRINT_OUTPUT:
+                    frac = manifest['stats']['finished_work_frac']
+                    print(f"Resuming from checkpoint {manifest['checkpoint_id']} in {Settings.CHECKPOINT_DIR} " + \
+                          f"with {manifest['num_stars']} stars ({round(100 * frac, 3)}% finished " + \
+                          f"in {to_time_str(prior_secs)})")
+
+            checkpoint_info = (key, prior_secs)
+        elif Settings.PRINT_OUTPUT:
+            print("Warning: checkpoints are only supported when init is a box; not saving checkpoints")
+
+    return checkpoint_info, resume
+
 def process_result(shared):
     'process a verification result'
 
@@ -213,9 +366,33 @@ def process_result(shared):
     # save num lps enum to result
     shared.result.total_lps_enum = shared.num_lps_enum.value
 
+    # save simplex stats to result
+    shared.result.total_simplex_calls = shared.simplex_calls.value
+    shared.result.total_simplex_iterations = int(shared.simplex_iterations.value)
+    shared.result.inherited_basis_calls = shared.inherited_basis_calls.value
+    shared.result.inherited_basis_iterations = int(shared.inherited_basis_iterations.value)
+
     # save num stars to result
     shared.result.total_stars = shared.finished_stars.value
 
+    # save offload transfer stats to result (the parent process may have packed the initial star)
+    parent_stats = shared.transfer_stats
+    shared.result.total_offload_count = shared.offload_count.value + parent_stats.num_sent
+    shared.result.total_offload_bytes = int(shared.offload_bytes.value) + parent_stats.bytes_sent
+    shared.result.total_offload_secs = shared.offload_secs.value + parent_stats.send_secs + \
+        parent_stats.receive_secs
+
+    # save work stealing stats to result
+    shared.result.total_steals = shared.steal_count.value
+    shared.result.total_steal_refusals = shared.steal_refusals.value
+    shared.result.total_steal_secs = shared.steal_secs.value
+    shared.result.worker_idle_secs = list(shared.idle_secs)
+
+    # save frontier spill stats to result
+    shared.result.total_spilled_stars = shared.spill_count.value
+    shared.result.total_spill_bytes = int(shared.spill_bytes.value)
+    shared.result.total_spill_secs = shared.spill_secs.value
+
     # save progress to result
     shared.result.progress_tuple = (shared.finished_stars.value,
                                     shared.unfinished_stars.value,
@@ -233,11 +410,47 @@ def process_result(shared):
             print(f"Runtime: {to_time_str(shared.result.total_secs)}{suffix}")
             print(f"Completed work frac: {shared.finished_work_frac.value}")
             print(f"Num Stars Copied Between Processes: {shared.num_offloaded.value}")
+
+            if shared.result.total_offload_count > 0:
+                count = shared.result.total_offload_count
+                mb = shared.result.total_offload_bytes / 1024 / 1024
+                ms = 1000 * shared.result.total_offload_secs
+
+                print(f"Offload Transfers: {round(mb, 3)} MB in {round(ms, 3)} ms " + \
+                      f"(per star: {round(mb / count, 3)} MB, {round(ms / count, 3)} ms)")
+
+            requests = shared.result.total_steals + shared.result.total_steal_refusals
+
+            if requests > 0:
+                ms = 1000 * shared.result.total_steal_secs
+                idle = ", ".join(f"{round(secs, 2)}" for secs in shared.result.worker_idle_secs)
+
+                print(f"Work Steals: {shared.result.total_steals} of {requests} requests " + \
+                      f"(mean latency {round(ms / requests, 3)} ms); Idle Secs per Worker: [{idle}]")
+
+            if shared.result.total_spilled_stars > 0:
+                mb = shared.result.total_spill_bytes / 1024 / 1024
+                secs = shared.result.total_spill_secs
+
+                print(f"Frontier Spills: {shared.result.total_spilled_stars} stars, {round(mb, 3)} MB written to " + \
+                      f"disk ({round(secs, 3)} sec writing and reading)")
+
             print(f"Num Lps During Enumeration: {shared.num_lps_enum.value}")
             #count = shared.incorrect_overapprox_count.value
             #t = round(shared.incorrect_overapprox_time.value, 3)
             #print(f"Incorrect Overapproximation Time: {round(t/1000, 1)} sec (count: {count})")
             print(f"Total Num Lps: {shared.num_lps.value}")
+
+            if shared.result.total_simplex_calls > 0:
+                calls = shared.result.total_simplex_calls
+                its = shared.result.total_simplex_iterations
+                inherited_calls = shared.result.inherited_basis_calls
+                inherited_its = shared.result.inherited_basis_iterations
+                inherited_avg = round(inherited_its / max(1, inherited_calls), 2)
+
+                print(f"Simplex Iterations: {its} in {calls} calls ({round(its / calls, 2)} per call); " + \
+                      f"from an inherited basis: {inherited_its} in {inherited_calls} calls ({inherited_avg} per call)")
+
             print("")
 
             if shared.had_timeout.value == 1:
@@ -282,72 +495,176 @@ def process_result(shared):
     for timer_name, count, secs in zip(Settings.RESULT_SAVE_TIMERS, shared.timer_counts, shared.timer_secs):
         shared.result.timers[timer_name] = (count, secs)
 
+    # workers add (worker_index, tree) pairs in the order they finish
+    trees = sorted(shared.result.worker_timer_trees, key=lambda pair: pair[0])
+    shared.result.worker_timer_trees = [tree for _, tree in trees]
+    shared.result.timer_tree = merge_timer_dicts(shared.result.worker_timer_trees)
+
+    stats = sorted(shared.result.worker_hot_timers, key=lambda pair: pair[0])
+    shared.result.worker_hot_timers = [s for _, s in stats]
+    shared.result.hot_timers = merge_hot_timer_stats(shared.result.worker_hot_timers)
+
 class SharedState(Freezable):
     'shared computation state across processes'
 
-    def __init__(self, network, spec, num_workers, start_time):
+    def __init__(self, network, spec, num_workers, start_time, sync=None):
+        '''sync is the factory used to create the shared objects
+
+        The default, a syncutil.ProcessSync, creates multiprocessing objects for workers on this host.
+        '''
+
         assert isinstance(network, NeuralNetwork)
+
+        if sync is None:
+            sync = ProcessSync()
         
         # process-local copies
         self.network = network
         self.spec = spec
         self.num_workers = num_workers
-        self.multithreaded = num_workers > 1
+        self.sync = sync
+
+        # stars cross process boundaries (and need to be serialized) if there are several workers or remote workers.
+        # Worker threads (Settings.BACKEND_THREADS) also serialize them, since lps are confined to the thread that
+        # created them, but skip the pickling.
+        self.multithreaded = num_workers > 1 or not sync.same_host
 
         self.start_time = start_time
 
         # master -> worker
         # this lock should be used whenever modifying shared variables or consistency is needed,
         # except for the more_work_queue since that manages its own locks
-        self.mutex = multiprocessing.Lock()
+        self.mutex = sync.Lock()
         
         if self.multithreaded:
-            self.more_work_queue = multiprocessing.Queue()
+            self.more_work_queue = sync.Queue()
         else:
             self.more_work_queue = FakeQueue() # use deque for single-threaded, faster
 
-        # queue size is unreliable since multithreaded, use this instead
-        self.stars_in_progress = multiprocessing.Value('i', 0)
-
-        # used for load balancing
-        self.heap_sizes = multiprocessing.Array('i', num_workers)
-
-        # statistics worker -> master
-        self.num_lps = multiprocessing.Value('i', 0)
-        self.num_lps_enum = multiprocessing.Value('i', 0)
-        self.num_offloaded = multiprocessing.Value('i', 0)
-        self.finished_stars = multiprocessing.Value('i', 0)
-        self.unfinished_stars = multiprocessing.Value('i', 0)
+        # queue size is unreliable since multithreaded, use these instead, see count_stars_in_progress()
+        self.stars_created = ShardedCounter(sync, 'i', num_workers) # initial stars plus stars created by splits
+        self.stars_done = ShardedCounter(sync, 'i', num_workers) # stars finished or dropped
+
+        # work stealing, see Worker.steal() and Worker.answer_steal_request()
+        self.idle_workers = sync.Array('i', num_workers) # 1 if the worker has no work, only written by that worker
+        self.steal_requests = sync.Array('i', num_workers) # index + 1 of the worker stealing from each worker, or 0
+
+        # replies to steal requests, one queue per worker: a star, or None if the victim had no work to give
+        self.steal_inboxes = [sync.Queue() for _ in range(num_workers)] if self.multithreaded else None
+
+        # statistics worker -> master, each worker adds to its own slot without the mutex
+        self.num_lps = ShardedCounter(sync, 'i', num_workers)
+        self.num_lps_enum = ShardedCounter(sync, 'i', num_workers)
+        self.simplex_calls = ShardedCounter(sync, 'i', num_workers) # see lputil.SimplexStats
+        self.simplex_iterations = ShardedCounter(sync, 'd', num_workers)
+        self.inherited_basis_calls = ShardedCounter(sync, 'i', num_workers)
+        self.inherited_basis_iterations = ShardedCounter(sync, 'd', num_workers)
+        self.num_offloaded = ShardedCounter(sync, 'i', num_workers)
+        self.offload_count = ShardedCounter(sync, 'i', num_workers)
+        self.offload_bytes = ShardedCounter(sync, 'd', num_workers)
+        self.offload_secs = ShardedCounter(sync, 'd', num_workers)
+        self.steal_count = ShardedCounter(sync, 'i', num_workers)
+        self.steal_refusals = ShardedCounter(sync, 'i', num_workers)
+        self.steal_secs = ShardedCounter(sync, 'd', num_workers) # total seconds from steal requests to their replies
+        self.idle_secs = sync.Array('d', num_workers, lock=False) # seconds each worker spent without work
+        self.spill_count = ShardedCounter(sync, 'i', num_workers) # see frontier.SpillFrontier
+        self.spill_bytes = ShardedCounter(sync, 'd', num_workers)
+        self.spill_secs = ShardedCounter(sync, 'd', num_workers)
+        self.finished_stars = ShardedCounter(sync, 'i', num_workers)
+        self.unfinished_stars = ShardedCounter(sync, 'i', num_workers)
         
-        self.finished_approx_stars = multiprocessing.Value('i', 0)
-        self.finished_work_frac = multiprocessing.Value('f', 0) 
-        self.incorrect_overapprox_count = multiprocessing.Value('i', 0)
-        self.incorrect_overapprox_time = multiprocessing.Value('f', 0)
+        self.finished_approx_stars = ShardedCounter(sync, 'i', num_workers)
+        self.finished_work_frac = ShardedCounter(sync, 'd', num_workers)
+        self.incorrect_overapprox_count = ShardedCounter(sync, 'i', num_workers)
+        self.incorrect_overapprox_time = ShardedCounter(sync, 'd', num_workers)
+        self.tree_size = TreeSizeStats(sync, num_workers, network) # per-depth counts for progress estimates
+
+        # one row per worker, written by that worker if live metrics are enabled, see metrics.py
+        self.live_metrics = sync.Array('d', num_workers * len(METRIC_NAMES), lock=False)
 
         num_timers = len(Settings.RESULT_SAVE_TIMERS)
-        self.timer_secs = multiprocessing.Array('f', num_timers) # seconds, in same order as timers in Settings
-        self.timer_counts = multiprocessing.Array('i', num_timers)
+        self.timer_secs = sync.Array('f', num_timers) # seconds, in same order as timers in Settings
+        self.timer_counts = sync.Array('i', num_timers)
 
-        self.cur_layers = multiprocessing.Array('i', num_workers)
-        self.cur_neurons = multiprocessing.Array('i', num_workers)
+        self.cur_layers = sync.Array('i', num_workers)
+        self.cur_neurons = sync.Array('i', num_workers)
 
         # status update if worker 0 finishes initial overapprox
-        self.finished_initial_overapprox = multiprocessing.Value('i', 0)
+        self.finished_initial_overapprox = sync.Value('i', 0)
+
+        # checkpoint barrier, see Worker.save_checkpoint()
+        self.checkpoint_requested = sync.Value('i', 0) # set by worker 0 to start a checkpoint
+        self.checkpoint_id = sync.Value('i', 0) # id of the latest checkpoint
+        self.checkpoint_done = sync.Value('i', 0) # id of the latest checkpoint saved (or abandoned) by worker 0
+        self.checkpoint_saved = sync.Array('i', num_workers) # id of the latest checkpoint saved by each worker
+        self.checkpoint_counts = sync.Array('i', num_workers) # number of stars each worker saved in it
+        self.final_checkpoint = sync.Value('i', 0) # save checkpoint after main loop? 0 = undecided, 1 = yes, 2 = no
 
         # set if an exception occurs so everyone exits
-        self.had_exception = multiprocessing.Value('i', 0)
+        self.had_exception = sync.Value('i', 0)
 
         # set if a timeout occured so everyone exits
-        self.had_timeout = multiprocessing.Value('i', 0)
+        self.had_timeout = sync.Value('i', 0)
 
         # general flag if we should exit
-        self.should_exit = multiprocessing.Value('i', 0)
+        self.should_exit = sync.Value('i', 0)
 
         # result data
-        self.result = Result(network)
+        self.result = Result(network, sync=sync)
+
+        # the result with the original shared-memory fields, since process_result() replaces them in self.result
+        self.result_template = self.result
+
+        # used by Enumerator to send jobs (or None to quit) to long-lived worker processes, and get notified when
+        # workers finish a job
+        self.job_queues = None
+        self.done_queue = None
+
+        # None (no checkpoints) or (key, prior_secs), see get_checkpoint_info(); set for each job
+        self.checkpoint_info = None
+
+        # None or a shared value that stops the enumeration when nonzero, see enumerate_network()
+        self.stop_flag = None
+
+        # None or the replay.ReplayLog being replayed (process-local, replays are single-threaded)
+        self.replay = None
+
+        # process-local transfer measurements, added to offload_bytes / offload_secs by each worker at the end
+        self.transfer_stats = TransferStats()
 
         self.freeze_attrs()
 
+    def reset_for_job(self, spec, start_time):
+        '''reset all shared variables so that the same worker processes can run another enumeration
+
+        call with no workers running
+        '''
+
+        assert self.more_work_queue.empty()
+
+        self.spec = spec
+        self.start_time = start_time
+
+        # zeros the shared values and arrays, including the ones in the result
+        self.sync.reset()
+
+        # drop replies to steal requests that were left by a job that ended with an exception
+        if self.steal_inboxes is not None:
+            for i in range(self.num_workers):
+                while self.get_steal_reply(i, timeout=0, skip_deserialize=True)[0]:
+                    pass
+
+        # process_result() modifies the result's fields, so give it a copy
+        self.result = copy.copy(self.result_template)
+
+        self.transfer_stats.reset()
+
+    def make_job_queues(self):
+        'create job_queues and done_queue, used by long-lived worker processes'
+
+        self.job_queues = [self.sync.Queue() for _ in range(self.num_workers)]
+        self.done_queue = self.sync.Queue()
+
     def push_init(self, ss):
         'put the initial init box or star onto the work queue'
 
@@ -358,38 +675,116 @@ class SharedState(Freezable):
         ##############################
         self.mutex.acquire()
         self.put_queue(ss)
-        self.stars_in_progress.value = 1
+        self.stars_created.value = 1
+        self.tree_size.set_roots([len(ss.branch_tuples)])
         self.mutex.release()
         ##############################
 
         Timers.toc('push_init')
 
+    def push_checkpoint(self, ss_list, stats, checkpoint_id):
+        '''put the stars of a loaded checkpoint onto the work queue, and restore its statistics
+
+        new checkpoint ids start after checkpoint_id, so the loaded checkpoint's files are not overwritten
+        '''
+
+        Timers.tic('push_checkpoint')
+
+        ##############################
+        self.mutex.acquire()
+
+        for ss in ss_list:
+            self.put_queue(ss)
+
+        self.stars_created.value = len(ss_list)
+        self.tree_size.set_roots([len(ss.branch_tuples) for ss in ss_list])
+
+        for name, val in stats.items():
+            getattr(self, name).value = val
+
+        self.checkpoint_id.value = checkpoint_id
+
+        # the initial overapprox was done by the run that saved the checkpoint
+        self.finished_initial_overapprox.value = 1
+
+        self.mutex.release()
+        ##############################
+
+        Timers.toc('push_checkpoint')
+
+    def flush_counters(self, worker_index):
+        '''add a worker's pending additions to all the ShardedCounters (see ShardedCounter.flush())
+
+        stars_created is flushed first, so that a star is never counted as done before it's counted as created
+        '''
+
+        self.stars_created.flush(worker_index)
+
+        for val in self.__dict__.values():
+            if isinstance(val, ShardedCounter):
+                val.flush(worker_index)
+
+    def count_stars_in_progress(self):
+        '''get the number of stars that are not done, without the mutex
+
+        A star is always counted as created before it is counted as done (see Worker.flush_stats()), and the done
+        counts are summed first, so the result is never less than the true count at the time of the call. A result of
+        zero therefore means the enumeration finished.
+        '''
+
+        done = self.stars_done.value
+
+        return self.stars_created.value - done
+
+    def pack_star(self, ss):
+        'prepare a starstate to be put on a queue read by other processes'
+
+        if self.multithreaded:
+            if not isinstance(ss, StarRecipe):
+                ss.star.lpi.serialize()
+            elif self.sync.same_address_space:
+                # recipes are pickled when crossing processes, but a thread needs its own copy of the snapshot
+                ss.snapshot = ss.snapshot.detached()
+
+            if Settings.SHM_TRANSFER and self.sync.same_host and not self.sync.same_address_space:
+                ss = timed_pack(ss, self.transfer_stats)
+
+        return ss
+
+    def unpack_star(self, item, skip_deserialize=False):
+        'get the starstate from an object created with pack_star()'
+
+        if isinstance(item, StarDescriptor):
+            if skip_deserialize:
+                item.discard()
+            else:
+                item = timed_unpack(item, self.transfer_stats)
+
+        if self.multithreaded and not skip_deserialize and not isinstance(item, StarRecipe):
+            item.star.lpi.deserialize()
+
+        return item
+
     def put_queue(self, ss):
         'put a starstate on the queue'
 
         Timers.tic('put_queue')
 
-        if self.multithreaded:
-            ss.star.lpi.serialize()
-
-        self.more_work_queue.put(ss)
+        self.more_work_queue.put(self.pack_star(ss))
 
         Timers.toc('put_queue')    
 
     def get_global_queue(self, block=True, timeout=None, skip_deserialize=False):
         '''pop a starstate from the global queue
 
-        returns None on timeout
+        returns None on timeout. If skip_deserialize is True, the returned object should only be counted; its shared
+        memory (if any) has already been released.
         '''
 
         Timers.tic('get_global_queue')
 
         try:
-            rv = self.more_work_queue.get(block=block, timeout=timeout)
-
-            if self.multithreaded and not skip_deserialize:
-                rv.star.lpi.deserialize()
-
+            rv = self.unpack_star(self.more_work_queue.get(block=block, timeout=timeout), skip_deserialize)
         except queue.Empty:
             rv = None
 
@@ -397,6 +792,177 @@ class SharedState(Freezable):
 
         return rv
 
+    def send_steal_reply(self, thief_index, ss):
+        'reply to a steal request with a starstate, or None if there is no work to give'
+
+        Timers.tic('send_steal_reply')
+
+        self.steal_inboxes[thief_index].put(None if ss is None else self.pack_star(ss))
+
+        Timers.toc('send_steal_reply')
+
+    def get_steal_reply(self, thief_index, timeout, skip_deserialize=False):
+        '''get the reply to a steal request
+
+        returns a pair (got_reply, ss), where ss is None if the victim had no work to give
+        '''
+
+        Timers.tic('get_steal_reply')
+
+        try:
+            item = self.steal_inboxes[thief_index].get(timeout=timeout)
+            rv = True, (None if item is None else self.unpack_star(item, skip_deserialize))
+        except queue.Empty:
+            rv = False, None
+
+        Timers.toc('get_steal_reply')
+
+        return rv
+
+class Enumerator(Freezable):
+    '''long-lived pool of worker processes for a single network
+
+    The worker processes are started on the first enumeration that needs them and are reused for later calls to
+    enumerate(), so that verifying many init sets (for example, a vnnlib file with many disjunctive input boxes)
+    does not pay process startup and shared-state setup for each one.
+
+    Settings are copied to the workers at the start of each job. Use as a context manager, or call close().
+    With Settings.BACKEND_THREADS (when the workers are started), the pool uses threads instead of processes.
+    '''
+
+    def __init__(self, network, num_workers=None):
+        assert isinstance(network, NeuralNetwork)
+
+        if num_workers is None:
+            num_workers = Settings.NUM_PROCESSES
+
+        self.network = network
+        self.num_workers = max(1, num_workers)
+
+        self.shared = None
+        self.processes = []
+
+        self.freeze_attrs()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_args):
+        self.close()
+
+    def enumerate(self, init, spec=None):
+        'enumerate_network() using the pooled workers, returns a Result'
+
+        return enumerate_network(init, self.network, spec, enumerator=self)
+
+    def uses_pool(self):
+        'should enumerate_network() run jobs on the pooled workers? (otherwise it runs single-threaded)'
+
+        return self.num_workers > 1
+
+    def estimate_tree_size(self):
+        '''estimate the size and remaining time of the running job (may be called from another thread)
+
+        returns a treesize.TreeSizeEstimate, or None before the first pooled job or if no star has finished yet
+        '''
+
+        shared = self.shared
+        rv = None
+
+        if shared is not None:
+            elapsed = time.perf_counter() - shared.start_time
+            rv = shared.tree_size.estimate(elapsed, shared.finished_stars.value)
+
+        return rv
+
+    def start_job(self, spec, start_time):
+        '''get a reset SharedState for a new enumeration, starting the worker processes if needed
+
+        returns the SharedState
+        '''
+
+        Timers.tic('start_job')
+
+        if self.shared is None:
+            sync = make_sync(self.num_workers)
+            self.shared = SharedState(self.network, spec, self.num_workers, start_time, sync=sync)
+            self.shared.make_job_queues()
+
+            for index in range(self.num_workers):
+                p = make_worker(pool_worker_func, (index, self.shared))
+                p.start()
+                self.processes.append(p)
+
+        assert len(self.shared.timer_secs) == len(Settings.RESULT_SAVE_TIMERS), \
+            "Settings.RESULT_SAVE_TIMERS cannot change while using an Enumerator"
+
+        self.shared.reset_for_job(spec, start_time)
+
+        Timers.toc('start_job')
+
+        return self.shared
+
+    def run_job(self):
+        'run the pooled workers on the current job and wait for them to finish'
+
+        shared = self.shared
+
+        # send the elapsed time rather than start_time, since perf_counter() is not comparable across hosts
+        elapsed = time.perf_counter() - shared.start_time
+        job = (shared.spec, elapsed, self.job_settings(), shared.checkpoint_info)
+
+        for job_queue in shared.job_queues:
+            job_queue.put(job)
+
+        num_done = 0
+
+        while num_done < self.num_workers:
+            try:
+                shared.done_queue.get(timeout=1.0)
+                num_done += 1
+            except queue.Empty:
+                if not self.check_workers():
+                    # drop remaining work so the result is reported as an error
+                    while shared.get_global_queue(block=False, skip_deserialize=True) is not None:
+                        pass
+
+                    break
+
+    def job_settings(self):
+        'get the Settings values sent to the workers with each job'
+
+        return Settings.snapshot()
+
+    def check_workers(self):
+        '''check that the worker processes are still running, stopping the pool if any have failed
+
+        returns True if all workers are running
+        '''
+
+        rv = all(p.is_alive() for p in self.processes)
+
+        if not rv:
+            print("Error: an Enumerator worker process exited unexpectedly")
+            self.shared.had_exception.value = 1
+            self.processes = [p for p in self.processes if p.is_alive()]
+            self.close()
+
+        return rv
+
+    def close(self):
+        'stop the worker processes'
+
+        if self.shared is not None:
+            for p, job_queue in zip(self.processes, self.shared.job_queues):
+                if p.is_alive():
+                    job_queue.put(None)
+
+            for p in self.processes:
+                p.join()
+
+            self.processes = []
+            self.shared = None
+
 class PrivateState(Freezable):
     'private state for work processes'
 
@@ -405,9 +971,8 @@ class PrivateState(Freezable):
 
         # ss is the current StarState being computed
         self.ss = None # pylint: disable=invalid-name
-        #self.work_list = [] # list of tuples: (layer, neuron, id(ss), ss)
-
-        self.work_list = []
+        self.work_list = make_frontier() # pending stars, see frontier.py
+        self.snapshot_cache = SnapshotCache(Settings.COMPACT_FRONTIER_CACHE_SIZE) # used to rebuild StarRecipes
 
         self.branch_tuples_list = None # for saving of branch strs to file
 
@@ -426,26 +991,43 @@ class PrivateState(Freezable):
         self.num_lps_enum = 0
         self.incorrect_overapprox_count = 0
         self.incorrect_overapprox_time = 0
+        self.overapprox_tries = 0
 
         self.stars_in_progress = 0
 
+        # live metrics, see Worker.publish_metrics() (None = disabled)
+        self.next_metrics_time = 0 if metrics_enabled() else None
+
         if Settings.SHUFFLE_TIME is not None:
             self.next_shuffle_step = Settings.SHUFFLE_TIME
             self.next_shuffle_time = time.time() + self.next_shuffle_step
 
         # shared variable timing updates
         self.next_shared_var_update = time.time() + Settings.UPDATE_SHARED_VARS_INTERVAL
+
+        # checkpoint timing (worker 0 starts checkpoints, all workers poll for them)
+        self.next_checkpoint_time = time.perf_counter() + Settings.CHECKPOINT_INTERVAL
+        self.next_checkpoint_check = 0
         self.shared_update_urgent = False # used when work is popped to make sure we update heap sizes
 
-        # fullfullment time stats
-        self.fulfillment_requested_time = None
-        self.total_fulfillment_time = 0
-        self.total_fulfillment_count = 0
+        # work stealing: outstanding request (victim index and perf_counter time), idle time and steal stats
+        self.steal_victim = None
+        self.steal_request_time = None
+        self.idle_start_time = None
+        self.idle_secs = 0
+        self.steal_count = 0
+        self.steal_refusals = 0
+        self.steal_secs = 0
 
         # for updating shared stats
         self.update_stars = 0
         self.update_work_frac = 0.0
         self.update_stars_in_progress = 0
+        self.update_splits = {} # depth -> count, see treesize.TreeSizeStats
+        self.update_leaves = {}
+
+        # replay.ReplayRecorder if Settings.REPLAY_RECORD is set, created by worker_func()
+        self.recorder = None
 
         # stats recorded by worker 0
         self.start_time = time.time()
@@ -463,28 +1045,77 @@ class PrivateState(Freezable):
 
         self.freeze_attrs()
 
-def worker_func(worker_index, shared):
-    'worker function during verification'
+def pool_worker_func(worker_index, shared):
+    'main function of an Enumerator worker process: run worker_func once per job until None is received'
+
+    job_queue = shared.job_queues[worker_index]
+
+    while True:
+        job = job_queue.get()
+
+        if job is None:
+            break
+
+        spec, elapsed, settings, checkpoint_info = job
+        Settings.restore(settings)
+
+        shared.spec = spec
+        shared.checkpoint_info = checkpoint_info
+        shared.start_time = time.perf_counter() - elapsed
+
+        Timers.reset()
+
+        if Settings.TIMING_STATS:
+            Timers.enable()
+        else:
+            Timers.disable()
+
+        enable_hot_timers()
+        worker_func(worker_index, shared, keep_lp_pool=True)
+
+        shared.done_queue.put(worker_index)
+
+    close_lp_pool()
+
+def worker_func(worker_index, shared, keep_lp_pool=False):
+    '''worker function during verification
+
+    the persistent lp pool of the worker (see lputil.get_lp_pool()) is stopped at the end, unless keep_lp_pool is True
+    (used by pool_worker_func() to keep it between jobs)
+    '''
 
     np.seterr(all='raise', under=Settings.UNDERFLOW_BEHAVIOR) # raise exceptions on floating-point errors
 
     if shared.multithreaded:
         Timers.stack.clear() # reset inherited Timers
+        HotTimers.reset()
+        SIMPLEX_STATS.reset() # counts are per thread, so this only resets this worker's counts
+        shared.transfer_stats.reset() # don't count transfers made by the parent process
         tag = f" (Process {worker_index})"
     else:
         tag = ""
 
     timer_name = f'worker_func{tag}'
 
+    start_recording()
     Timers.tic(timer_name)
     
     priv = PrivateState(worker_index)
     priv.start_time = shared.start_time
     w = Worker(shared, priv)
 
+    if Settings.REPLAY_RECORD is not None:
+        priv.recorder = ReplayRecorder(worker_index)
+
     try:
         w.main_loop()
 
+        if priv.recorder is not None:
+            priv.recorder.save(Settings.REPLAY_RECORD)
+
+        if shared.replay is not None and Settings.PRINT_OUTPUT:
+            shared.replay.print_summary()
+
         if worker_index == 0 and Settings.PRINT_OUTPUT:
             print("\n")
 
@@ -527,6 +1158,16 @@ def worker_func(worker_index, shared):
 
         Timers.toc(timer_name)
 
+        if Settings.TIMING_STATS:
+            worker_timer = Timers.top_level_timer.get_children_recursive(timer_name)[0]
+            shared.result.worker_timer_trees.append((worker_index, worker_timer.to_dict('worker_func')))
+
+        if HotTimers.enabled:
+            shared.result.worker_hot_timers.append((worker_index, HotTimers.get_stats()))
+
+        if Settings.TRACE_FILE is not None:
+            save_part(Settings.TRACE_FILE, worker_index, shared.start_time)
+
         if shared.multithreaded and not shared.had_exception.value:
             if worker_index != 0 and Settings.PRINT_OUTPUT and Settings.TIMING_STATS:
                 time.sleep(0.2) # delay to try to let worker 0 print timing stats first
@@ -551,10 +1192,7 @@ def worker_func(worker_index, shared):
                 sum_percent = exact_percent + over_percent
 
                 if Settings.PRINT_OUTPUT:
-                    if w.priv.total_fulfillment_count > 0:
-                        t = w.priv.total_fulfillment_time
-                    else:
-                        t = 0
+                    t = w.priv.idle_secs
 
                     e_stars = w.priv.finished_stars
                     a_stars = w.priv.finished_approx_stars
@@ -562,7 +1200,7 @@ def worker_func(worker_index, shared):
                     print(f"Worker {worker_index}: {tot_stars} stars ({e_stars} exact, {a_stars} approx); " + \
                           f"Working: {round(sum_percent, 1)}% (Exact: {round(exact_percent, 1)}%, " + \
                           f"Overapprox: {round(over_percent, 1)}%); " + \
-                          f"Waiting: {round(1000*t, 3)}ms ")
+                          f"Idle: {round(1000*t, 3)}ms ")
             shared.mutex.release()
             ##############################
 
@@ -596,4 +1234,8 @@ def worker_func(worker_index, shared):
             Timers.toc(Timers.stack[-1].name)
 
         Timers.toc(timer_name)
+        Timers.stop_recording() # no trace part is saved for this worker
+    finally:
+        if not keep_lp_pool:
+            close_lp_pool()
 
@@ -0,0 +1,393 @@
+'''
+Frontier of pending stars in each worker (PrivateState.work_list)
+
+The order in which stars are explored is selected with Settings.FRONTIER_ORDER: depth-first (the original stack),
+breadth-first, or best-first using a heap keyed by Settings.FRONTIER_PRIORITY.
+
+With Settings.COMPACT_FRONTIER, the frontier holds lp_star_state.StarRecipe objects for stars created by splits, which
+the worker rebuilds after popping them. With Settings.MAX_FRONTIER_MEMORY, stars beyond the budget are spilled to disk
+(see SpillFrontier).
+
+Stanley Bak
+'''
+
+import heapq
+import math
+import pickle
+import random
+import tempfile
+import time
+from collections import deque
+
+from nnenum.util import Freezable
+from nnenum.settings import Settings
+from nnenum.timerutil import Timers
+from nnenum.lp_star_state import StarRecipe
+
+class DequeFrontier(Freezable):
+    '''depth-first (stack) or breadth-first (fifo) frontier
+
+    stars are pushed on the right. The left end is always the star closest to the root of the search.
+    '''
+
+    def __init__(self, lifo=True):
+        self.lifo = lifo
+        self.items = deque()
+
+        self.freeze_attrs()
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def push(self, ss):
+        'add a star'
+
+        self.items.append(ss)
+
+    def extend(self, ss_list):
+        'add several stars'
+
+        self.items.extend(ss_list)
+
+    def peek(self):
+        'get the star that pop() will return next'
+
+        return self.items[-1] if self.lifo else self.items[0]
+
+    def pop(self):
+        'remove and return the next star to explore'
+
+        return self.items.pop() if self.lifo else self.items.popleft()
+
+    def peek_heaviest(self):
+        'get the star that pop_heaviest() will return next'
+
+        return self.items[0]
+
+    def pop_heaviest(self):
+        'remove and return the star with the most work (closest to the root), used when offloading work'
+
+        return self.items.popleft()
+
+    def pop_coldest(self, count):
+        'remove and return a list of the count stars that would be popped last, the last one first'
+
+        pop_func = self.items.popleft if self.lifo else self.items.pop
+
+        return [pop_func() for _ in range(min(count, len(self.items)))]
+
+    def push_cold(self, ss):
+        'add a star that will be popped after all the others (undoes pop_coldest)'
+
+        if self.lifo:
+            self.items.appendleft(ss)
+        else:
+            self.items.append(ss)
+
+    def shuffle(self):
+        'randomize the order of the stars'
+
+        items = list(self.items)
+        random.shuffle(items)
+        self.items = deque(items)
+
+class PriorityFrontier(Freezable):
+    '''best-first frontier, stars with the smallest priority are popped first
+
+    ties are broken by popping the most recently pushed star, like the depth-first stack
+    '''
+
+    def __init__(self, priority_func):
+        self.priority_func = priority_func
+        self.heap = [] # list of tuples (priority, -push_count, ss)
+        self.push_count = 0
+
+        self.freeze_attrs()
+
+    def __len__(self):
+        return len(self.heap)
+
+    def __iter__(self):
+        return (ss for _, _, ss in self.heap)
+
+    def push(self, ss):
+        'add a star'
+
+        self.push_count += 1
+        heapq.heappush(self.heap, (self.priority_func(ss), -self.push_count, ss))
+
+    def extend(self, ss_list):
+        'add several stars'
+
+        for ss in ss_list:
+            self.push(ss)
+
+    def peek(self):
+        'get the star that pop() will return next'
+
+        return self.heap[0][2]
+
+    def pop(self):
+        'remove and return the next star to explore'
+
+        return heapq.heappop(self.heap)[2]
+
+    def heaviest_index(self):
+        'get the index in the heap of the star with the most work'
+
+        return max(range(len(self.heap)), key=lambda i: self.heap[i][2].work_frac)
+
+    def peek_heaviest(self):
+        'get the star that pop_heaviest() will return next'
+
+        return self.heap[self.heaviest_index()][2]
+
+    def pop_heaviest(self):
+        '''remove and return the star with the most work, used when offloading work
+
+        this is O(n), but offloading only happens when other workers are idle
+        '''
+
+        index = self.heaviest_index()
+
+        rv = self.heap[index][2]
+        self.heap[index] = self.heap[-1]
+        self.heap.pop()
+        heapq.heapify(self.heap)
+
+        return rv
+
+    def pop_coldest(self, count):
+        'remove and return a list of the count stars that would be popped last, the last one first'
+
+        self.heap.sort(reverse=True)
+
+        rv = [ss for _, _, ss in self.heap[:count]]
+        self.heap = self.heap[count:]
+        heapq.heapify(self.heap)
+
+        return rv
+
+    def push_cold(self, ss):
+        'add a star back after pop_coldest (with a priority, the order is restored anyway)'
+
+        self.push(ss)
+
+    def shuffle(self):
+        'the order is determined by the priorities, so this does nothing'
+
+class SpillFrontier(Freezable):
+    '''wrapper for a frontier with a memory budget (Settings.MAX_FRONTIER_MEMORY)
+
+    When the estimated size of the stars in memory exceeds the budget, the coldest stars (the ones the wrapped frontier
+    would pop last) are pickled to an append-only temporary file until half the budget is used. The file is used as a
+    stack: when the stars in memory run out, the most recently spilled ones are read back and the file is truncated,
+    which restores the wrapped frontier's order.
+    '''
+
+    def __init__(self, inner, max_bytes):
+        self.inner = inner
+        self.max_bytes = max_bytes
+        self.mem_bytes = 0 # estimated size of the stars in inner
+
+        self.spill_file = None # created on the first spill
+
+        # (file offset, num_bytes, work_frac) for each spilled star, in the order they were spilled. The file may also
+        # have records of stars that were read back by pop_heaviest(), which are dropped when the file is truncated.
+        self.spilled = []
+
+        # statistics
+        self.spill_count = 0
+        self.spill_bytes = 0
+        self.spill_secs = 0.0
+
+        self.freeze_attrs()
+
+    def __len__(self):
+        return len(self.inner) + len(self.spilled)
+
+    def __iter__(self):
+        'iterate over the stars in memory (the spilled ones are read with spilled_records())'
+
+        return iter(self.inner)
+
+    def spilled_records(self):
+        '''iterate over the pickled bytes of the spilled stars (with their lps serialized), without unpickling them
+
+        this is used to stream the spilled stars into a checkpoint (see checkpoint.save_frontier())
+        '''
+
+        for offset, num_bytes, _ in self.spilled:
+            self.spill_file.seek(offset)
+
+            yield self.spill_file.read(num_bytes)
+
+    def push(self, ss):
+        'add a star'
+
+        self.inner.push(ss)
+        self.mem_bytes += ss.estimate_bytes()
+
+        if self.mem_bytes > self.max_bytes:
+            self.spill()
+
+    def extend(self, ss_list):
+        'add several stars'
+
+        for ss in ss_list:
+            self.push(ss)
+
+    def peek(self):
+        'get the star that pop() will return next'
+
+        self.unspill()
+
+        return self.inner.peek()
+
+    def pop(self):
+        'remove and return the next star to explore'
+
+        self.unspill()
+        rv = self.inner.pop()
+        self.mem_bytes -= rv.estimate_bytes()
+
+        return rv
+
+    def pop_heaviest(self):
+        '''remove and return the star with the most work, including the spilled stars
+
+        with a depth-first frontier, the spilled stars are the ones closest to the root, so they usually have the most
+        work. This is O(number of spilled stars), but offloading only happens when other workers are idle.
+        '''
+
+        index = None
+
+        if self.spilled:
+            index = max(range(len(self.spilled)), key=lambda i: self.spilled[i][2])
+
+            if len(self.inner) > 0 and self.inner.peek_heaviest().work_frac >= self.spilled[index][2]:
+                index = None
+
+        if index is None:
+            self.unspill()
+            rv = self.inner.pop_heaviest()
+            self.mem_bytes -= rv.estimate_bytes()
+        else:
+            offset, num_bytes, _ = self.spilled.pop(index)
+            rv = self.read_star(offset, num_bytes)
+
+            if index == len(self.spilled):
+                self.spill_file.truncate(offset)
+
+        return rv
+
+    def shuffle(self):
+        'randomize the order of the stars in memory'
+
+        self.inner.shuffle()
+
+    def spill(self):
+        'write the coldest stars to the spill file until half the budget is used'
+
+        Timers.tic('frontier_spill')
+        start = time.perf_counter()
+
+        if self.spill_file is None:
+            self.spill_file = tempfile.TemporaryFile(prefix='nnenum_spill_', dir=Settings.FRONTIER_SPILL_DIR)
+
+        target = self.max_bytes / 2
+
+        # keep at least one star in memory, so that pop() doesn't need to read back what was just written
+        while self.mem_bytes > target and len(self.inner) > 1:
+            avg_bytes = self.mem_bytes / len(self.inner)
+            count = min(len(self.inner) - 1, math.ceil((self.mem_bytes - target) / avg_bytes))
+
+            for ss in self.inner.pop_coldest(count):
+                self.mem_bytes -= ss.estimate_bytes()
+
+                if not isinstance(ss, StarRecipe): # recipes pickle their snapshot's star themselves
+                    ss.star.lpi.serialize()
+
+                data = pickle.dumps(ss)
+
+                self.spill_file.seek(0, 2)
+                self.spilled.append((self.spill_file.tell(), len(data), ss.work_frac))
+                self.spill_file.write(data)
+
+                self.spill_count += 1
+                self.spill_bytes += len(data)
+
+        self.spill_secs += time.perf_counter() - start
+        Timers.toc('frontier_spill')
+
+    def unspill(self):
+        'if there are no stars in memory, read back the most recently spilled ones until half the budget is used'
+
+        if len(self.inner) == 0 and self.spilled:
+            Timers.tic('frontier_unspill')
+            start = time.perf_counter()
+
+            while self.spilled and (len(self.inner) == 0 or self.mem_bytes < self.max_bytes / 2):
+                offset, num_bytes, _ = self.spilled.pop()
+                ss = self.read_star(offset, num_bytes)
+                self.spill_file.truncate(offset)
+
+                self.inner.push_cold(ss)
+                self.mem_bytes += ss.estimate_bytes()
+
+            self.spill_secs += time.perf_counter() - start
+            Timers.toc('frontier_unspill')
+
+    def read_star(self, offset, num_bytes):
+        'read a star from the spill file'
+
+        self.spill_file.seek(offset)
+        rv = pickle.loads(self.spill_file.read(num_bytes))
+
+        if not isinstance(rv, StarRecipe):
+            rv.star.lpi.deserialize()
+
+        return rv
+
+def distance_priority(ss):
+    'closest to the unsafe set first, see Worker.set_distance_to_unsafe()'
+
+    return ss.distance_to_unsafe if ss.distance_to_unsafe is not None else 0
+
+def work_frac_priority(ss):
+    'largest remaining work fraction first'
+
+    return -ss.work_frac
+
+def depth_priority(ss):
+    'most splits first'
+
+    return -len(ss.branch_tuples)
+
+def make_frontier():
+    'create the frontier selected in the settings'
+
+    if Settings.FRONTIER_ORDER == Settings.FRONTIER_DFS:
+        rv = DequeFrontier(lifo=True)
+    elif Settings.FRONTIER_ORDER == Settings.FRONTIER_BFS:
+        rv = DequeFrontier(lifo=False)
+    else:
+        assert Settings.FRONTIER_ORDER == Settings.FRONTIER_BEST_FIRST, \
+            f"unknown FRONTIER_ORDER: {Settings.FRONTIER_ORDER}"
+
+        priority_funcs = {Settings.PRIORITY_DISTANCE: distance_priority,
+                          Settings.PRIORITY_WORK_FRAC: work_frac_priority,
+                          Settings.PRIORITY_DEPTH: depth_priority}
+
+        assert Settings.FRONTIER_PRIORITY in priority_funcs, \
+            f"unknown FRONTIER_PRIORITY: {Settings.FRONTIER_PRIORITY}"
+
+        rv = PriorityFrontier(priority_funcs[Settings.FRONTIER_PRIORITY])
+
+    if Settings.MAX_FRONTIER_MEMORY is not None:
+        rv = SpillFrontier(rv, Settings.MAX_FRONTIER_MEMORY)
+
+    return rv
@@ -8,12 +8,14 @@ import numpy as np
 from nnenum.settings import Settings
 if Settings.LP_SOLVER == 'GLPK':
     from nnenum.lpinstance_glpk import LpInstanceGLPK as LpInstance
+elif Settings.LP_SOLVER == 'HiGHS':
+    from nnenum.lpinstance_highs import LpInstanceHiGHS as LpInstance
 else:
     from nnenum.lpinstance_gb import LpInstanceGB as LpInstance
 # from nnenum.lpinstance import LpInstance
 from nnenum.util import Freezable
 from nnenum.settings import Settings
-from nnenum.timerutil import Timers
+from nnenum.timerutil import Timers, hot_timed
 from nnenum import kamenev
 
 
@@ -25,6 +27,8 @@ class LpStar(Freezable):
     constraints on initial variables (using csr / rhs)
     '''
 
+    rows_after_prune = 0 # default for stars pickled before the attribute existed
+
     def __init__(self, a_mat, bias, box_bounds=None):
         assert a_mat is None or isinstance(a_mat, np.ndarray)
         assert bias is None or isinstance(bias, np.ndarray)
@@ -46,6 +50,8 @@ class LpStar(Freezable):
 
         self.num_lps = 0 # stat, number of lps solved
 
+        self.rows_after_prune = 0 # number of lp rows after the last prune_rows()
+
         # box_bounds may be None if we're initializing in lp_star.copy()
         if box_bounds is not None:
             if Settings.CONTRACT_LP_TRACK_WITNESSES:
@@ -98,6 +104,7 @@ class LpStar(Freezable):
         rv = LpStar(a_mat=self.a_mat.copy(), bias=self.bias.copy())
 
         rv.lpi = LpInstance(self.lpi)
+        rv.rows_after_prune = self.rows_after_prune
         
         Timers.tic('copy init bm bias')
 
@@ -422,6 +429,7 @@ class LpStar(Freezable):
 
         return rv
 
+    @hot_timed('minimize_output')
     def minimize_output(self, output_index, maximize=False):
         '''
         get the output value when one of the outputs is minimized (or maximized)
@@ -431,8 +439,6 @@ class LpStar(Freezable):
         if you want the (input, output) pair to produce this output, use consutrct_last_io()
         '''
 
-        Timers.tic('minimize_output')
-
         if self.a_mat.size == 0:
             value = self.bias
         else:
@@ -450,10 +456,120 @@ class LpStar(Freezable):
             # single row
             value = self.a_mat[output_index].dot(lp_result) + self.bias[output_index]
 
-        Timers.toc('minimize_output')
-
         return value
 
+    @hot_timed('minimize_outputs')
+    def minimize_outputs(self, output_indices, maximize, split_tolerance=None):
+        '''
+        get the output values when each of the outputs is minimized (or maximized, where maximize is True), using a
+        single batched lp call
+
+        if split_tolerance is not None, each lp may stop early once the sign of its bound is decided, so a minimum is
+        only known to be a lower bound that is at least -split_tolerance (a maximum: an upper bound at most
+        split_tolerance)
+
+        returns an array of the values
+        '''
+
+        output_indices = np.array(output_indices, dtype=int)
+        bias = self.bias[output_indices]
+
+        if self.a_mat.size == 0:
+            rv = bias.copy()
+        else:
+            rows = self.a_mat[output_indices]
+            signs = np.where(maximize, -1.0, 1.0)
+            stop_values = None if split_tolerance is None else -split_tolerance - signs * bias
+
+            res = self.lpi.minimize_batch(rows * signs[:, np.newaxis], stop_values)
+            self.num_lps += len(output_indices)
+
+            witnesses = res[:, 1:]
+            solved = ~np.isnan(witnesses[:, 0])
+
+            # like minimize_output(), use the witness when there is one
+            rv = signs * res[:, 0] + bias
+            rv[solved] = np.einsum('ij,ij->i', rows[solved], witnesses[solved]) + bias[solved]
+
+        return rv
+
+    def prune_rows(self, max_lps=0, tol=None):
+        '''remove redundant rows from the lp, which keeps the lps of deep stars from growing with each split
+
+        The lp's column bounds are first tightened to the input box bounds from the witnesses, bloated by tol (relative
+        to the bound's magnitude, default Settings.PRUNE_LP_TOLERANCE). Rows implied by the box are then found with
+        interval arithmetic. Up to max_lps of the other rows, oldest first, are checked with an lp that maximizes the
+        row with the row itself relaxed. Rows that are tight at a witness point are skipped, as they are likely to be
+        needed.
+
+        The witnesses are only optimal up to the lp solver's feasibility tolerance, so the tightened box contains the
+        star's set only if tol is at least that tolerance. Rows removed by an lp test are implied up to tol, so the set
+        may grow by up to tol along those rows; rows removed by the interval test are implied by the box.
+
+        returns the number of removed rows
+        '''
+
+        if tol is None:
+            tol = Settings.PRUNE_LP_TOLERANCE
+
+        rv = 0
+        num_rows = self.lpi.get_num_rows()
+
+        if self.input_bounds_witnesses is not None and num_rows > 0:
+            Timers.tic('prune_rows')
+
+            box = np.array(self.get_input_box_bounds(), dtype=float)
+            bloat = tol * np.maximum(1.0, np.abs(box))
+            box += bloat * np.array([-1.0, 1.0])
+            self.lpi.tighten_col_bounds(box)
+
+            mat = self.lpi.get_constraints_csr().toarray()
+            rhs = self.lpi.get_rhs()
+
+            # interval test: the maximum of each row over the box
+            row_max = np.maximum(mat * box[:, 0], mat * box[:, 1]).sum(axis=1)
+            redundant = row_max <= rhs
+
+            if max_lps > 0:
+                wit_pts = np.array([pt for wits in self.input_bounds_witnesses for pt in wits])
+                tight = (mat.dot(wit_pts.T) >= rhs[:, np.newaxis] - tol).any(axis=1)
+                candidates = np.nonzero(~redundant & ~tight)[0][:max_lps]
+
+                if candidates.size > 0:
+                    # rows that are found redundant stay relaxed (to 1 above their maximum), until they're deleted
+                    lp_rhs = np.where(redundant, row_max + 1, rhs)
+
+                    for row in candidates:
+                        lp_rhs[row] = row_max[row] + 1
+                        self.lpi.set_rhs(lp_rhs)
+
+                        try:
+                            # min -row >= -rhs: the row is implied by the others
+                            res = self.lpi.minimize_batch(-mat[row:row+1], stop_values=[-rhs[row] - tol])
+                        except RuntimeError:
+                            # infeasible star or solver failure, keep the row and skip the other lp tests
+                            lp_rhs[row] = rhs[row]
+                            break
+
+                        self.num_lps += 1
+
+                        if res[0, 0] >= -rhs[row] - tol:
+                            redundant[row] = True
+                        else:
+                            lp_rhs[row] = rhs[row]
+
+                    self.lpi.set_rhs(lp_rhs)
+
+            removed = np.nonzero(redundant)[0]
+            self.lpi.del_rows(list(removed))
+            rv = removed.size
+
+            Timers.toc('prune_rows')
+
+        self.rows_after_prune = num_rows - rv
+
+        return rv
+
     def construct_last_io(self):
         '''construct the last concrete input/output pair from the optimization performed when minimize_output was called
 
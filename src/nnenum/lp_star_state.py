@@ -3,10 +3,15 @@ LP Star State (includes enumeration state variables)
 Stanley Bak
 '''
 
+import pickle
+import copy
+from collections import OrderedDict
+
 import numpy as np
 
 from nnenum.lp_star import LpStar
-from nnenum.prefilter import Prefilter
+from nnenum.prefilter import Prefilter, OutputBounds
+from nnenum.zonotope import Zonotope
 from nnenum.timerutil import Timers
 from nnenum.util import Freezable, compress_init_box
 from nnenum.network import FullyConnectedLayer, ReluLayer, FlattenLayer, AddLayer, MatMulLayer
@@ -46,6 +51,11 @@ class LpStarState(Freezable):
 
         self.distance_to_unsafe = None
 
+        # with Settings.COMPACT_FRONTIER, the state of this star before its splits on the current layer, and the
+        # list of (neuron_index, is_positive) splits since then (see StarRecipe)
+        self.snapshot = None
+        self.snapshot_splits = []
+
         if uncompressed_init_box is not None:
             assert isinstance(uncompressed_init_box, np.ndarray), "init bounds should be given in a numpy array"
             assert uncompressed_init_box.dtype in [np.float32, np.float64], \
@@ -81,6 +91,55 @@ class LpStarState(Freezable):
 
         return rv
 
+    def estimate_bytes(self):
+        '''estimate the memory used by this star (for Settings.MAX_FRONTIER_MEMORY)
+
+        the lp is counted as a csr matrix of doubles (with int32 indices), plus its rhs and column bounds
+        '''
+
+        star = self.star
+        lpi = star.lpi
+        rv = star.a_mat.nbytes + star.bias.nbytes
+        rv += 12 * lpi.get_num_nonzeros() + 12 * lpi.get_num_rows() + 16 * lpi.get_num_cols()
+
+        if self.prefilter is not None and self.prefilter.output_bounds is not None:
+            rv += self.prefilter.output_bounds.layer_bounds.nbytes
+
+        return rv
+
+    def backup(self):
+        '''get a copy of this star, which is put back in the frontier if a step is interrupted by the timeout (see
+        Worker.main_loop())
+
+        the prefilter is copied like StarSnapshot.make_prefilter() does, and the snapshot (see StarRecipe) is shared
+        '''
+
+        Timers.tic('backup_star')
+
+        rv = LpStarState(safe_spec_list=None if self.safe_spec_list is None else self.safe_spec_list.copy())
+        rv.star = self.star.copy()
+        rv.cur_layer = self.cur_layer
+        rv.work_frac = self.work_frac
+        rv.should_try_overapprox = self.should_try_overapprox
+        rv.branch_tuples = self.branch_tuples.copy()
+        rv.distance_to_unsafe = self.distance_to_unsafe
+        rv.snapshot = self.snapshot
+        rv.snapshot_splits = self.snapshot_splits.copy()
+
+        prefilter = self.prefilter
+        rv.prefilter = Prefilter()
+        rv.prefilter.simulation = None if prefilter.simulation is None else [x.copy() for x in prefilter.simulation]
+        rv.prefilter.zono = Zonotope(rv.star.bias, rv.star.a_mat, prefilter.zono.init_bounds.copy())
+
+        if prefilter.output_bounds is not None:
+            rv.prefilter.output_bounds = OutputBounds(rv.prefilter)
+            rv.prefilter.output_bounds.layer_bounds = prefilter.output_bounds.layer_bounds.copy()
+            rv.prefilter.output_bounds.branching_neurons = prefilter.output_bounds.branching_neurons.copy()
+
+        Timers.toc('backup_star')
+
+        return rv
+
     def remaining_splits(self):
         'get the number of remaining splits on the current layer'
 
@@ -156,6 +215,8 @@ class LpStarState(Freezable):
         'advance to the next layer'
 
         self.cur_layer += 1
+        self.snapshot = None
+        self.snapshot_splits = []
 
         if self.prefilter:
             self.prefilter.clear_output_bounds()
@@ -180,6 +241,16 @@ class LpStarState(Freezable):
 
         Timers.toc('starstate.apply_linear_layer')
 
+    def prune_lp_rows(self):
+        '''remove redundant rows from the star's lp (see LpStar.prune_rows()), if Settings.PRUNE_LP_ROWS is set and
+        enough rows were added since it was last pruned
+        '''
+
+        star = self.star
+
+        if Settings.PRUNE_LP_ROWS and star.lpi.get_num_rows() - star.rows_after_prune >= Settings.PRUNE_LP_MIN_ROWS:
+            star.prune_rows(Settings.PRUNE_LP_MAX_LPS)
+
     def split_enumerate(self, i, network, spec, start_time):
         '''
         helper for execute_relus
@@ -194,6 +265,10 @@ class LpStarState(Freezable):
 
         Timers.tic('split_enumerate')
 
+        # the star is modified in a way StarRecipe can't replay
+        self.snapshot = None
+        self.snapshot_splits = []
+
         child = LpStarState()
         child.star = self.star.copy()
             
@@ -284,10 +359,55 @@ class LpStarState(Freezable):
 
             Timers.toc('prefilter_split_relu')
 
+            # after the split, so the prune uses the witnesses of the tightened input box
+            pos.prune_lp_rows()
+            neg.prune_lp_rows()
+
         Timers.toc('split_enumerate')
 
         return rv
 
+    def split_compact(self, i, start_time):
+        '''split on neuron i like split_enumerate(), except that the star for the negative branch is not built
+
+        self takes the positive branch. Returns a StarRecipe for the negative branch.
+        '''
+
+        Timers.tic('split_compact')
+
+        if self.snapshot is None:
+            self.snapshot = StarSnapshot(self)
+            self.snapshot_splits = []
+
+        self.work_frac /= 2.0
+
+        rv = StarRecipe(self, self.snapshot_splits + [(i, False)])
+
+        row = self.star.a_mat[i]
+        bias = self.star.bias[i]
+
+        # pos gets output >= 0
+        self.star.lpi.add_dense_row(-row, bias)
+
+        self.branch_tuples.append((self.cur_layer, i, True))
+        self.snapshot_splits = self.snapshot_splits + [(i, True)]
+
+        Timers.tic('prefilter_split_relu')
+        depth = len(self.branch_tuples)
+        self.prefilter.split_relu_one_side(i, self.star, True, row, bias, start_time, depth)
+
+        # tolerance for lp solver is about 1e-6
+        if Settings.EAGER_BOUNDS:
+            assert self.prefilter.simulation[1][i] >= -1e-3, f"pos sim for {i} was {self.prefilter.simulation[1][i]}"
+
+        Timers.toc('prefilter_split_relu')
+
+        self.prune_lp_rows()
+
+        Timers.toc('split_compact')
+
+        return rv
+
     def do_first_relu_split(self, network, spec, start_time):
         '''
         do the first relu split for the current layer
@@ -304,8 +424,210 @@ class LpStarState(Freezable):
         
         index = self.prefilter.output_bounds.branching_neurons[0]
 
-        rv = self.split_enumerate(index, network, spec, start_time)
+        if Settings.COMPACT_FRONTIER and not LpStarState.TARGET_BRANCH_TUPLE:
+            rv = self.split_compact(index, start_time)
+        else:
+            rv = self.split_enumerate(index, network, spec, start_time)
 
         Timers.toc('do_first_relu_split')
 
         return rv
+
+class StarSnapshot(Freezable):
+    '''the state of a star before its splits on one layer, shared by the StarRecipes of the stars split from it
+
+    the star is live while the snapshot is in a worker's SnapshotCache, and otherwise kept pickled (with its lp
+    serialized), which is much smaller
+    '''
+
+    def __init__(self, ss):
+        self.cur_layer = ss.cur_layer
+
+        self.star = ss.star.copy()
+        self.star_bytes = None
+
+        prefilter = ss.prefilter
+        self.simulation = None if prefilter.simulation is None else [x.copy() for x in prefilter.simulation]
+        self.init_bounds = prefilter.zono.init_bounds.copy()
+        self.layer_bounds = prefilter.output_bounds.layer_bounds.copy()
+        self.branching_neurons = prefilter.output_bounds.branching_neurons.copy()
+
+        self.freeze_attrs()
+
+    def __getstate__(self):
+        # snapshots are pickled in checkpoints and when stars are sent to other workers. The live star may be in use
+        # by get_star() in another thread, so the state is built from a copy and self is left unchanged.
+        rv = self.__dict__.copy()
+
+        if self.star_bytes is None:
+            star = self.star.copy()
+            star.lpi.serialize()
+            rv['star_bytes'] = pickle.dumps(star)
+
+        rv['star'] = None
+
+        return rv
+
+    def detached(self):
+        '''get a copy of the snapshot with the star pickled, for a StarRecipe sent to another worker thread
+
+        lps are confined to the thread that created them, so the receiver unpickles its own copy of the star
+        '''
+
+        return copy.copy(self)
+
+    def compact(self):
+        'pickle the star, if it\'s live'
+
+        if self.star is not None:
+            Timers.tic('compact_snapshot')
+
+            if self.star_bytes is None:
+                self.star.lpi.serialize()
+                self.star_bytes = pickle.dumps(self.star)
+
+            self.star = None
+
+            Timers.toc('compact_snapshot')
+
+    def get_star(self):
+        'get the live star, unpickling it if needed'
+
+        if self.star is None:
+            Timers.tic('load_snapshot_star')
+
+            self.star = pickle.loads(self.star_bytes)
+            self.star.lpi.deserialize()
+
+            Timers.toc('load_snapshot_star')
+
+        return self.star
+
+    def make_prefilter(self, star):
+        'make a prefilter for a copy of the snapshot star'
+
+        rv = Prefilter()
+
+        rv.simulation = None if self.simulation is None else [x.copy() for x in self.simulation]
+        rv.zono = Zonotope(star.bias, star.a_mat, self.init_bounds.copy())
+
+        rv.output_bounds = OutputBounds(rv)
+        rv.output_bounds.layer_bounds = self.layer_bounds.copy()
+        rv.output_bounds.branching_neurons = self.branching_neurons.copy()
+
+        return rv
+
+class SnapshotCache(Freezable):
+    '''the most recently used StarSnapshots of a worker, which keep their stars live
+
+    sibling stars are usually split and popped close together, so most snapshots are never pickled
+    '''
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.snapshots = OrderedDict() # used as an ordered set
+
+        self.freeze_attrs()
+
+    def touch(self, snapshot):
+        'mark a snapshot as recently used, and compact the least recently used one if the cache is full'
+
+        if snapshot in self.snapshots:
+            self.snapshots.move_to_end(snapshot)
+        else:
+            self.snapshots[snapshot] = None
+
+            if len(self.snapshots) > self.max_size:
+                old, _ = self.snapshots.popitem(last=False)
+                old.compact()
+
+    def get_star(self, snapshot):
+        'get a copy of the star in the snapshot'
+
+        rv = snapshot.get_star().copy()
+        self.touch(snapshot)
+
+        return rv
+
+class StarRecipe(Freezable):
+    '''compact pending star in the frontier (see Settings.COMPACT_FRONTIER)
+
+    this is a reference to a StarSnapshot of an ancestor and the list of splits to apply to it. It has the
+    attributes the frontier uses for ordering, and is rebuilt into an LpStarState with materialize() when popped.
+    '''
+
+    def __init__(self, parent, splits):
+        self.snapshot = parent.snapshot
+        self.splits = splits # list of (neuron_index, is_positive)
+
+        i, is_positive = splits[-1]
+        self.branch_tuples = parent.branch_tuples + [(parent.cur_layer, i, is_positive)]
+        self.work_frac = parent.work_frac
+        self.safe_spec_list = None if parent.safe_spec_list is None else parent.safe_spec_list.copy()
+
+        # the distance of the parent, since the simulation point is only computed by materialize()
+        self.distance_to_unsafe = parent.distance_to_unsafe
+        self.should_try_overapprox = True
+
+        self.freeze_attrs()
+
+    def estimate_bytes(self):
+        'estimate the memory used by this recipe, not counting the shared snapshot'
+
+        return 64 * (len(self.splits) + len(self.branch_tuples))
+
+    def materialize(self, network, start_time, cache):
+        '''rebuild the LpStarState and propagate it up to its next split
+
+        this applies all the split constraints to a copy of the snapshot star, and then contracts the domain and
+        updates the bounds once (rather than after every split), so the branching order may differ slightly from
+        split_enumerate()
+        '''
+
+        Timers.tic('materialize_recipe')
+
+        snapshot = self.snapshot
+
+        rv = LpStarState(safe_spec_list=self.safe_spec_list)
+        rv.star = cache.get_star(snapshot)
+        rv.prefilter = snapshot.make_prefilter(rv.star)
+        rv.cur_layer = snapshot.cur_layer
+        rv.work_frac = self.work_frac
+        rv.branch_tuples = self.branch_tuples.copy()
+        rv.distance_to_unsafe = self.distance_to_unsafe
+        rv.should_try_overapprox = self.should_try_overapprox
+
+        star = rv.star
+        depth = len(rv.branch_tuples)
+        hyperplane_list = []
+        rhs_list = []
+
+        for i, is_positive in self.splits:
+            row = star.a_mat[i].copy()
+            bias = star.bias[i]
+
+            if is_positive:
+                hyperplane_list.append(-row)
+                rhs_list.append(bias)
+            else:
+                hyperplane_list.append(row)
+                rhs_list.append(-bias)
+
+                star.a_mat[i] = 0
+                star.bias[i] = 0
+
+            star.lpi.add_dense_row(hyperplane_list[-1], rhs_list[-1])
+
+            rv.prefilter.split_relu_one_side(i, star, is_positive, row, bias, start_time, depth, replay=True)
+
+        rv.prefilter.replay_done(star, hyperplane_list, rhs_list, start_time, depth)
+
+        # later splits on this layer can share the snapshot
+        rv.snapshot = snapshot
+        rv.snapshot_splits = self.splits
+
+        rv.propagate_up_to_split(network, start_time)
+
+        Timers.toc('materialize_recipe')
+
+        return rv
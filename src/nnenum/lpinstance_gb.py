@@ -2,138 +2,241 @@
 Ali A.Bigdeli
 March 2023
 Gurobi python interface using gurobipy
-'''
 
+The model is built with gurobi's matrix api (addMVar / addMConstr), and the lps are solved with the dual simplex method,
+so a model keeps its basis between objective changes and added rows. The basis is also kept when an lp is copied or
+serialized, like in lpinstance_glpk.py. All the models of a thread share one gurobi environment.
+'''
 
-import sys
-import math
+import os
 import time
-from typing import List, Tuple, Dict
+import threading
 
 import numpy as np
+from scipy.sparse import csr_matrix
+
+import gurobipy as gp
+from gurobipy import GRB
 
 from nnenum.util import Freezable
-from nnenum.timerutil import Timers
+from nnenum.timerutil import Timers, hot_timed
 from nnenum.settings import Settings
+from nnenum.lputil import SIMPLEX_STATS
 
-import gurobipy as gp
-from gurobipy import GRB, LinExpr
+ENV_LOCAL = threading.local()
+
+def get_env():
+    '''get the gurobi environment of this thread, which is shared by all its models
+
+    environments are not thread-safe and can't be used after a fork, so each thread of each process starts its own
+    '''
+
+    env = getattr(ENV_LOCAL, 'env', None)
+
+    if env is None or ENV_LOCAL.pid != os.getpid():
+        env = gp.Env(empty=True)
+        env.setParam('OutputFlag', 0)
+        env.setParam('Threads', 1) # each enumeration worker already uses a core
+        env.setParam('Method', 1) # dual simplex: warm starts after adding rows, sound cutoffs in minimize_batch()
+        env.start()
+
+        ENV_LOCAL.env = env
+        ENV_LOCAL.pid = os.getpid()
 
+    return env
 
 class LpInstanceGB(Freezable):
     'Linear programming wrapper using Gurobipy'
 
     lp_time_limit_sec = 15.0
+    inherited_basis = False
 
-    def __init__(self, other_lpi=None): 
+    def __init__(self, other_lpi=None):
         'initialize the lp instance'
 
-        # self.cached_vars = None
+        self.env = get_env() # the environment of self.lp, which is only used from the thread that made it
 
-        if other_lpi is not None:
-            Timers.tic('gb_copy_model')
-            self.lp = other_lpi.lp.copy()
-            Timers.toc('gb_copy_model')
+        if other_lpi is None:
+            self.lp = LpInstanceGB.make_model()
+            self.names = [] # column names
+
+            # is the basis kept from a parent lp, and not used by a minimize yet? (counted in SIMPLEX_STATS)
+            self.inherited_basis = False
         else:
-            self.lp = gp.Model()
-            self.lp.setParam('OutputFlag', False)
+            # initialize from other lpi
+            self.names = other_lpi.names.copy()
+
+            Timers.tic('gb_copy_model')
 
-            # self.init_from_box(box)
+            if other_lpi.env is self.env:
+                other_lpi.lp.update()
+                self.lp = other_lpi.lp.copy() # uses the same environment
+                basis = other_lpi.get_basis()
+
+                if basis is not None:
+                    self.set_basis(*basis)
+
+                self.inherited_basis = basis is not None
+            else:
+                # the model is from another thread (or the parent of a forked process), so rebuild it in this
+                # thread's environment
+                self.lp = other_lpi.get_arrays()
+                self.inherited_basis = False
+                self.deserialize()
+
+            Timers.toc('gb_copy_model')
 
         self.print_failure_msg = True
-        self.need_update = False
         self.freeze_attrs()
 
-    
     def __deepcopy__(self, _):
-        if self.need_update:
-            self.update()
-            
-        return LpInstanceGB(clone_hpoly=self)
+        return LpInstanceGB(self)
 
-    def update(self):
-        """update the model"""
+    def __getstate__(self):
+        # lps are pickled serialized, and the environment is set again by deserialize()
+        rv = self.__dict__.copy()
+        rv['env'] = None
 
-        assert self.need_update
+        return rv
+
+    def __del__(self):
+        if hasattr(self, 'lp') and self.lp is not None and not isinstance(self.lp, tuple):
+            self.lp.dispose()
+            self.lp = None
+
+    @staticmethod
+    def make_model():
+        'make an empty model in this thread\'s environment'
+
+        rv = gp.Model(env=get_env())
+        rv.setParam('TimeLimit', LpInstanceGB.lp_time_limit_sec)
+
+        return rv
 
-        self.need_update = False
-        self.lp.update()    
+    def update(self):
+        """process the pending model changes (gurobi applies changes lazily)"""
+
+        self.lp.update()
 
     def get_vars(self):
         """get the vars"""
 
         self.lp.update()
         return self.lp.getVars()
-    
+
+    def get_basis(self):
+        '''get the basis of the model, as int8 arrays of the row (CBasis) and column (VBasis) statuses
+
+        returns None if the model has no basis (it wasn't solved since it was built or changed)
+        '''
+
+        rv = None
+
+        try:
+            row_stat = np.array(self.lp.getAttr(GRB.Attr.CBasis, self.lp.getConstrs()), dtype=np.int8)
+            col_stat = np.array(self.lp.getAttr(GRB.Attr.VBasis, self.lp.getVars()), dtype=np.int8)
+            rv = row_stat, col_stat
+        except gp.GurobiError:
+            pass
+
+        return rv
+
+    def set_basis(self, row_stat, col_stat):
+        'set the starting basis of the next optimize() (see get_basis())'
+
+        self.lp.update()
+        self.lp.setAttr(GRB.Attr.CBasis, self.lp.getConstrs(), row_stat.tolist())
+        self.lp.setAttr(GRB.Attr.VBasis, self.lp.getVars(), col_stat.tolist())
+
+    def get_arrays(self):
+        '''get the model as a tuple of numpy arrays, without changing it
+
+        the tuple has the same layout as LpInstanceGLPK.serialize(): (data, indices, indptr, rhs, col_bounds, row_stat,
+        col_stat), where the basis statuses are gurobi's CBasis and VBasis values (or empty arrays if there is no basis)
+        '''
+
+        csr = self.get_constraints_csr()
+        rhs = self.get_rhs()
+        variables = self.lp.getVars()
+        col_bounds = np.array([self.lp.getAttr(GRB.Attr.LB, variables), self.lp.getAttr(GRB.Attr.UB, variables)],
+                              dtype=float).T.reshape((len(variables), 2))
+
+        basis = self.get_basis()
+
+        if basis is None:
+            row_stat = col_stat = np.zeros((0,), dtype=np.int8)
+        else:
+            row_stat, col_stat = basis
+
+        return csr.data, csr.indices, csr.indptr, rhs, col_bounds, row_stat, col_stat
+
     def serialize(self):
-        'serialize self.lp from a gurobi model into a tuple'
+        'serialize self.lp from a gurobi model into a tuple of numpy arrays (see get_arrays())'
 
         Timers.tic('serialize')
-        
-        # get constraints as csr matrix
-        A_sparse = self.lp.getA()
-            
-        # rhs
-        rhs = self.lp.getAttr('rhs', self.lp.getConstrs())
-
-        # Get the lower bounds of all variables
-        lbs = self.lp.getAttr(gp.GRB.Attr.LB, self.lp.getVars())
-        # Get the upper bounds of all variables
-        ubs = self.lp.getAttr(gp.GRB.Attr.UB, self.lp.getVars())
-        # Get the names of all variables
-        var_names = [var.varName for var in self.lp.getVars()]
-
-        # remember to free lp object before overwriting with tuple
+
+        arrays = self.get_arrays()
+
+        # remember to free the model before overwriting with tuple
         self.lp.dispose()
-        self.lp = (A_sparse, rhs, lbs, ubs, var_names)
+        self.lp = arrays
 
         Timers.toc('serialize')
 
-
     def deserialize(self):
-        'deserialize self.lp from a tuple into a gorubi model'
+        'deserialize self.lp from a tuple into a gurobi model'
 
         assert isinstance(self.lp, tuple)
 
         Timers.tic('deserialize')
 
-        A_sparse, rhs, lbs, ubs, var_names = self.lp
+        data, indices, indptr, rhs, col_bounds, row_stat, col_stat = self.lp
+        num_cols = len(col_bounds)
+
+        self.env = get_env()
+        self.lp = LpInstanceGB.make_model()
+        x = self.lp.addMVar(num_cols, lb=col_bounds[:, 0], ub=col_bounds[:, 1])
 
-        self.lp = gp.Model()
-        self.lp.setParam('OutputFlag', False)
+        if len(rhs) > 0:
+            mat = csr_matrix((data, indices, indptr), shape=(len(rhs), num_cols))
+            self.lp.addMConstr(mat, x, GRB.LESS_EQUAL, rhs)
 
-        n_variables = len(var_names)
-        x = self.lp.addVars(n_variables, lb=lbs, ub=ubs, name=var_names)
-        vars = x.select() # use select method to get values of tupledict as a list
-        # Define constraints
-        for i in range(len(rhs)):
-            vec = np.squeeze(A_sparse[i].toarray())
-            lhs_expr = LinExpr(vec, vars) 
-            self.lp.addLConstr(lhs_expr, GRB.LESS_EQUAL, rhs[i], name=f"R{i}")
+        if len(row_stat) > 0:
+            self.set_basis(row_stat, col_stat)
+            self.inherited_basis = True
 
         self.lp.update()
-        
+
         Timers.toc('deserialize')
-    
 
     def __str__(self, plain_text=False):
         'get the LP as string (useful for debugging)'
 
         rows = self.get_num_rows()
         cols = self.get_num_cols()
-        rv = "Lp has {} columns (variables) and {} rows (constraints)\n".format(cols, rows)
+        rv = f"Lp has {cols} columns (variables) and {rows} rows (constraints)\n"
+
+        csr = self.get_constraints_csr()
+        rhs = self.get_rhs()
 
-        rv += self.lp.display()
+        for row in range(rows):
+            rv += f"{csr[row].toarray()[0]} <= {rhs[row]}\n"
+
+        for var, name in zip(self.lp.getVars(), self.names):
+            rv += f"{var.LB} <= {name} <= {var.UB}\n"
 
         return rv
-    
 
-    def add_var(self, name, lb, ub):
-        """add a bounded variable, get stored in self.vars"""
+    def _add_cols(self, names, lb, ub):
+        'add columns with the given bounds'
+
+        assert isinstance(names, list)
+        num_vars = len(names)
+
+        if num_vars > 0:
+            self.names += names
+            self.lp.addMVar(num_vars, lb=lb, ub=ub)
 
-        self.lp.addVar(lb=lb, ub=ub, vtype=GRB.CONTINUOUS, name=name)
-    
-    
     def add_double_bounded_cols(self, names, lb, ub):
         'add a certain number of columns to the LP with the given lower and upper bound'
 
@@ -143,133 +246,291 @@ class LpInstanceGB(Freezable):
         ub = float(ub)
         assert lb <= ub, f"lb ({lb}) <= ub ({ub}). dif: {ub - lb}"
 
-        assert isinstance(names, list)
-        num_vars = len(names)
-
-        if num_vars > 0:
-
-            for i in range(num_vars):
-                self.lp.addVar(lb=lb, ub=ub, vtype=GRB.CONTINUOUS, name=names[i])
-                self.lp.update()
+        self._add_cols(names, lb, ub)
 
     def add_positive_cols(self, names):
         'add a certain number of columns to the LP with positive bounds'
 
-        assert isinstance(names, list)
-        num_vars = len(names)
-
-        if num_vars > 0:
-
-            for i in range(num_vars):
-                self.lp.addVar(lb=0, ub=float('inf'), vtype=GRB.CONTINUOUS, name=names[i]) # var with lower bounds (0, inf)
+        self._add_cols(names, 0.0, GRB.INFINITY)
 
     def add_cols(self, names):
         'add a certain number of columns to the LP'
 
-        assert isinstance(names, list)
-        num_vars = len(names)
+        self._add_cols(names, -GRB.INFINITY, GRB.INFINITY)
 
-        if num_vars > 0:
+    def add_rows_less_equal(self, rhs_vec):
+        '''add rows to the LP with <= constraints and no nonzeros
 
-            for i in range(num_vars):
-                self.lp.addVar(lb=float('-inf'), ub=float('inf'), vtype=GRB.CONTINUOUS, name=names[i]) # free variable (-inf, inf)
+        rhs_vector is the right-hand-side values of the constriants
+        '''
+
+        rhs_vec = np.array(rhs_vec, dtype=float)
+        assert len(rhs_vec.shape) == 1, "expected 1-d right-hand-side vector"
 
+        if rhs_vec.size > 0:
+            mat = csr_matrix((rhs_vec.size, self.get_num_cols()))
+            self.lp.addMConstr(mat, None, GRB.LESS_EQUAL, rhs_vec)
+
+    @hot_timed('add_dense_row')
     def add_dense_row(self, vec, rhs, normalize=True):
         '''
         add a row from a dense nd.array, row <= rhs
         '''
 
-        Timers.tic('add_dense_row')
-
         assert isinstance(vec, np.ndarray)
         assert len(vec.shape) == 1 or vec.shape[0] == 1
         assert len(vec) == self.get_num_cols(), f"vec had {len(vec)} values, but lpi has {self.get_num_cols()} cols"
 
         if normalize and not Settings.SKIP_CONSTRAINT_NORMALIZATION:
             norm = np.linalg.norm(vec)
-            
+
             if norm > 1e-9:
                 vec = vec / norm
                 rhs = rhs / norm
 
-        variables = self.get_vars()
-
-        self.lp.addLConstr(LinExpr(vec, variables), GRB.LESS_EQUAL, rhs)
-
-        self.need_update = True
-
-        Timers.toc('add_dense_row')
+        self.lp.update() # so the new row uses all the columns
+        self.lp.addMConstr(vec.reshape((1, -1)), None, GRB.LESS_EQUAL, np.array([rhs], dtype=float))
 
     def dims(self):
         """return number of dimensions"""
 
-        return len(self.get_vars())
-    
+        return self.get_num_cols()
+
     def get_num_cols(self):
         'get the number of cols in the lp'
 
         self.lp.update()
-        return self.lp.NumVars
-    
+        cols = self.lp.NumVars
+
+        assert cols == len(self.names), f"lp had {cols} columns, but names list had {len(self.names)} names"
+
+        return cols
+
     def get_num_rows(self):
         'get the number of rows in the lp'
-        
+
         self.lp.update()
-        return len(self.lp.getConstrs())
-    
-    def minimize(self, obj_vec, fail_on_unsat=True):
-        """return minimum point or raise MinimizeFailed exception"""
+        return self.lp.NumConstrs
 
-        if obj_vec is None:
-            obj_vec = np.zeros(self.get_num_cols(), dtype='float')
+    def get_num_nonzeros(self):
+        'get the number of nonzeros in the constraints matrix'
 
-        min_start = time.perf_counter()
+        self.lp.update()
+        return self.lp.NumNZs
 
-        if not isinstance(obj_vec, np.ndarray):
-            obj_vec = np.array(obj_vec, dtype=float)
+    def get_rhs(self, row_indices=None):
+        '''get the rhs vector of the constraints
+        row_indices - a list of requested indices (None=all)
+        this returns an np.array of rhs values for the requested indices
+        '''
 
-        variables = self.get_vars() #original code
+        self.lp.update()
+        rv = np.array(self.lp.getAttr(GRB.Attr.RHS, self.lp.getConstrs()), dtype=float)
 
-        # do this after get_vars, since that sometimes will update
-        if self.need_update:
-            self.update()
+        if row_indices is not None:
+            rv = rv[list(row_indices)]
 
-        self.lp.setObjective(obj_vec @ variables, GRB.MINIMIZE)
+        return rv
 
-        #self.m.display() ## debug display model
+    def set_rhs(self, rhs_vec):
+        'set (overwrite) the rhs for exising rows'
+
+        self.lp.update()
+        constrs = self.lp.getConstrs()
+        assert rhs_vec.size == len(constrs)
+
+        self.lp.setAttr(GRB.Attr.RHS, constrs, np.array(rhs_vec, dtype=float).tolist())
+
+    def get_constraints_csr(self):
+        '''get the LP matrix as a csr_matrix
+        '''
+
+        self.lp.update()
+
+        return self.lp.getA().tocsr()
+
+    def tighten_col_bounds(self, bounds):
+        '''tighten the column bounds to the given list of (lb, ub), one for each column
+
+        bounds that are looser than the lp's current ones (or that cross due to numerical error) are not changed
+        '''
+
+        variables = self.get_vars()
+        assert len(bounds) == len(variables)
+
+        bounds = np.array(bounds, dtype=float).reshape((len(variables), 2))
+        cur_lbs = np.array(self.lp.getAttr(GRB.Attr.LB, variables), dtype=float)
+        cur_ubs = np.array(self.lp.getAttr(GRB.Attr.UB, variables), dtype=float)
+
+        lbs = np.maximum(bounds[:, 0], cur_lbs)
+        ubs = np.minimum(bounds[:, 1], cur_ubs)
+
+        crossed = lbs > ubs
+        lbs[crossed] = cur_lbs[crossed]
+        ubs[crossed] = cur_ubs[crossed]
+
+        self.lp.setAttr(GRB.Attr.LB, variables, lbs.tolist())
+        self.lp.setAttr(GRB.Attr.UB, variables, ubs.tolist())
+
+    def del_rows(self, row_indices):
+        'delete the rows with the given (0-based) indices'
+
+        if len(row_indices) > 0:
+            self.lp.update()
+            constrs = self.lp.getConstrs()
+            self.lp.remove([constrs[i] for i in row_indices])
+
+    def is_feasible(self):
+        '''check if the lp is feasible
+
+        returns a feasible point or None
+        '''
+
+        return self.minimize(None, fail_on_unsat=False) is not None
+
+    def contains_point(self, pt, tol=1e-9):
+        '''does this lpi contain the point?
+        this is slow, will pull the constraints and check them
+        '''
+
+        print("Warning: called lpi.contains_point() (slow, used for testing)")
+
+        vec = self.get_constraints_csr().dot(pt)
+        rhs = self.get_rhs()
+
+        assert vec.size == rhs.size
+
+        # all rows are upper bounds
+        return bool(np.all(vec - tol <= rhs))
+
+    def set_minimize_direction(self, direction):
+        '''set the optimization direction'''
+
+        variables = self.get_vars()
+
+        assert len(direction) == len(variables), f"expected {len(variables)} cols, but optimization " + \
+            f"vector had {len(direction)} variables"
+
+        self.lp.setAttr(GRB.Attr.Obj, variables, np.array(direction, dtype=float).tolist())
+
+    def _optimize(self, inherited=False):
+        'run the solver, counting the call in SIMPLEX_STATS, and return the status'
 
-        start = time.perf_counter()
         Timers.tic('GB optimize')
         self.lp.optimize()
         Timers.toc('GB optimize')
-        diff = time.perf_counter() - start
 
+        SIMPLEX_STATS.add(int(self.lp.IterCount), inherited)
+
+        return self.lp.Status
 
-        if self.lp.status != GRB.OPTIMAL:
+    def _solve(self, inherited=False):
+        '''run the solver, retrying from scratch if it fails
+
+        returns True if the lp is optimal and False if it's infeasible
+        '''
+
+        start = time.perf_counter()
+        status = self._optimize(inherited)
+
+        if status not in [GRB.OPTIMAL, GRB.INFEASIBLE, GRB.INF_OR_UNBD]:
             if self.print_failure_msg:
-                statuses = ["ZERO?", "LOADED", "OPTIMAL", "INFEASIBLE", "INF_OR_UNBD", "UNBOUNDED", "CUTOFF",
-                            "ITERATION_LIMIT", "NODE_LIMIT", "TIME_LIMIT", "SOL_LIMIT", "INTERRUPTED", "NUMERIC",
-                            "SUBOPTIMAL", "INPROGRESS", "USER_OBJ_LIMIT"]
+                diff = time.perf_counter() - start
+                print(f"Gurobi.optimize() failed (status {status}) after {round(diff, 3)} sec with " + \
+                      f"{self.get_num_rows()} rows and {self.get_num_cols()} cols; retrying with reset")
 
-                code = self.lp.status
-                status = statuses[code]
-                print(f"Gurobi.optimize() failed: status was {status} ({code})")
+            self.lp.reset()
+            status = self._optimize()
 
-            rv = None
-        else:
-            vals = [v.x for v in variables]
-            rv = np.array(vals)
+        if status not in [GRB.OPTIMAL, GRB.INFEASIBLE, GRB.INF_OR_UNBD]:
+            raise RuntimeError(f"Gurobi status after minimize() was {status}")
 
+        return status == GRB.OPTIMAL
+
+    def minimize(self, direction_vec, fail_on_unsat=True):
+        '''minimize the lp, returning a list of assigments to each of the variables
+
+        if direction_vec is not None, this will first assign the optimization direction
+
+        returns None if UNSAT, otherwise the optimization result.
+        '''
+
+        assert not isinstance(self.lp, tuple), "self.lp was tuple. Did you call lpi.deserialize()?"
+
+        if direction_vec is None:
+            direction_vec = np.zeros(self.get_num_cols())
+
+        self.set_minimize_direction(direction_vec)
+
+        inherited = self.inherited_basis
+        self.inherited_basis = False
+
+        rv = None
+
+        if self._solve(inherited):
+            rv = np.array(self.lp.getAttr(GRB.Attr.X, self.lp.getVars()), dtype=float)
 
-        diff = time.perf_counter() - min_start
-        
         if rv is None and fail_on_unsat:
             raise UnsatError("minimize returned UNSAT and fail_on_unsat was True")
 
         return rv
-    
+
+    def minimize_batch(self, direction_mat, stop_values=None):
+        '''minimize the lp in each of the directions (the rows of direction_mat), back to back from the same basis
+
+        see LpInstanceGLPK.minimize_batch(). The early stop uses gurobi's Cutoff parameter, so the value of an lp that
+        stopped early is stop_values[r], a lower bound on its minimum.
+        '''
+
+        assert not isinstance(self.lp, tuple), "self.lp was tuple. Did you call lpi.deserialize()?"
+
+        variables = self.get_vars()
+        num_cols = len(variables)
+        rv = np.full((len(direction_mat), 1 + num_cols), np.nan)
+        prev_direction = None
+
+        inherited = self.inherited_basis
+        self.inherited_basis = False
+
+        try:
+            for r, direction in enumerate(direction_mat):
+                if prev_direction is None:
+                    self.set_minimize_direction(direction)
+                else:
+                    # only assign the coefficients that changed
+                    changed = np.nonzero(direction != prev_direction)[0]
+
+                    if changed.size > 0:
+                        self.lp.setAttr(GRB.Attr.Obj, [variables[i] for i in changed],
+                                        np.array(direction[changed], dtype=float).tolist())
+
+                prev_direction = direction
+
+                if stop_values is not None:
+                    self.lp.setParam('Cutoff', float(stop_values[r]))
+
+                status = self._optimize(inherited and r == 0)
+
+                if status == GRB.CUTOFF:
+                    # the minimum is known to be above the cutoff
+                    rv[r, 0] = stop_values[r]
+                elif status == GRB.OPTIMAL:
+                    rv[r, 0] = self.lp.ObjVal
+                    rv[r, 1:] = self.lp.getAttr(GRB.Attr.X, variables)
+                else:
+                    # solver failure or infeasible: minimize() retries, and raises UnsatError if it's still infeasible
+                    if stop_values is not None:
+                        self.lp.setParam('Cutoff', GRB.INFINITY)
+
+                    res = self.minimize(direction)
+
+                    rv[r, 0] = np.dot(direction, res)
+                    rv[r, 1:] = res
+        finally:
+            if stop_values is not None:
+                self.lp.setParam('Cutoff', GRB.INFINITY)
+
+        return rv
 
 class UnsatError(RuntimeError):
     'raised if an LP is infeasible'
-
-    
\ No newline at end of file
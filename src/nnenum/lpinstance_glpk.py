@@ -7,6 +7,8 @@ GLPK python interface using swiglpk
 import sys
 import math
 import time
+import ctypes
+import threading
 
 import numpy as np
 from scipy.sparse import csr_matrix
@@ -15,13 +17,22 @@ from termcolor import colored
 
 import swiglpk as glpk
 from nnenum.util import Freezable
-from nnenum.timerutil import Timers
+from nnenum.timerutil import Timers, hot_timed
 from nnenum.settings import Settings
+from nnenum.lputil import SIMPLEX_STATS
+
+# glp_get_it_cnt is not in older glpk versions
+HAS_IT_CNT = hasattr(glpk, 'glp_get_it_cnt')
 
 def get_lp_params(alternate_lp_params=False):
-    'get the lp params object'
+    '''get the lp params object
+
+    the objects are per thread, so that worker threads (Settings.BACKEND_THREADS) don't race on the lazy init
+    '''
 
-    if not hasattr(get_lp_params, 'obj'):
+    local = get_lp_params.local
+
+    if not hasattr(local, 'obj'):
         params = glpk.glp_smcp()
         glpk.glp_init_smcp(params)
 
@@ -31,8 +42,6 @@ def get_lp_params(alternate_lp_params=False):
 
         params.tm_lim = int(Settings.GLPK_TIMEOUT * 1000)
         params.out_dly = 2 * 1000 # start printing to terminal delay
-        
-        get_lp_params.obj = params
 
         # make alternative params
         params2 = glpk.glp_smcp()
@@ -43,14 +52,174 @@ def get_lp_params(alternate_lp_params=False):
         params2.tm_lim = int(Settings.GLPK_TIMEOUT * 1000)
         params2.out_dly = 1 * 1000 # start printing to terminal status after 1 secs
         
-        get_lp_params.alt_obj = params2
+        local.alt_obj = params2
+        local.obj = params # assigned last, since it's the attribute checked above
         
     if alternate_lp_params:
         #glpk.glp_term_out(glpk.GLP_ON)
-        rv = get_lp_params.alt_obj
+        rv = local.alt_obj
     else:
         #glpk.glp_term_out(glpk.GLP_OFF)
-        rv = get_lp_params.obj
+        rv = local.obj
+
+    return rv
+
+get_lp_params.local = threading.local()
+
+def get_dual_lp_params():
+    '''get the lp params object for the first lp after a basis is inherited (Settings.GLPK_INHERITED_DUAL)
+
+    the parent's basis plus the new (basic) split row is dual feasible for the parent's last objective, which the dual
+    simplex could reoptimize from. The first lp usually has a new objective (set_minimize_direction()), so the basis
+    is generally not dual feasible: GLP_DUALP then needs a dual phase one or falls back to the primal simplex
+    (depending on the glpk version), which still starts from the inherited basis. The object is per thread, like
+    get_lp_params().
+    '''
+
+    local = get_dual_lp_params.local
+
+    if not hasattr(local, 'obj'):
+        params = glpk.glp_smcp()
+        glpk.glp_init_smcp(params)
+
+        params.msg_lev = glpk.GLP_MSG_ERR
+        params.meth = glpk.GLP_DUALP # dual simplex, switching to primal if it fails
+
+        params.tm_lim = int(Settings.GLPK_TIMEOUT * 1000)
+        params.out_dly = 2 * 1000 # start printing to terminal delay
+
+        local.obj = params
+
+    return local.obj
+
+get_dual_lp_params.local = threading.local()
+
+def get_batch_lp_params():
+    '''get the lp params object for LpInstanceGLPK.minimize_batch() with stop values
+
+    this uses the dual simplex, which can stop once the objective passes obj_ul (the primal simplex can't). The
+    object is per thread, since minimize_batch() assigns obj_ul for each lp.
+    '''
+
+    local = get_batch_lp_params.local
+
+    if not hasattr(local, 'obj'):
+        params = glpk.glp_smcp()
+        glpk.glp_init_smcp(params)
+
+        params.msg_lev = glpk.GLP_MSG_ERR
+        params.meth = glpk.GLP_DUALP # dual simplex, switching to primal if it fails
+
+        params.tm_lim = int(Settings.GLPK_TIMEOUT * 1000)
+        params.out_dly = 2 * 1000 # start printing to terminal delay
+
+        local.obj = params
+
+    return local.obj
+
+get_batch_lp_params.local = threading.local()
+
+def glpk_thread_safe():
+    '''was glpk built with thread local storage (glp_config("TLS") is not NULL)?
+
+    Otherwise, glpk's environment and memory allocator are shared by all threads, so glpk calls must never run in two
+    threads at the same time. swiglpk calls hold the GIL, and get_glpk_cdll() then loads the library so that ctypes
+    calls hold it too.
+    '''
+
+    if not hasattr(glpk_thread_safe, 'rv'):
+        rv = False
+        ext = sys.modules.get('swiglpk._swiglpk') or sys.modules.get('_swiglpk')
+
+        if ext is not None:
+            try:
+                # PyDLL holds the GIL during the call
+                glp_config = ctypes.PyDLL(ext.__file__).glp_config
+                glp_config.argtypes = [ctypes.c_char_p]
+                glp_config.restype = ctypes.c_char_p
+
+                rv = glp_config(b'TLS') is not None
+            except (OSError, AttributeError): # glp_config is not in older glpk versions
+                pass
+
+        glpk_thread_safe.rv = rv
+
+    return glpk_thread_safe.rv
+
+def get_glpk_cdll():
+    '''get the glpk library through ctypes, or None
+
+    ctypes calls can pass numpy buffers directly. If glpk is thread safe (see glpk_thread_safe()), they also release
+    the GIL (swiglpk calls hold it). The library is looked up through the swiglpk extension module, so that it's the
+    same glpk library.
+    '''
+
+    if not hasattr(get_glpk_cdll, 'lib'):
+        rv = None
+        ext = sys.modules.get('swiglpk._swiglpk') or sys.modules.get('_swiglpk')
+
+        if ext is not None:
+            try:
+                lib = ctypes.CDLL(ext.__file__) if glpk_thread_safe() else ctypes.PyDLL(ext.__file__)
+
+                lib.glp_simplex.argtypes = [ctypes.c_void_p, ctypes.c_void_p]
+                lib.glp_simplex.restype = ctypes.c_int
+
+                # (lp, row, ind, val), ind and val are filled from index 1
+                lib.glp_get_mat_row.argtypes = [ctypes.c_void_p, ctypes.c_int, ctypes.c_void_p, ctypes.c_void_p]
+                lib.glp_get_mat_row.restype = ctypes.c_int
+
+                # (lp, ne, ia, ja, ar), arrays start at index 1
+                lib.glp_load_matrix.argtypes = [ctypes.c_void_p, ctypes.c_int, ctypes.c_void_p, ctypes.c_void_p,
+                                                ctypes.c_void_p]
+                lib.glp_load_matrix.restype = None
+
+                rv = lib
+            except (OSError, AttributeError):
+                pass
+
+        # assigned once, so other threads never see a partial value (the lookup itself is safe to repeat)
+        get_glpk_cdll.lib = rv
+
+    return get_glpk_cdll.lib
+
+def get_nogil_simplex():
+    '''get glp_simplex through ctypes, which releases the GIL during the call (swiglpk calls hold it), or None
+
+    this is None if glpk is not thread safe (see glpk_thread_safe())
+    '''
+
+    if not hasattr(get_nogil_simplex, 'func'):
+        lib = get_glpk_cdll()
+        func = None if lib is None or not glpk_thread_safe() else lib.glp_simplex
+
+        if lib is None and Settings.PRINT_OUTPUT:
+            print("Warning: glp_simplex not found with ctypes; LPs will hold the GIL with BACKEND_THREADS")
+
+        get_nogil_simplex.func = func
+
+    return get_nogil_simplex.func
+
+def run_simplex(lp, params, inherited=False):
+    '''call glp_simplex, and count it in SIMPLEX_STATS
+
+    inherited is True if the starting basis was kept from the parent lp (see LpInstanceGLPK.inherited_basis)
+
+    with Settings.BACKEND_THREADS, the GIL is released during the call (if glpk is thread safe, see
+    get_nogil_simplex()), so that LPs in other worker threads run at the same time
+    '''
+
+    func = get_nogil_simplex() if Settings.WORKER_BACKEND == Settings.BACKEND_THREADS else None
+    start_iterations = glpk.glp_get_it_cnt(lp) if HAS_IT_CNT else 0
+
+    if func is None:
+        rv = glpk.glp_simplex(lp, params)
+    else:
+        # swig pointer objects convert to their address
+        rv = func(int(lp), int(params.this))
+
+    iterations = glpk.glp_get_it_cnt(lp) - start_iterations if HAS_IT_CNT else 0
+    SIMPLEX_STATS.add(iterations, inherited)
 
     return rv
 
@@ -58,6 +227,7 @@ class LpInstanceGLPK(Freezable):
     'Linear programming wrapper using glpk (through swiglpk python interface)'
 
     lp_time_limit_sec = 15.0
+    inherited_basis = False # default for instances pickled before the attribute existed
 
     def __init__(self, other_lpi=None):
         'initialize the lp instance'
@@ -68,15 +238,20 @@ class LpInstanceGLPK(Freezable):
             # internal bookkeeping
             self.names = [] # column names
 
+            # is the basis kept from a parent lp, and not used by a minimize yet? (counted in SIMPLEX_STATS)
+            self.inherited_basis = False
+
             # setup lp params
         else:
             # initialize from other lpi
             self.names = other_lpi.names.copy()
                 
             Timers.tic('glp_copy_prob')
-            glpk.glp_copy_prob(self.lp, other_lpi.lp, glpk.GLP_OFF)
+            glpk.glp_copy_prob(self.lp, other_lpi.lp, glpk.GLP_OFF) # this copies the row and column basis status
             Timers.toc('glp_copy_prob')
 
+            self.inherited_basis = True
+
         self.freeze_attrs()
 
     def __del__(self):
@@ -88,56 +263,92 @@ class LpInstanceGLPK(Freezable):
             self.lp = None
 
     def serialize(self):
-        'serialize self.lp from a glpk instance into a tuple'
+        '''serialize self.lp from a glpk instance into a tuple of numpy arrays
+
+        the tuple is (data, indices, indptr, rhs, col_bounds, row_stat, col_stat): the constraints matrix in csr form
+        (with 0-based column indices), the rhs of each row, the (lb, ub) of each column, and the basis status of each
+        row and column, so that deserialize() can warm-start from the same basis
+        '''
 
         Timers.tic('serialize')
 
-        # get constraints as csr matrix
-        lp_rows = self.get_num_rows()
-        lp_cols = self.get_num_cols()
+        data, indices, indptr = self._get_csr_arrays()
+        rhs = self.get_rhs()
+        col_bounds = self._get_col_bounds()
+
+        row_stat = np.array([glpk.glp_get_row_stat(self.lp, row + 1) for row in range(len(rhs))], dtype=np.int8)
+        col_stat = np.array([glpk.glp_get_col_stat(self.lp, col + 1) for col in range(len(col_bounds))],
+                            dtype=np.int8)
 
-        inds_row = SwigArray.get_int_array(lp_cols + 1)
-        vals_row = SwigArray.get_double_array(lp_cols + 1)
+        # remember to free lp object before overwriting with tuple
+        glpk.glp_delete_prob(self.lp)
+        self.lp = (data, indices, indptr, rhs, col_bounds, row_stat, col_stat)
 
-        data = []
-        glpk_indices = []
-        indptr = [0]
+        Timers.toc('serialize')
 
-        for row in range(lp_rows):
-            got_len = glpk.glp_get_mat_row(self.lp, row + 1, inds_row, vals_row)
+    def _get_csr_arrays(self):
+        'get the constraints matrix as csr arrays (data, indices, indptr), with 0-based column indices'
 
-            for i in range(1, got_len+1):
-                data.append(vals_row[i])
-                glpk_indices.append(inds_row[i])
+        lp_rows = self.get_num_rows()
+        nnz = glpk.glp_get_num_nz(self.lp)
+        lib = get_glpk_cdll()
+
+        # glpk fills each row from index 1, so a row's values go one entry past the pointer passed in
+        vals = np.zeros((nnz + 1,), dtype=float)
+        inds = np.zeros((nnz + 1,), dtype=np.int32)
+        indptr = np.zeros((lp_rows + 1,), dtype=np.int32)
+        count = 0
+
+        if lib is not None:
+            lp_ptr = int(self.lp) # swig pointer objects convert to their address
+            vals_ptr = vals.ctypes.data
+            inds_ptr = inds.ctypes.data
+
+            for row in range(lp_rows):
+                count += lib.glp_get_mat_row(lp_ptr, row + 1, inds_ptr + inds.itemsize * count,
+                                             vals_ptr + vals.itemsize * count)
+                indptr[row + 1] = count
+        else:
+            lp_cols = self.get_num_cols()
+            inds_row = SwigArray.get_int_array(lp_cols + 1)
+            vals_row = SwigArray.get_double_array(lp_cols + 1)
 
-            indptr.append(len(data))
-            
-        # rhs
-        rhs = []
-        
-        for row in range(lp_rows):
-            assert glpk.glp_get_row_type(self.lp, row + 1) == glpk.GLP_UP
+            for row in range(lp_rows):
+                got_len = glpk.glp_get_mat_row(self.lp, row + 1, inds_row, vals_row)
 
-            rhs.append(glpk.glp_get_row_ub(self.lp, row + 1))
+                for i in range(1, got_len + 1):
+                    vals[count + i] = vals_row[i]
+                    inds[count + i] = inds_row[i]
 
-        col_bounds = self._get_col_bounds()
+                count += got_len
+                indptr[row + 1] = count
 
-        # remember to free lp object before overwriting with tuple
-        glpk.glp_delete_prob(self.lp)
-        self.lp = (data, glpk_indices, indptr, rhs, col_bounds)
+        assert count == nnz, f"got {count} nonzeros, expected {nnz}"
 
-        Timers.toc('serialize')
+        return vals[1:], inds[1:] - 1, indptr
+
+    def tighten_col_bounds(self, bounds):
+        '''tighten the column bounds to the given list of (lb, ub), one for each column
+
+        bounds that are looser than the lp's current ones (or that cross due to numerical error) are not changed
+        '''
+
+        assert len(bounds) == self.get_num_cols()
 
-    # removed this, as get_col_bounds shouldn't be used externally
-    #def set_col_bounds(self, col, lb, ub):
-    #    'set double-bounded column bounds'
+        for col, ((lb, ub), (cur_lb, cur_ub)) in enumerate(zip(bounds, self._get_col_bounds())):
+            lb = max(float(lb), cur_lb)
+            ub = min(float(ub), cur_ub)
 
-    #    col_type = glpk.glp_get_col_type(self.lp, col + 1)
+            if (lb == cur_lb and ub == cur_ub) or lb > ub:
+                continue
 
-    #    if col_type != glpk.GLP_DB:
-    #        print(f"Warning: Contract col {col} to {lb, ub} skipped (col type is not GLP_DB):\n{self}")
-    #    else:
-    #        glpk.glp_set_col_bnds(self.lp, col + 1, glpk.GLP_DB, lb, ub)  # double-bounded variable
+            # glpk changes the status of a non-basic column if it doesn't match the new type, so the basis stays valid
+            if lb == ub:
+                glpk.glp_set_col_bnds(self.lp, col + 1, glpk.GLP_FX, lb, ub)  # fixed variable
+            elif ub == np.inf:
+                glpk.glp_set_col_bnds(self.lp, col + 1, glpk.GLP_LO, lb, ub)  # lower-bounded variable
+            else:
+                glpk.glp_set_col_bnds(self.lp, col + 1, glpk.GLP_DB, lb, ub)  # double-bounded variable
 
     def _get_col_bounds(self):
         '''get column bounds
@@ -148,7 +359,7 @@ class LpInstanceGLPK(Freezable):
         lp_cols = self.get_num_cols()
 
         # column lower and upper bounds
-        col_bounds = []
+        col_bounds = np.zeros((lp_cols, 2), dtype=float)
         
         for col in range(lp_cols):
             col_type = glpk.glp_get_col_type(self.lp, col + 1)
@@ -166,7 +377,7 @@ class LpInstanceGLPK(Freezable):
             else:
                 assert col_type == glpk.GLP_FR, "unsupported col type in _get_col_bounds()"
 
-            col_bounds.append((lb, ub))
+            col_bounds[col] = lb, ub
 
         return col_bounds
 
@@ -177,40 +388,84 @@ class LpInstanceGLPK(Freezable):
 
         Timers.tic('deserialize')
 
-        data, glpk_indices, indptr, rhs, col_bounds = self.lp
+        if len(self.lp) == 7:
+            data, indices, indptr, rhs, col_bounds, row_stat, col_stat = self.lp
+        else:
+            data, indices, indptr, rhs, col_bounds = self.lp
+            row_stat = col_stat = None
 
-        self.lp = glpk.glp_create_prob()
+        if isinstance(data, list):
+            # serialized with lists and 1-based indices (for example, in an older checkpoint)
+            data = np.array(data, dtype=float)
+            indices = np.array(indices, dtype=np.int32) - 1
+            indptr = np.array(indptr, dtype=np.int32)
+            rhs = np.array(rhs, dtype=float)
 
-        # add cols
-        names = self.names
-        self.names = [] # adding columns populates self.names
+        self.lp = glpk.glp_create_prob()
 
+        # add cols, all at once
         num_cols = len(col_bounds)
+        assert num_cols == len(self.names)
+
+        if num_cols > 0:
+            glpk.glp_add_cols(self.lp, num_cols)
 
-        for i, (lb, ub) in enumerate(col_bounds):
-            name = names[i]
+        for col, (lb, ub) in enumerate(col_bounds):
+            lb = float(lb)
+            ub = float(ub)
 
             if ub == np.inf:
                 if lb == -np.inf:
-                    # free variable
-                    self.add_cols([name])
+                    glpk.glp_set_col_bnds(self.lp, col + 1, glpk.GLP_FR, 0, 0) # free variable
                 else:
-                    assert lb == 0
-
-                    self.add_positive_cols([name])
+                    glpk.glp_set_col_bnds(self.lp, col + 1, glpk.GLP_LO, lb, 0) # lower-bounded variable
+            elif lb == ub:
+                glpk.glp_set_col_bnds(self.lp, col + 1, glpk.GLP_FX, lb, ub) # fixed variable
             else:
-                self.add_double_bounded_cols([name], lb, ub)
+                glpk.glp_set_col_bnds(self.lp, col + 1, glpk.GLP_DB, lb, ub) # double-bounded variable
 
         # add rows
         num_rows = len(rhs)
-        self.add_rows_less_equal(rhs)
+        self.add_rows_less_equal(np.asarray(rhs, dtype=float))
 
         # set constraints
-        shape = (num_rows, num_cols)
-        self.set_constraints_csr(data, glpk_indices, indptr, shape)
+        self._load_csr_arrays(data, indices, indptr, (num_rows, num_cols))
+
+        # restore the basis (new rows are basic and new columns are non-basic otherwise)
+        if row_stat is not None:
+            for row, stat in enumerate(row_stat):
+                if stat != glpk.GLP_BS:
+                    glpk.glp_set_row_stat(self.lp, row + 1, int(stat))
+
+            for col, stat in enumerate(col_stat):
+                if stat != glpk.GLP_NS:
+                    glpk.glp_set_col_stat(self.lp, col + 1, int(stat))
+
+            self.inherited_basis = True
 
         Timers.toc('deserialize')
 
+    def _load_csr_arrays(self, data, indices, indptr, shape):
+        'set the constraints matrix of an lp that has no constraints from csr arrays, with 0-based column indices'
+
+        lib = get_glpk_cdll()
+        nnz = len(data)
+
+        if lib is None:
+            self.set_constraints_csr(list(map(float, data)), [int(i) + 1 for i in indices], list(indptr), shape)
+        elif nnz > 0:
+            # glp_load_matrix loads the whole matrix in one call, from 1-based (row, col, value) triplets
+            ia = np.zeros((nnz + 1,), dtype=np.int32)
+            ja = np.zeros((nnz + 1,), dtype=np.int32)
+            ar = np.zeros((nnz + 1,), dtype=float)
+
+            ia[1:] = np.repeat(np.arange(1, shape[0] + 1, dtype=np.int32), np.diff(indptr))
+            ja[1:] = indices
+            ja[1:] += 1
+            ar[1:] = data
+
+            lib.glp_load_matrix(int(self.lp), nnz, ia.ctypes.data, ja.ctypes.data, ar.ctypes.data)
+
     def _column_names_str(self):
         'get the line in __str__ for the column names'
 
@@ -377,6 +632,11 @@ class LpInstanceGLPK(Freezable):
 
         return glpk.glp_get_num_rows(self.lp)
 
+    def get_num_nonzeros(self):
+        'get the number of nonzeros in the constraints matrix'
+
+        return glpk.glp_get_num_nz(self.lp)
+
     def get_num_cols(self):
         'get the number of columns in the lp'
 
@@ -400,7 +660,8 @@ class LpInstanceGLPK(Freezable):
         if rhs_vec.shape[0] > 0:
             num_rows = glpk.glp_get_num_rows(self.lp)
 
-            # create new row for each constraint
+            # create new row for each constraint, these are basic, so a row added to a copied lp (a split) keeps the
+            # copied basis valid
             glpk.glp_add_rows(self.lp, len(rhs_vec))
 
             for i, rhs in enumerate(rhs_vec):
@@ -474,13 +735,12 @@ class LpInstanceGLPK(Freezable):
                     assert lb < ub
                     glpk.glp_set_col_bnds(self.lp, num_cols + i + 1, glpk.GLP_DB, lb, ub)  # double-bounded variable
 
+    @hot_timed('add_dense_row')
     def add_dense_row(self, vec, rhs, normalize=True):
         '''
         add a row from a dense nd.array, row <= rhs
         '''
 
-        Timers.tic('add_dense_row')
-
         assert isinstance(vec, np.ndarray)
         assert len(vec.shape) == 1 or vec.shape[0] == 1
         assert len(vec) == self.get_num_cols(), f"vec had {len(vec)} values, but lpi has {self.get_num_cols()} cols"
@@ -501,8 +761,6 @@ class LpInstanceGLPK(Freezable):
 
         glpk.glp_set_mat_row(self.lp, rows_before + 1, vec.size, indices_vec, data_vec)
 
-        Timers.toc('add_dense_row')
-
     def set_constraints_csr(self, data, glpk_indices, indptr, shape):
         '''
         set the constrains row by row to be equal to the passed-in csr matrix attribues
@@ -535,6 +793,24 @@ class LpInstanceGLPK(Freezable):
 
         Timers.toc('set_constraints_csr')
 
+    def del_rows(self, row_indices):
+        '''delete the rows with the given (0-based) indices
+
+        the basis is kept if the deleted rows are basic (which redundant rows usually are), and reset otherwise
+        '''
+
+        num_rows = len(row_indices)
+
+        if num_rows > 0:
+            keeps_basis = all(glpk.glp_get_row_stat(self.lp, int(row) + 1) == glpk.GLP_BS for row in row_indices)
+
+            # glpk reads the row numbers from index 1
+            rows_vec = SwigArray.as_int_array([int(row) + 1 for row in row_indices], num_rows)
+            glpk.glp_del_rows(self.lp, num_rows, rows_vec)
+
+            if not keeps_basis:
+                self.reset_basis()
+
     def get_rhs(self, row_indices=None):
         '''get the rhs vector of the constraints
         row_indices - a list of requested indices (None=all)
@@ -571,26 +847,7 @@ class LpInstanceGLPK(Freezable):
 
         lp_rows = self.get_num_rows()
         lp_cols = self.get_num_cols()
-        nnz = glpk.glp_get_num_nz(self.lp)
-
-        data = np.zeros((nnz,), dtype=float)
-        inds = np.zeros((nnz,), dtype=np.int32)
-        indptr = np.zeros((lp_rows+1,), dtype=np.int32)
-
-        inds_row = SwigArray.get_int_array(lp_cols + 1)
-        vals_row = SwigArray.get_double_array(lp_cols + 1)
-        data_index = 0
-        indptr[0] = 0
-
-        for row in range(1, lp_rows + 1):
-            got_len = glpk.glp_get_mat_row(self.lp, row, inds_row, vals_row)
-
-            for i in range(1, got_len + 1):
-                data[data_index] = vals_row[i]
-                inds[data_index] = inds_row[i] - 1
-                data_index += 1
-
-            indptr[row] = data_index
+        data, inds, indptr = self._get_csr_arrays()
 
         csr_mat = csr_matrix((data, inds, indptr), shape=(lp_rows, lp_cols), dtype=float)
         csr_mat.check_format()
@@ -666,11 +923,16 @@ class LpInstanceGLPK(Freezable):
 
         self.set_minimize_direction(direction_vec)
 
+        inherited = self.inherited_basis and not Settings.GLPK_RESET_BEFORE_MINIMIZE
+        self.inherited_basis = False
+
         if Settings.GLPK_RESET_BEFORE_MINIMIZE:
             self.reset_basis()
+
+        params = get_dual_lp_params() if inherited and Settings.GLPK_INHERITED_DUAL else get_lp_params()
         
         start = time.perf_counter()
-        simplex_res = glpk.glp_simplex(self.lp, get_lp_params())
+        simplex_res = run_simplex(self.lp, params, inherited)
 
         if simplex_res != 0: # solver failure (possibly timeout)
             r = self.get_num_rows()
@@ -683,7 +945,7 @@ class LpInstanceGLPK(Freezable):
             print("Retrying with reset")
             self.reset_basis()
             start = time.perf_counter()
-            simplex_res = glpk.glp_simplex(self.lp, get_lp_params())
+            simplex_res = run_simplex(self.lp, get_lp_params())
             diff = time.perf_counter() - start
             print(f"result with reset  ({simplex_res}) {round(diff, 3)} sec")
 
@@ -693,7 +955,7 @@ class LpInstanceGLPK(Freezable):
             params = get_lp_params(alternate_lp_params=True)
             self.reset_basis()
             start = time.perf_counter()
-            simplex_res = glpk.glp_simplex(self.lp, params)
+            simplex_res = run_simplex(self.lp, params)
             diff = time.perf_counter() - start
             print(f"result with reset & alternate settings ({simplex_res}) {round(diff, 3)} sec")
             
@@ -731,6 +993,62 @@ class LpInstanceGLPK(Freezable):
 
         return rv
 
+    def minimize_batch(self, direction_mat, stop_values=None):
+        '''minimize the lp in each of the directions (the rows of direction_mat), back to back from the same basis
+
+        if stop_values is not None, the lp of row r stops early once its minimum is known to be at least
+        stop_values[r] (see get_batch_lp_params()). Its value is then a lower bound on the minimum that is at least
+        stop_values[r], and it has no minimizing point.
+
+        returns an array with a row for each direction: the minimum (column 0) and the minimizing point (the other
+        columns, nan if the lp stopped early)
+        '''
+
+        assert not isinstance(self.lp, tuple), "self.lp was tuple. Did you call lpi.deserialize()?"
+
+        num_cols = self.get_num_cols()
+        rv = np.full((len(direction_mat), 1 + num_cols), np.nan)
+        params = get_lp_params() if stop_values is None else get_batch_lp_params()
+        prev_direction = None
+
+        inherited = self.inherited_basis and not Settings.GLPK_RESET_BEFORE_MINIMIZE
+        self.inherited_basis = False
+
+        for r, direction in enumerate(direction_mat):
+            if prev_direction is None:
+                self.set_minimize_direction(direction)
+            else:
+                # only assign the coefficients that changed
+                for i in np.nonzero(direction != prev_direction)[0]:
+                    glpk.glp_set_obj_coef(self.lp, int(1 + i), float(direction[i]))
+
+            prev_direction = direction
+
+            if Settings.GLPK_RESET_BEFORE_MINIMIZE:
+                self.reset_basis()
+
+            if stop_values is not None:
+                params.obj_ul = float(stop_values[r])
+
+            simplex_res = run_simplex(self.lp, params, inherited and r == 0)
+
+            if simplex_res == glpk.GLP_EOBJUL:
+                # stopped early; the basis is dual feasible, so the objective is a lower bound
+                rv[r, 0] = glpk.glp_get_obj_val(self.lp)
+            elif simplex_res == 0 and glpk.glp_get_status(self.lp) == glpk.GLP_OPT:
+                rv[r, 0] = glpk.glp_get_obj_val(self.lp)
+
+                for col in range(num_cols):
+                    rv[r, 1 + col] = glpk.glp_get_col_prim(self.lp, int(1 + col))
+            else:
+                # solver failure or infeasible: minimize() retries, and raises UnsatError if it's still infeasible
+                res = self.minimize(direction)
+
+                rv[r, 0] = np.dot(direction, res)
+                rv[r, 1:] = res
+
+        return rv
+
     @staticmethod
     def get_simplex_error_string(simplex_res):
         '''get the error message when simplex() fails'''
@@ -845,43 +1163,59 @@ class SwigArray():
     '''
     This is my workaround to fix a memory leak in swig arrays, see: https://github.com/biosustain/swiglpk/issues/31)
 
-    The general idea is to only allocate a single time for each type, and reuse the array
+    The general idea is to only allocate a single time for each type, and reuse the array. The arrays are kept per
+    thread, since worker threads (Settings.BACKEND_THREADS) would otherwise overwrite each other's arrays.
     '''
 
-    dbl_array = []
-    dbl_array_size = -1
+    local = threading.local() # dbl_array, int_array and seq_array, with their sizes
+
+    @classmethod
+    def get_local(cls):
+        'get this thread\'s arrays, creating them on the first call'
+
+        rv = cls.local
+
+        if not hasattr(rv, 'dbl_array'):
+            rv.dbl_array = []
+            rv.dbl_array_size = -1
 
-    int_array = []
-    int_array_size = -1
+            rv.int_array = []
+            rv.int_array_size = -1
 
-    seq_array = []
-    seq_array_size = -1
+            rv.seq_array = []
+            rv.seq_array_size = -1
+
+        return rv
 
     @classmethod
     def get_double_array(cls, size):
         'get a double array of the requested size (or greater)'
 
-        if size > cls.dbl_array_size:
-            cls.dbl_array_size = 2**math.ceil(math.log(size, 2)) # allocate in multiples of two
-            cls.dbl_array = glpk.doubleArray(cls.dbl_array_size)
+        loc = cls.get_local()
+
+        if size > loc.dbl_array_size:
+            loc.dbl_array_size = 2**math.ceil(math.log(size, 2)) # allocate in multiples of two
+            loc.dbl_array = glpk.doubleArray(loc.dbl_array_size)
 
-            #print(f"allocated dbl array of size {cls.dbl_array_size} (requested {size})")
+            #print(f"allocated dbl array of size {loc.dbl_array_size} (requested {size})")
 
-        return cls.dbl_array
+        return loc.dbl_array
 
     @classmethod
     def get_int_array(cls, size):
         'get a int array of the requested size (or greater)'
 
-        if size > cls.int_array_size:
-            cls.int_array_size = 2**math.ceil(math.log(size, 2)) # allocate in multiples of two
-            cls.int_array = glpk.intArray(cls.int_array_size)
+        loc = cls.get_local()
 
-            #print(f".allocated int array of size {cls.int_array_size} (requested {size})")
+        if size > loc.int_array_size:
+            loc.int_array_size = 2**math.ceil(math.log(size, 2)) # allocate in multiples of two
+            loc.int_array = glpk.intArray(loc.int_array_size)
 
-        #print(f".returning {cls.int_array} of size {cls.int_array_size} (requested {size})")
+            #print(f".allocated int array of size {loc.int_array_size} (requested {size})")
 
-        return cls.int_array
+        #print(f".returning {loc.int_array} of size {loc.int_array_size} (requested {size})")
+
+        return loc.int_array
 
     @classmethod
     def as_double_array(cls, list_data, size):
@@ -912,13 +1246,15 @@ class SwigArray():
     def get_sequential_int_array(cls, size):
         'creates or returns a swig int array that counts from 1, 2, 3, 4, .. size'
 
-        if size > (cls.seq_array_size - 1):
-            cls.seq_array_size = 1 + 2**math.ceil(math.log(size, 2)) # allocate in multiples of two
-            cls.seq_array = glpk.intArray(cls.seq_array_size)
+        loc = cls.get_local()
+
+        if size > (loc.seq_array_size - 1):
+            loc.seq_array_size = 1 + 2**math.ceil(math.log(size, 2)) # allocate in multiples of two
+            loc.seq_array = glpk.intArray(loc.seq_array_size)
 
-            #print(f"allocated seq array of size {cls.seq_array_size} (requested {size})")
+            #print(f"allocated seq array of size {loc.seq_array_size} (requested {size})")
 
-            for i in range(cls.seq_array_size):
-                cls.seq_array[i] = i
+            for i in range(loc.seq_array_size):
+                loc.seq_array[i] = i
 
-        return cls.seq_array
+        return loc.seq_array
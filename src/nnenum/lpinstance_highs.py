@@ -0,0 +1,484 @@
+'''
+HiGHS python interface using highspy (Settings.LP_SOLVER = 'HiGHS')
+
+The lps are solved with the dual simplex method without presolve, so that each Highs object keeps its basis and
+factorization between calls: re-solving after changing the objective or adding a row (a split) is hot-started. The
+basis is also kept when an lp is copied or serialized, like in lpinstance_glpk.py.
+
+Stanley Bak
+'''
+
+import time
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+import highspy
+
+from nnenum.util import Freezable
+from nnenum.timerutil import Timers, hot_timed
+from nnenum.settings import Settings
+from nnenum.lputil import SIMPLEX_STATS
+
+def make_highs():
+    'make a Highs object with the options used for all lps'
+
+    lp = highspy.Highs()
+
+    lp.setOptionValue('output_flag', False)
+    lp.setOptionValue('presolve', 'off') # presolve would discard the basis on each run
+    lp.setOptionValue('solver', 'simplex')
+    lp.setOptionValue('simplex_strategy', 1) # dual simplex: hot starts after adding rows, sound objective bounds
+    lp.setOptionValue('time_limit', float(LpInstanceHiGHS.lp_time_limit_sec))
+
+    return lp
+
+def run_highs(lp, inherited=False):
+    '''run the solver on a Highs object, counting the call in SIMPLEX_STATS
+
+    returns the HighsModelStatus
+    '''
+
+    lp.run()
+    SIMPLEX_STATS.add(lp.getInfo().simplex_iteration_count, inherited)
+
+    return lp.getModelStatus()
+
+class LpInstanceHiGHS(Freezable):
+    'Linear programming wrapper using HiGHS (through the highspy python interface)'
+
+    lp_time_limit_sec = 15.0
+    inherited_basis = False
+
+    def __init__(self, other_lpi=None):
+        'initialize the lp instance'
+
+        self.lp = make_highs()
+
+        if other_lpi is None:
+            self.names = [] # column names
+
+            # is the basis kept from a parent lp, and not used by a minimize yet? (counted in SIMPLEX_STATS)
+            self.inherited_basis = False
+        else:
+            # initialize from other lpi
+            self.names = other_lpi.names.copy()
+
+            Timers.tic('highs_copy_model')
+            self.lp.passModel(other_lpi.lp.getLp())
+            basis = other_lpi.lp.getBasis()
+
+            if basis.valid:
+                self.lp.setBasis(basis)
+
+            Timers.toc('highs_copy_model')
+
+            self.inherited_basis = basis.valid
+
+        self.freeze_attrs()
+
+    def serialize(self):
+        '''serialize self.lp from a Highs object into a tuple of numpy arrays
+
+        the tuple has the same layout as LpInstanceGLPK.serialize(): (data, indices, indptr, rhs, col_bounds, row_stat,
+        col_stat), where the basis statuses are HighsBasisStatus values (or empty arrays if there is no basis yet)
+        '''
+
+        Timers.tic('serialize')
+
+        csr = self.get_constraints_csr()
+        rhs = self.get_rhs()
+        col_bounds = np.array(self.get_col_bounds(), dtype=float).T.reshape((len(self.names), 2))
+
+        basis = self.lp.getBasis()
+
+        if basis.valid:
+            row_stat = np.array([int(s) for s in basis.row_status], dtype=np.int8)
+            col_stat = np.array([int(s) for s in basis.col_status], dtype=np.int8)
+        else:
+            row_stat = col_stat = np.zeros((0,), dtype=np.int8)
+
+        self.lp = (csr.data, csr.indices, csr.indptr, rhs, col_bounds, row_stat, col_stat)
+
+        Timers.toc('serialize')
+
+    def deserialize(self):
+        'deserialize self.lp from a tuple into a Highs object'
+
+        assert isinstance(self.lp, tuple)
+
+        Timers.tic('deserialize')
+
+        data, indices, indptr, rhs, col_bounds, row_stat, col_stat = self.lp
+        num_rows = len(rhs)
+        num_cols = len(col_bounds)
+
+        self.lp = make_highs()
+
+        if num_cols > 0:
+            self.lp.addVars(num_cols, col_bounds[:, 0], col_bounds[:, 1])
+
+        if num_rows > 0:
+            self.lp.addRows(num_rows, np.full(num_rows, -highspy.kHighsInf), rhs, len(data),
+                            indptr[:-1].astype(np.int32), indices.astype(np.int32), data.astype(float))
+
+        if len(row_stat) > 0:
+            basis = self.lp.getBasis()
+            basis.row_status = [highspy.HighsBasisStatus(int(s)) for s in row_stat]
+            basis.col_status = [highspy.HighsBasisStatus(int(s)) for s in col_stat]
+            basis.valid = True
+
+            self.lp.setBasis(basis)
+            self.inherited_basis = True
+
+        Timers.toc('deserialize')
+
+    def __str__(self, plain_text=False):
+        'get the LP as string (useful for debugging)'
+
+        rows = self.get_num_rows()
+        cols = self.get_num_cols()
+        rv = f"Lp has {cols} columns (variables) and {rows} rows (constraints)\n"
+
+        csr = self.get_constraints_csr()
+        rhs = self.get_rhs()
+        lbs, ubs = self.get_col_bounds()
+
+        for row in range(rows):
+            rv += f"{csr[row].toarray()[0]} <= {rhs[row]}\n"
+
+        for col, name in enumerate(self.names):
+            rv += f"{lbs[col]} <= {name} <= {ubs[col]}\n"
+
+        return rv
+
+    def get_num_rows(self):
+        'get the number of rows in the lp'
+
+        return self.lp.getNumRow()
+
+    def get_num_nonzeros(self):
+        'get the number of nonzeros in the constraints matrix'
+
+        return self.lp.getNumNz()
+
+    def get_num_cols(self):
+        'get the number of columns in the lp'
+
+        cols = self.lp.getNumCol()
+
+        assert cols == len(self.names), f"lp had {cols} columns, but names list had {len(self.names)} names"
+
+        return cols
+
+    def add_rows_less_equal(self, rhs_vec):
+        '''add rows to the LP with <= constraints and no nonzeros
+
+        rhs_vector is the right-hand-side values of the constriants
+        '''
+
+        if isinstance(rhs_vec, list):
+            rhs_vec = np.array(rhs_vec, dtype=float)
+
+        assert isinstance(rhs_vec, np.ndarray) and len(rhs_vec.shape) == 1, "expected 1-d right-hand-side vector"
+
+        num_rows = rhs_vec.shape[0]
+
+        if num_rows > 0:
+            self.lp.addRows(num_rows, np.full(num_rows, -highspy.kHighsInf), rhs_vec, 0,
+                            np.zeros(num_rows, dtype=np.int32), np.zeros(0, dtype=np.int32), np.zeros(0))
+
+    def _add_cols(self, names, lb, ub):
+        'add columns with the given bounds'
+
+        assert isinstance(names, list)
+        num_vars = len(names)
+
+        if num_vars > 0:
+            self.names += names
+            self.lp.addVars(num_vars, np.full(num_vars, lb, dtype=float), np.full(num_vars, ub, dtype=float))
+
+    def add_positive_cols(self, names):
+        'add a certain number of columns to the LP with positive bounds'
+
+        self._add_cols(names, 0, highspy.kHighsInf)
+
+    def add_cols(self, names):
+        'add a certain number of columns to the LP'
+
+        self._add_cols(names, -highspy.kHighsInf, highspy.kHighsInf)
+
+    def add_double_bounded_cols(self, names, lb, ub):
+        'add a certain number of columns to the LP with the given lower and upper bound'
+
+        assert lb != -np.inf
+
+        lb = float(lb)
+        ub = float(ub)
+        assert lb <= ub, f"lb ({lb}) <= ub ({ub}). dif: {ub - lb}"
+
+        self._add_cols(names, lb, min(ub, highspy.kHighsInf))
+
+    @hot_timed('add_dense_row')
+    def add_dense_row(self, vec, rhs, normalize=True):
+        '''
+        add a row from a dense nd.array, row <= rhs
+        '''
+
+        assert isinstance(vec, np.ndarray)
+        assert len(vec.shape) == 1 or vec.shape[0] == 1
+        assert len(vec) == self.get_num_cols(), f"vec had {len(vec)} values, but lpi has {self.get_num_cols()} cols"
+
+        if normalize and not Settings.SKIP_CONSTRAINT_NORMALIZATION:
+            norm = np.linalg.norm(vec)
+
+            if norm > 1e-9:
+                vec = vec / norm
+                rhs = rhs / norm
+
+        vec = vec.reshape(-1)
+
+        self.lp.addRow(-highspy.kHighsInf, float(rhs), vec.size, np.arange(vec.size, dtype=np.int32),
+                       vec.astype(float))
+
+    def tighten_col_bounds(self, bounds):
+        '''tighten the column bounds to the given list of (lb, ub), one for each column
+
+        bounds that are looser than the lp's current ones (or that cross due to numerical error) are not changed
+        '''
+
+        num_cols = self.get_num_cols()
+        assert len(bounds) == num_cols
+
+        cur_lbs, cur_ubs = self.get_col_bounds()
+        bounds = np.array(bounds, dtype=float).reshape((num_cols, 2))
+        lbs = np.maximum(bounds[:, 0], cur_lbs)
+        ubs = np.minimum(bounds[:, 1], cur_ubs)
+
+        crossed = lbs > ubs
+        lbs[crossed] = cur_lbs[crossed]
+        ubs[crossed] = cur_ubs[crossed]
+
+        self.lp.changeColsBounds(num_cols, np.arange(num_cols, dtype=np.int32), lbs, ubs)
+
+    def del_rows(self, row_indices):
+        'delete the rows with the given (0-based) indices (highs keeps the basis if it stays valid)'
+
+        if len(row_indices) > 0:
+            self.lp.deleteRows(len(row_indices), np.array(row_indices, dtype=np.int32))
+
+    def get_col_bounds(self):
+        'get the column bounds, as a pair of arrays (lbs, ubs)'
+
+        num_cols = self.get_num_cols()
+        rv = np.zeros(0), np.zeros(0)
+
+        # getLp() would copy the whole model, so only the needed arrays are queried
+        if num_cols > 0:
+            _, _, _, lbs, ubs, _ = self.lp.getCols(num_cols, np.arange(num_cols, dtype=np.int32))
+            rv = np.array(lbs, dtype=float), np.array(ubs, dtype=float)
+
+        return rv
+
+    def get_rhs(self, row_indices=None):
+        '''get the rhs vector of the constraints
+        row_indices - a list of requested indices (None=all)
+        this returns an np.array of rhs values for the requested indices
+        '''
+
+        if row_indices is None:
+            row_indices = np.arange(self.get_num_rows(), dtype=np.int32)
+        else:
+            row_indices = np.array(row_indices, dtype=np.int32)
+
+        rv = np.zeros(0)
+
+        if row_indices.size > 0:
+            _, _, _, ubs, _ = self.lp.getRows(row_indices.size, row_indices)
+            rv = np.array(ubs, dtype=float)
+
+        return rv
+
+    def set_rhs(self, rhs_vec):
+        'set (overwrite) the rhs for exising rows'
+
+        num_rows = self.get_num_rows()
+        assert rhs_vec.size == num_rows
+
+        self.lp.changeRowsBounds(num_rows, np.arange(num_rows, dtype=np.int32),
+                                 np.full(num_rows, -highspy.kHighsInf), np.array(rhs_vec, dtype=float))
+
+    def get_constraints_csr(self):
+        '''get the LP matrix as a csr_matrix
+        '''
+
+        lp_rows = self.get_num_rows()
+        lp_cols = self.get_num_cols()
+
+        if lp_rows == 0:
+            csr_mat = csr_matrix((lp_rows, lp_cols))
+        else:
+            _, start, index, value = self.lp.getRowsEntries(lp_rows, np.arange(lp_rows, dtype=np.int32))
+            indptr = np.append(np.array(start, dtype=np.int32), len(index))
+
+            csr_mat = csr_matrix((np.array(value, dtype=float), np.array(index, dtype=np.int32), indptr),
+                                 shape=(lp_rows, lp_cols))
+
+        csr_mat.check_format()
+
+        return csr_mat
+
+    def is_feasible(self):
+        '''check if the lp is feasible
+
+        returns a feasible point or None
+        '''
+
+        return self.minimize(None, fail_on_unsat=False) is not None
+
+    def contains_point(self, pt, tol=1e-9):
+        '''does this lpi contain the point?
+        this is slow, will pull the constraints and check them
+        '''
+
+        print("Warning: called lpi.contains_point() (slow, used for testing)")
+
+        vec = self.get_constraints_csr().dot(pt)
+        rhs = self.get_rhs()
+
+        assert vec.size == rhs.size
+
+        # all rows are upper bounds
+        return bool(np.all(vec - tol <= rhs))
+
+    def set_minimize_direction(self, direction):
+        '''set the optimization direction'''
+
+        num_cols = self.get_num_cols()
+
+        assert len(direction) == num_cols, f"expected {num_cols} cols, but optimization " + \
+            f"vector had {len(direction)} variables"
+
+        self.lp.changeColsCost(num_cols, np.arange(num_cols, dtype=np.int32), np.array(direction, dtype=float))
+
+    def reset_basis(self):
+        'discard the lp basis, so the next run starts from scratch'
+
+        self.lp.clearSolver()
+
+    def _solve(self, inherited=False):
+        '''run the solver, retrying from scratch if it fails
+
+        returns True if the lp is optimal and False if it's infeasible
+        '''
+
+        start = time.perf_counter()
+        status = run_highs(self.lp, inherited)
+
+        if status not in [highspy.HighsModelStatus.kOptimal, highspy.HighsModelStatus.kInfeasible]:
+            diff = time.perf_counter() - start
+            print(f"HiGHS failed ({self.lp.modelStatusToString(status)}) after {round(diff, 3)} sec with " + \
+                  f"{self.get_num_rows()} rows and {self.get_num_cols()} cols; retrying with reset")
+
+            self.reset_basis()
+            status = run_highs(self.lp)
+
+        if status not in [highspy.HighsModelStatus.kOptimal, highspy.HighsModelStatus.kInfeasible]:
+            raise RuntimeError(f"LP status after minimize() was {self.lp.modelStatusToString(status)}")
+
+        return status == highspy.HighsModelStatus.kOptimal
+
+    def minimize(self, direction_vec, fail_on_unsat=True):
+        '''minimize the lp, returning a list of assigments to each of the variables
+
+        if direction_vec is not None, this will first assign the optimization direction
+
+        returns None if UNSAT, otherwise the optimization result.
+        '''
+
+        assert not isinstance(self.lp, tuple), "self.lp was tuple. Did you call lpi.deserialize()?"
+
+        if direction_vec is None:
+            direction_vec = np.zeros(self.get_num_cols())
+
+        self.set_minimize_direction(direction_vec)
+
+        inherited = self.inherited_basis
+        self.inherited_basis = False
+
+        rv = None
+
+        if self._solve(inherited):
+            rv = np.array(self.lp.getSolution().col_value, dtype=float)
+        elif fail_on_unsat:
+            # like with glpk, a numerically difficult lp can sometimes be solved from scratch
+            print("Note: minimize failed with fail_on_unsat was true, trying to reset basis...")
+            self.reset_basis()
+
+            if self._solve():
+                print("Using result after reset basis (soltion was now feasible)")
+                rv = np.array(self.lp.getSolution().col_value, dtype=float)
+
+        if rv is None and fail_on_unsat:
+            raise UnsatError("minimize returned UNSAT and fail_on_unsat was True")
+
+        return rv
+
+    def minimize_batch(self, direction_mat, stop_values=None):
+        '''minimize the lp in each of the directions (the rows of direction_mat), back to back from the same basis
+
+        see LpInstanceGLPK.minimize_batch(). The early stop uses the dual simplex objective bound, so the value of an
+        lp that stopped early is a lower bound on its minimum that is at least stop_values[r].
+        '''
+
+        assert not isinstance(self.lp, tuple), "self.lp was tuple. Did you call lpi.deserialize()?"
+
+        num_cols = self.get_num_cols()
+        all_cols = np.arange(num_cols, dtype=np.int32)
+        rv = np.full((len(direction_mat), 1 + num_cols), np.nan)
+        prev_direction = None
+
+        inherited = self.inherited_basis
+        self.inherited_basis = False
+
+        try:
+            for r, direction in enumerate(direction_mat):
+                if prev_direction is None:
+                    self.set_minimize_direction(direction)
+                else:
+                    # only assign the coefficients that changed
+                    changed = all_cols[direction != prev_direction]
+
+                    if changed.size > 0:
+                        self.lp.changeColsCost(changed.size, changed, np.array(direction[changed], dtype=float))
+
+                prev_direction = direction
+
+                if stop_values is not None:
+                    self.lp.setOptionValue('objective_bound', float(stop_values[r]))
+
+                status = run_highs(self.lp, inherited and r == 0)
+
+                if status == highspy.HighsModelStatus.kObjectiveBound:
+                    # stopped early; the basis is dual feasible, so the objective is a lower bound
+                    rv[r, 0] = self.lp.getInfo().objective_function_value
+                elif status == highspy.HighsModelStatus.kOptimal:
+                    rv[r, 0] = self.lp.getInfo().objective_function_value
+                    rv[r, 1:] = self.lp.getSolution().col_value
+                else:
+                    # solver failure or infeasible: minimize() retries, and raises UnsatError if it's still infeasible
+                    if stop_values is not None:
+                        self.lp.setOptionValue('objective_bound', highspy.kHighsInf)
+
+                    res = self.minimize(direction)
+
+                    rv[r, 0] = np.dot(direction, res)
+                    rv[r, 1:] = res
+        finally:
+            if stop_values is not None:
+                self.lp.setOptionValue('objective_bound', highspy.kHighsInf)
+
+        return rv
+
+class UnsatError(RuntimeError):
+    'raised if an LP is infeasible'
@@ -2,13 +2,51 @@
 utilities for lp solving
 '''
 
+import os
 import time
+import queue
+import itertools
+import threading
 from multiprocessing import Pool
 
 import numpy as np
 
 from nnenum.timerutil import Timers
 from nnenum.settings import Settings
+from nnenum.util import Freezable
+from nnenum import shm_transfer
+
+class SimplexStats(threading.local):
+    '''counts of simplex calls and iterations in this thread (lp solvers that report them add to SIMPLEX_STATS)
+
+    calls that start from a basis kept from the parent lp (through a copy or serialization) are also counted
+    separately, to measure the benefit of keeping it
+    '''
+
+    def __init__(self):
+        super().__init__()
+
+        self.calls = 0
+        self.iterations = 0
+        self.inherited_calls = 0
+        self.inherited_iterations = 0
+
+    def reset(self):
+        'zero the counts'
+
+        self.calls = self.iterations = self.inherited_calls = self.inherited_iterations = 0
+
+    def add(self, iterations, inherited):
+        'count a simplex call'
+
+        self.calls += 1
+        self.iterations += iterations
+
+        if inherited:
+            self.inherited_calls += 1
+            self.inherited_iterations += iterations
+
+SIMPLEX_STATS = SimplexStats()
 
 def init_worker(wfunc, serialized_star):
     'initializer parallel worker'
@@ -23,11 +61,20 @@ def worker_func(param):
     '''
 
     star = worker_func.star
-    num_lps = 0
 
     if isinstance(star.lpi.lp, tuple):
         star.lpi.deserialize()
 
+    return compute_bounds(star, param)
+
+def compute_bounds(star, param):
+    '''compute the bounds of one neuron for parallel lp
+
+    return tuple is (split_index, new_lb, new_ub, num_lps)
+    '''
+
+    num_lps = 0
+
     # lb, ub are current bounds
     i, lb, ub, sim_i, both_bounds = param
 
@@ -60,6 +107,132 @@ def worker_func(param):
 
     return (i, lb, ub, num_lps)
 
+class LpPool(Freezable):
+    '''long-lived pool of lp processes for update_bounds_lp_parallel(), kept by each enumeration worker (see
+    get_lp_pool())
+
+    Each call sends the star once, through a shared memory segment that every lp process reads (see shm_transfer.py),
+    and then streams the neurons' bound jobs, with at most num_processes jobs in flight. An lp process unpacks each
+    star once and keeps it for the following jobs. The settings are sent with the star, since they may have changed
+    since the processes were started (for example, in a reused Enumerator).
+    '''
+
+    star_ids = itertools.count()
+    local = threading.local() # the pool of this thread, and the star currently kept by an lp process
+
+    def __init__(self, num_processes):
+        self.num_processes = num_processes
+        self.pool = Pool(processes=num_processes) # None after close()
+
+        self.freeze_attrs()
+
+    def close(self):
+        'stop the lp processes'
+
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+    @staticmethod
+    def job_func(job):
+        '''compute the bounds of one neuron in an lp process
+
+        job is (star_id, descriptor, param), where descriptor is the StarDescriptor of (star, settings snapshot)
+        '''
+
+        star_id, descriptor, param = job
+        loc = LpPool.local
+
+        if getattr(loc, 'star_id', None) != star_id:
+            star, settings = descriptor.unpack(release=False)
+            Settings.restore(settings)
+            star.lpi.deserialize()
+
+            loc.star_id = star_id
+            loc.star = star
+
+        return compute_bounds(loc.star, param)
+
+    def imap(self, star, params, num_processes):
+        '''compute the bounds for each of the params (see compute_bounds()) with star, using at most num_processes
+        processes at once
+
+        this is a generator of the results, in the order they complete. The jobs are started in the order of params.
+        '''
+
+        star_id = f'{os.getpid()}-{threading.get_ident()}-{next(LpPool.star_ids)}'
+
+        star.lpi.serialize()
+        descriptor = shm_transfer.pack((star, Settings.snapshot()))
+        star.lpi.deserialize()
+
+        results = queue.SimpleQueue()
+        jobs = ((star_id, descriptor, param) for param in params)
+        in_flight = 0
+
+        def submit():
+            'start the next job, returns False if there are no more jobs'
+
+            job = next(jobs, None)
+
+            if job is not None:
+                self.pool.apply_async(LpPool.job_func, (job,), callback=results.put, error_callback=results.put)
+
+            return job is not None
+
+        try:
+            while in_flight < num_processes and submit():
+                in_flight += 1
+
+            while in_flight > 0:
+                res = results.get()
+                in_flight -= 1
+
+                if isinstance(res, BaseException):
+                    raise res
+
+                if submit():
+                    in_flight += 1
+
+                yield res
+        finally:
+            if in_flight > 0:
+                # a result raised or the caller stopped early (cancel). The lp processes are stopped rather than
+                # waited for, so that the jobs still running don't delay the next call, which restarts the pool.
+                self.close()
+
+            descriptor.discard()
+
+def get_lp_pool(num_processes):
+    '''get the persistent lp pool of this thread (enumeration worker), with at least num_processes processes
+
+    the pool is started on the first call (timer 'lp_pool_create'), and restarted if more processes are needed or
+    if it was stopped by an abandoned call (see LpPool.imap())
+    '''
+
+    rv = getattr(LpPool.local, 'pool', None)
+
+    if rv is None or rv.pool is None or rv.num_processes < num_processes:
+        Timers.tic('lp_pool_create')
+
+        if rv is not None:
+            rv.close()
+
+        rv = LpPool.local.pool = LpPool(num_processes)
+        Timers.toc('lp_pool_create')
+
+    return rv
+
+def close_lp_pool():
+    'stop this thread\'s persistent lp pool, if it was started'
+
+    pool = getattr(LpPool.local, 'pool', None)
+
+    if pool is not None:
+        pool.close()
+        LpPool.local.pool = None
+
 def update_bounds_lp(layer_bounds, star, sim, split_indices, depth, check_cancel_func=None, both_bounds=False):
     '''update the passed in bounds using an lp solver (if two-sided)
     
@@ -87,7 +260,9 @@ def update_bounds_lp(layer_bounds, star, sim, split_indices, depth, check_cancel
     #    print("infeasible")
     #    print(star.lpi)
 
-    if n <= 1:
+    if n <= 1 and Settings.LP_BATCH_SIZE > 1 and Settings.EAGER_BOUNDS:
+        rv = update_bounds_lp_batched(layer_bounds, star, sim, split_indices, check_cancel_func, both_bounds)
+    elif n <= 1:
         rv = update_bounds_lp_serial(layer_bounds, star, sim, split_indices, check_cancel_func, both_bounds)
     else:
         rv = update_bounds_lp_parallel(layer_bounds, star, sim, split_indices, n, check_cancel_func, both_bounds)
@@ -101,6 +276,12 @@ def update_bounds_lp_parallel(layer_bounds, star, sim, split_indices, num_proces
     '''
 
     start = time.perf_counter()
+    pool_secs = 0
+
+    if Settings.LP_POOL_PERSISTENT:
+        # started on the first call, and timed separately (timer 'lp_pool_create')
+        lp_pool = get_lp_pool(num_processes)
+        pool_secs = time.perf_counter() - start
 
     Timers.tic('update_bounds_lp_parallel')
     assert len(sim) == layer_bounds.shape[0]
@@ -119,16 +300,21 @@ def update_bounds_lp_parallel(layer_bounds, star, sim, split_indices, num_proces
         params.append(param)
 
     ####### start
-    
-    star.lpi.serialize()
-
-    init_arg = (worker_func, star)
-    new_splits = []
+    is_split = {}
     total_lps = 0
 
-    with Pool(initializer=init_worker, initargs=init_arg, processes=num_processes) as pool:
+    if Settings.LP_POOL_PERSISTENT:
+        results = lp_pool.imap(star, params, num_processes)
+        pool = None
+    else:
+        star.lpi.serialize()
+
+        init_arg = (worker_func, star)
+        pool = Pool(initializer=init_worker, initargs=init_arg, processes=num_processes)
+        results = pool.imap_unordered(worker_func, params)
 
-        for i, res in enumerate(pool.imap_unordered(worker_func, params)):
+    try:
+        for i, res in enumerate(results):
             if Settings.NUM_PROCESSES == 1 and Settings.PRINT_OUTPUT:
                 print(f'\rParallel LP Progress: {round(100 * i / len(params), 1)}%', end='', flush=True)
 
@@ -141,24 +327,28 @@ def update_bounds_lp_parallel(layer_bounds, star, sim, split_indices, num_proces
             if i % 2 == 0 and check_cancel_func is not None:
                 check_cancel_func() # raises exception to cancel
 
-            if lb < -Settings.SPLIT_TOLERANCE and ub > Settings.SPLIT_TOLERANCE:
-                new_splits.append(i)
-
-        pool.close() # do we need this? we're in a manager
+            is_split[i] = lb < -Settings.SPLIT_TOLERANCE and ub > Settings.SPLIT_TOLERANCE
+    finally:
+        if pool is not None:
+            pool.terminate()
+            star.lpi.deserialize()
+        else:
+            results.close() # releases the star's shared memory
 
-    star.lpi.deserialize()
     #############
 
-    new_splits = np.array(new_splits)
+    # results complete in any order, but the splits are kept in the order of split_indices, like the serial version
+    new_splits = np.array([i for i in split_indices if is_split[i]])
     Timers.toc('update_bounds_lp_parallel')
 
     if Settings.NUM_PROCESSES == 1 and Settings.PRINT_OUTPUT:
         diff = max(1e-6, time.perf_counter() - start)
-        avg = diff / total_lps
+        avg = diff / max(1, total_lps)
 
-        print(f"\nTotal time in update_bounds_lp: {round(diff, 2)}, num lp: {total_lps}, lp avg ms: {round(avg, 4)}")
+        print(f"\nTotal time in update_bounds_lp: {round(diff, 2)}, num lp: {total_lps}, lp avg ms: {round(avg, 4)}" + \
+              f", lp pool creation: {round(pool_secs, 2)}")
 
-    return new_splits        
+    return new_splits
 
 def update_bounds_lp_serial(layer_bounds, star, sim, split_indices, check_cancel_func=None, both_bounds=False):
     '''
@@ -235,3 +425,65 @@ def update_bounds_lp_serial(layer_bounds, star, sim, split_indices, check_cancel
     #print(f"total time in update_bounds_lp: {time.perf_counter() - start}")
 
     return new_splits
+
+def update_bounds_lp_batched(layer_bounds, star, sim, split_indices, check_cancel_func=None, both_bounds=False):
+    '''
+    single-threaded version of update_bounds_lp, where the lps of Settings.LP_BATCH_SIZE neurons at a time are solved
+    with one star.minimize_outputs() call
+
+    like update_bounds_lp_serial, the side of each neuron's bound that can rule out the split is computed first, and
+    the other side only if it's needed. With Settings.LP_BATCH_EARLY_STOP (and not both_bounds), the lps stop once
+    the sign of the bound is decided, so the bounds of neurons that can't be split may be looser (but still sound).
+    '''
+
+    Timers.tic('update_bounds_lp_batched')
+    assert len(sim) == layer_bounds.shape[0]
+
+    if split_indices is None:
+        num_neurons = star.a_mat.shape[0]
+        split_indices = range(num_neurons)
+
+    split_indices = np.array(split_indices, dtype=int)
+    sim = np.asarray(sim)
+    tol = Settings.SPLIT_TOLERANCE
+    early_stop_tol = tol if Settings.LP_BATCH_EARLY_STOP and not both_bounds else None
+    new_splits = []
+
+    for start in range(0, len(split_indices), Settings.LP_BATCH_SIZE):
+        if check_cancel_func is not None:
+            check_cancel_func() # raises exception to cancel
+
+        batch = split_indices[start:start + Settings.LP_BATCH_SIZE]
+        lb = layer_bounds[batch, 0]
+        ub = layer_bounds[batch, 1]
+
+        assert np.all(lb < 0) and np.all(ub > 0), f"bounds for {batch} were not all two-sided: {lb}, {ub}"
+
+        # the simulation is a witness for one side, so compute the bound on the other side first
+        ub_first = sim[batch] < 0
+        values = star.minimize_outputs(batch, ub_first, early_stop_tol)
+        ub = np.where(ub_first, values, ub)
+        lb = np.where(ub_first, lb, values)
+
+        two_sided = (lb < -tol) & (ub > tol)
+        other_side = two_sided & (both_bounds | (ub_first & (lb == -np.inf)) | (~ub_first & (ub == np.inf)))
+
+        if np.any(other_side):
+            values = star.minimize_outputs(batch[other_side], ~ub_first[other_side], early_stop_tol)
+            lb[other_side] = np.where(ub_first[other_side], values, lb[other_side])
+            ub[other_side] = np.where(ub_first[other_side], ub[other_side], values)
+
+            assert np.all(lb - 1e-1 < sim[batch]) and np.all(sim[batch] < ub + 1e-1), \
+                f"sim[{batch}]={sim[batch]} was not between bounds: {lb, ub}"
+
+            two_sided = (lb < -tol) & (ub > tol)
+
+        layer_bounds[batch, 0] = lb
+        layer_bounds[batch, 1] = ub
+        new_splits += batch[two_sided].tolist()
+
+    new_splits = np.array(new_splits)
+
+    Timers.toc('update_bounds_lp_batched')
+
+    return new_splits
@@ -0,0 +1,213 @@
+'''
+Live metrics for a running enumeration (Settings.METRICS_FILE and Settings.METRICS_PORT)
+
+Every Settings.METRICS_INTERVAL seconds, each worker writes its own statistics into its row of
+SharedState.live_metrics (see Worker.publish_metrics()). While the workers run, a MetricsExporter thread in the process
+that called enumerate_network() samples the rows at the same interval and publishes them as a JSON-lines stream and/or
+a localhost HTTP endpoint in the Prometheus text format (http://127.0.0.1:<port>/metrics).
+
+When both settings are None (the default), workers only check one attribute per shared variable update.
+
+Stanley Bak
+'''
+
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from nnenum.util import Freezable
+from nnenum.settings import Settings
+
+# the columns of SharedState.live_metrics, in order
+METRIC_NAMES = ['finished_stars', 'num_lps', 'num_lps_enum', 'overapprox_tries', 'overapprox_safe', 'frontier_size',
+                'steal_count', 'steal_secs', 'idle_secs', 'rss_bytes']
+
+# prometheus metric types (the others are gauges); counters are exported with a _total suffix
+COUNTERS = ['finished_stars', 'num_lps', 'num_lps_enum', 'overapprox_tries', 'overapprox_safe', 'steal_count',
+            'steal_secs', 'idle_secs']
+
+def metrics_enabled():
+    'are live metrics published?'
+
+    return Settings.METRICS_FILE is not None or Settings.METRICS_PORT is not None
+
+def get_rss_bytes():
+    'get the resident memory of this process in bytes (the peak resident memory if /proc is not available)'
+
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            rv = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        import resource # not available on windows
+
+        rv = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    return rv
+
+class MetricsExporter(Freezable):
+    'samples SharedState.live_metrics and publishes them, see start_metrics()'
+
+    def __init__(self, shared):
+        self.shared = shared
+        self.start_time = time.perf_counter()
+
+        self.latest = None # the latest sample, a dict
+        self.prev_finished = [0] * shared.num_workers # for throughput
+        self.prev_time = self.start_time
+
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+        self.file = None
+        self.server = None
+
+        self.freeze_attrs()
+
+    def start(self):
+        'open the outputs and start sampling'
+
+        if Settings.METRICS_FILE is not None:
+            self.file = sys.stdout if Settings.METRICS_FILE == '-' else open(Settings.METRICS_FILE, 'a')
+
+        if Settings.METRICS_PORT is not None:
+            try:
+                self.server = ThreadingHTTPServer(('127.0.0.1', Settings.METRICS_PORT), make_handler(self))
+            except OSError as e:
+                # port in use, for example; the enumeration continues without the http endpoint
+                if Settings.PRINT_OUTPUT:
+                    print(f"Warning: could not serve metrics on port {Settings.METRICS_PORT} ({e}); continuing " +
+                          "without the metrics endpoint")
+            else:
+                self.server.daemon_threads = True
+                threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+                if Settings.PRINT_OUTPUT:
+                    print(f"Serving metrics at http://127.0.0.1:{self.server.server_address[1]}/metrics")
+
+        self.thread.start()
+
+    def stop(self):
+        'take a final sample and close the outputs'
+
+        self.stop_event.set()
+        self.thread.join()
+
+        self.sample()
+
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+        if self.file is not None and self.file is not sys.stdout:
+            self.file.close()
+
+    def run(self):
+        'sampling thread'
+
+        while not self.stop_event.wait(Settings.METRICS_INTERVAL):
+            self.sample()
+
+    def sample(self):
+        'read the live metrics, and write a json line if METRICS_FILE is set'
+
+        shared = self.shared
+        now = time.perf_counter()
+        num_cols = len(METRIC_NAMES)
+        rows = list(shared.live_metrics)
+        dt = max(now - self.prev_time, 1e-9)
+
+        workers = []
+
+        for i in range(shared.num_workers):
+            w = dict(zip(METRIC_NAMES, rows[i * num_cols:(i + 1) * num_cols]))
+
+            w['stars_per_sec'] = (w['finished_stars'] - self.prev_finished[i]) / dt
+            w['overapprox_success_rate'] = w['overapprox_safe'] / max(w['overapprox_tries'], 1)
+            w['mean_steal_wait_secs'] = w['steal_secs'] / max(w['steal_count'], 1)
+
+            self.prev_finished[i] = w['finished_stars']
+            workers.append(w)
+
+        self.prev_time = now
+
+        try:
+            queue_size = shared.more_work_queue.qsize()
+        except NotImplementedError:
+            queue_size = None
+
+        self.latest = {'elapsed': now - self.start_time,
+                       'queue_size': queue_size,
+                       'frontier_size': sum(w['frontier_size'] for w in workers),
+                       'stars_in_progress': shared.count_stars_in_progress(),
+                       'finished_stars': shared.finished_stars.value,
+                       'workers': workers}
+
+        if self.file is not None:
+            self.file.write(json.dumps(self.latest) + '\n')
+            self.file.flush()
+
+    def prometheus_text(self):
+        'get the latest sample in the prometheus text format'
+
+        sample = self.latest
+        lines = []
+
+        if sample is not None:
+            for name in ['elapsed', 'queue_size', 'frontier_size', 'stars_in_progress', 'finished_stars']:
+                if sample[name] is not None:
+                    lines.append(f"# TYPE nnenum_{name} gauge")
+                    lines.append(f"nnenum_{name} {sample[name]}")
+
+            for name in sample['workers'][0] if sample['workers'] else []:
+                if name in COUNTERS:
+                    metric_type = 'counter'
+                    metric_name = f"nnenum_worker_{name}_total"
+                else:
+                    metric_type = 'gauge'
+                    metric_name = f"nnenum_worker_{name}"
+
+                lines.append(f"# TYPE {metric_name} {metric_type}")
+
+                for i, w in enumerate(sample['workers']):
+                    lines.append(f'{metric_name}{{worker="{i}"}} {w[name]}')
+
+        return '\n'.join(lines) + '\n'
+
+def make_handler(exporter):
+    'make the http request handler class for an exporter'
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        'serves /metrics'
+
+        def do_GET(self): # pylint: disable=invalid-name
+            'handle a get request'
+
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+            else:
+                body = exporter.prometheus_text().encode()
+
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        def log_message(self, *_args): # pylint: disable=arguments-differ
+            'don\'t log requests to stderr'
+
+    return MetricsHandler
+
+def start_metrics(shared):
+    'start a MetricsExporter for the workers of shared, returns None if live metrics are disabled'
+
+    rv = None
+
+    if metrics_enabled():
+        rv = MetricsExporter(shared)
+        rv.start()
+
+    return rv
@@ -1,7 +1,16 @@
 '''
 nnenum vnnlib front end
 
-usage: "python3 nnenum.py <onnx_file> <vnnlib_file> [timeout=None] [outfile=None]"
+usage: "python3 nnenum.py <onnx_file> <vnnlib_file> [timeout=None] [outfile=None] [processes=<auto>] [settings=auto]"
+
+optional flags: "--checkpoint <dir>" periodically saves the remaining work to dir (and on timeout),
+                "--resume <dir>" does the same and resumes from the checkpoint in dir if there is one,
+                "--parallel-boxes" verifies all the input boxes at the same time (see parallel_boxes.py),
+                "--record <file>" records the search tree and per-node work to file (see replay.py),
+                "--replay <file>" deterministically re-executes the search tree recorded in file,
+                "--threads" runs the workers as threads instead of processes (Settings.BACKEND_THREADS),
+                "--metrics-file <file>" appends live metrics to file as json lines (see metrics.py),
+                "--metrics-port <port>" serves live metrics in the prometheus format at http://127.0.0.1:<port>/metrics
 
 Stanley Bak
 June 2021
@@ -11,20 +20,27 @@ import sys
 
 import numpy as np
 
-from nnenum.enumerate import enumerate_network
+from nnenum.enumerate import Enumerator
 from nnenum.settings import Settings
 from nnenum.result import Result
 from nnenum.onnx_network import load_onnx_network_optimized, load_onnx_network
 from nnenum.specification import Specification, DisjunctiveSpec
 from nnenum.vnnlib import get_num_inputs_outputs, read_vnnlib_simple
+from nnenum.checkpoint import make_key, load_manifest
+from nnenum.parallel_boxes import verify_boxes_parallel
 
-def make_spec(vnnlib_filename, onnx_filename):
+def make_spec(vnnlib_filename, onnx_filename, io_sizes=None):
     '''make Specification
 
+    io_sizes is the result of get_num_inputs_outputs(onnx_filename), which is computed (loading the onnx file) if None
+
     returns a pair: (list of [box, Specification], inp_dtype)
     '''
 
-    num_inputs, num_outputs, inp_dtype = get_num_inputs_outputs(onnx_filename)
+    if io_sizes is None:
+        io_sizes = get_num_inputs_outputs(onnx_filename)
+
+    num_inputs, num_outputs, inp_dtype = io_sizes
     vnnlib_spec = read_vnnlib_simple(vnnlib_filename, num_inputs, num_outputs)
 
     rv = []
@@ -92,35 +108,8 @@ def set_image_settings():
     Settings.CONTRACT_ZONOTOPE = False
     Settings.CONTRACT_ZONOTOPE_LP = False
 
-def main():
-    'main entry point'
-
-    if len(sys.argv) < 3:
-        print('usage: "python3 nnenum.py <onnx_file> <vnnlib_file> [timeout=None] [outfile=None] [processes=<auto>]"')
-        sys.exit(1)
-
-    onnx_filename = sys.argv[1]
-    vnnlib_filename = sys.argv[2]
-    timeout = None
-    outfile = None
-
-    if len(sys.argv) >= 4:
-        timeout = float(sys.argv[3])
-
-    if len(sys.argv) >= 5:
-        outfile = sys.argv[4]
-
-    if len(sys.argv) >= 6:
-        processes = int(sys.argv[5])
-        Settings.NUM_PROCESSES = processes
-
-    if len(sys.argv) >= 7:
-        settings_str = sys.argv[6]
-    else:
-        settings_str = "auto"
-
-    #
-    spec_list, input_dtype = make_spec(vnnlib_filename, onnx_filename)
+def load_network(onnx_filename):
+    'load an onnx network, using the optimized loader if all layers are supported'
 
     try:
         network = load_onnx_network_optimized(onnx_filename)
@@ -128,9 +117,10 @@ def main():
         # cannot do optimized load due to unsupported layers
         network = load_onnx_network(onnx_filename)
 
-    result_str = 'none' # gets overridden
+    return network
 
-    num_inputs = len(spec_list[0][0])
+def apply_settings(settings_str, num_inputs):
+    'assign Settings for the given preset name ("auto", "control", "image" or "exact")'
 
     if settings_str == "auto":
         if num_inputs < 700:
@@ -142,10 +132,77 @@ def main():
     elif settings_str == "image":
         set_image_settings()
     else:
-        assert settings_str == "exact"
+        assert settings_str == "exact", f"unknown settings preset: {settings_str}"
         set_exact_settings()
 
-    for init_box, spec in spec_list:
+    if Settings.TRACE_FILE is not None:
+        Settings.TIMING_STATS = True # the trace is recorded by the Timers
+
+    if Settings.WORKER_BACKEND == Settings.BACKEND_THREADS:
+        # Timers are shared by the whole process
+        Settings.TIMING_STATS = False
+        Settings.TRACE_FILE = None
+
+def verify(onnx_filename, vnnlib_filename, timeout=None, settings_str="auto", network=None, enumerator=None,
+           io_sizes=None):
+    '''verify a vnnlib property on an onnx network
+
+    network is the loaded onnx network (loaded from onnx_filename if None)
+    enumerator is an Enumerator for network to reuse (a temporary one is created if None)
+    io_sizes is the (num_inputs, num_outputs, inp_dtype) tuple of the onnx file (see make_spec())
+
+    returns the VNN-COMP result string: "holds", "violated", "timeout", "error", ...
+    '''
+
+    spec_list, input_dtype = make_spec(vnnlib_filename, onnx_filename, io_sizes)
+
+    if network is None:
+        network = load_network(onnx_filename)
+
+    result_str = 'none' # gets overridden
+
+    num_inputs = len(spec_list[0][0])
+    apply_settings(settings_str, num_inputs)
+
+    parallel_boxes = Settings.PARALLEL_BOXES and len(spec_list) > 1
+
+    if parallel_boxes and Settings.CHECKPOINT_DIR is not None:
+        print("Warning: checkpoints are not supported with PARALLEL_BOXES; verifying the input boxes sequentially")
+        parallel_boxes = False
+
+    if parallel_boxes and (Settings.REPLAY_RECORD is not None or Settings.REPLAY_LOG is not None):
+        print("Warning: record and replay are not supported with PARALLEL_BOXES; verifying the boxes sequentially")
+        parallel_boxes = False
+
+    if parallel_boxes:
+        # each box runs in its own processes, so the enumerator is not used
+        result_str = verify_boxes_parallel(spec_list, input_dtype, network, timeout)
+    elif enumerator is None:
+        # worker processes are started once and reused for each (init_box, spec) pair
+        with Enumerator(network) as temp_enumerator:
+            result_str = verify_spec_list(spec_list, input_dtype, timeout, temp_enumerator)
+    else:
+        result_str = verify_spec_list(spec_list, input_dtype, timeout, enumerator)
+
+    # rename for VNNCOMP21:
+        
+    if result_str == "safe":
+        result_str = "holds"
+    elif "unsafe" in result_str:
+        result_str = "violated"
+
+    return result_str
+
+def verify_spec_list(spec_list, input_dtype, timeout, enumerator):
+    '''verify each (init_box, spec) pair until one is not safe
+
+    returns the result string of the last enumeration
+    '''
+
+    result_str = 'none'
+    start_index = get_resume_index(spec_list, input_dtype)
+
+    for init_box, spec in spec_list[start_index:]:
         init_box = np.array(init_box, dtype=input_dtype)
 
         if timeout is not None:
@@ -155,7 +212,7 @@ def main():
 
             Settings.TIMEOUT = timeout
 
-        res = enumerate_network(init_box, network, spec)
+        res = enumerator.enumerate(init_box, spec)
         result_str = res.result_str
 
         if timeout is not None:
@@ -165,12 +222,106 @@ def main():
         if result_str != "safe":
             break
 
-    # rename for VNNCOMP21:
-        
-    if result_str == "safe":
-        result_str = "holds"
-    elif "unsafe" in result_str:
-        result_str = "violated"
+    return result_str
+
+def get_resume_index(spec_list, input_dtype):
+    '''get the index of the (init_box, spec) pair to start from
+
+    when resuming, the pairs before the checkpointed one were proven safe by the run that saved it
+    '''
+
+    rv = 0
+
+    if Settings.CHECKPOINT_DIR is not None and Settings.CHECKPOINT_RESUME:
+        manifest = load_manifest(Settings.CHECKPOINT_DIR)
+
+        if manifest is not None:
+            for i, (init_box, spec) in enumerate(spec_list):
+                if make_key(np.array(init_box, dtype=input_dtype), spec) == manifest['key']:
+                    rv = i
+
+                    if i > 0 and Settings.PRINT_OUTPUT:
+                        print(f"Resuming: skipping {i} input boxes proven safe before the checkpoint")
+
+                    break
+
+    return rv
+
+def main():
+    'main entry point'
+
+    args = sys.argv[1:]
+
+    for flag in ['--checkpoint', '--resume']:
+        if flag in args:
+            index = args.index(flag)
+            Settings.CHECKPOINT_DIR = args[index + 1]
+            Settings.CHECKPOINT_RESUME = Settings.CHECKPOINT_RESUME or flag == '--resume'
+            del args[index:index + 2]
+
+    if '--parallel-boxes' in args:
+        Settings.PARALLEL_BOXES = True
+        args.remove('--parallel-boxes')
+
+    if '--threads' in args:
+        Settings.WORKER_BACKEND = Settings.BACKEND_THREADS
+        args.remove('--threads')
+
+    for flag in ['--metrics-file', '--metrics-port']:
+        if flag in args:
+            index = args.index(flag)
+
+            if flag == '--metrics-file':
+                Settings.METRICS_FILE = args[index + 1]
+            else:
+                Settings.METRICS_PORT = int(args[index + 1])
+
+            del args[index:index + 2]
+
+    if '--trace' in args:
+        index = args.index('--trace')
+        Settings.TRACE_FILE = args[index + 1]
+        del args[index:index + 2]
+
+    for flag in ['--record', '--replay']:
+        if flag in args:
+            index = args.index(flag)
+
+            if flag == '--record':
+                Settings.REPLAY_RECORD = args[index + 1]
+            else:
+                Settings.REPLAY_LOG = args[index + 1]
+
+            del args[index:index + 2]
+
+    if len(args) < 2:
+        print('usage: "python3 nnenum.py <onnx_file> <vnnlib_file> [timeout=None] [outfile=None] ' + \
+              '[processes=<auto>] [settings=auto] [--checkpoint <dir>] [--resume <dir>] [--parallel-boxes] ' + \
+              '[--record <file>] [--replay <file>] [--threads] [--metrics-file <file>] [--metrics-port <port>] ' + \
+              '[--trace <file>]"')
+        sys.exit(1)
+
+    onnx_filename = args[0]
+    vnnlib_filename = args[1]
+    timeout = None
+    outfile = None
+
+    if len(args) >= 3:
+        timeout = float(args[2])
+
+    if len(args) >= 4:
+        outfile = args[3]
+
+    if len(args) >= 5:
+        processes = int(args[4])
+        Settings.NUM_PROCESSES = processes
+
+    if len(args) >= 6:
+        settings_str = args[5]
+    else:
+        settings_str = "auto"
+
+    result_str = verify(onnx_filename, vnnlib_filename, timeout, settings_str)
 
     if outfile is not None:
         with open(outfile, 'w') as f:
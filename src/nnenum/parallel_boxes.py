@@ -0,0 +1,218 @@
+'''
+Parallel verification of the input boxes of one vnnlib file (Settings.PARALLEL_BOXES)
+
+Rather than verifying the (init_box, spec) pairs one after another, all of them are scheduled at once on the
+Settings.NUM_PROCESSES cores. Each box runs in its own process, with one worker if there are at least as many boxes as
+cores, and otherwise the cores are divided in proportion to the box volumes, so large boxes get several workers.
+Boxes are started largest first, and all boxes are stopped as soon as one is violated.
+
+Stanley Bak
+'''
+
+import math
+import multiprocessing
+import queue
+import time
+import traceback
+
+import numpy as np
+
+from nnenum.settings import Settings
+from nnenum.enumerate import enumerate_network
+
+class BoxRun:
+    'the scheduling and outcome of one input box'
+
+    def __init__(self, index, init_box, spec, volume):
+        self.index = index
+        self.init_box = init_box
+        self.spec = spec
+        self.volume = volume # relative to the largest box
+
+        self.num_workers = 1
+        self.process = None
+        self.start_time = None
+
+        self.result_str = None
+        self.secs = None
+        self.total_stars = None
+
+    def __str__(self):
+        stars = '' if self.total_stars is None else f", {self.total_stars} stars"
+
+        return f"Box {self.index}: {self.result_str} in {round(self.secs, 3)} sec " + \
+            f"({self.num_workers} worker{'s' if self.num_workers > 1 else ''}{stars})"
+
+def get_relative_volumes(init_boxes):
+    '''get the volume of each box relative to the largest one (computed in log space, since there may be many inputs)
+
+    inputs that are fixed in every box don't matter. The other inputs are counted in every box, with widths of at
+    least a small tolerance, so that all the volumes are over the same dimensions.
+    '''
+
+    tol = 1e-9
+    widths = np.array([np.array(box, dtype=float)[:, 1] - np.array(box, dtype=float)[:, 0] for box in init_boxes])
+    varying = (widths > tol).any(axis=0)
+
+    log_vols = np.log(np.maximum(widths[:, varying], tol)).sum(axis=1)
+    max_log_vol = log_vols.max()
+
+    return [math.exp(v - max_log_vol) for v in log_vols]
+
+def assign_workers(runs, num_cores):
+    '''set num_workers of each run
+
+    if there are fewer boxes than cores, the extra cores are given to the boxes in proportion to their volumes
+    (largest remainder method)
+    '''
+
+    extra = num_cores - len(runs)
+
+    if extra > 0:
+        total_volume = sum(r.volume for r in runs)
+        shares = [extra * r.volume / total_volume for r in runs]
+
+        for r, share in zip(runs, shares):
+            r.num_workers = 1 + int(share)
+
+        leftover = num_cores - sum(r.num_workers for r in runs)
+        by_remainder = sorted(range(len(runs)), key=lambda i: shares[i] - int(shares[i]), reverse=True)
+
+        for i in by_remainder[:leftover]:
+            runs[i].num_workers += 1
+
+def run_box(run, network, timeout, stop_flag, result_queue):
+    'process function for one box, puts (index, result_str, secs, total_stars) on result_queue'
+
+    start = time.perf_counter()
+
+    try:
+        Settings.NUM_PROCESSES = run.num_workers
+        Settings.PRINT_OUTPUT = False # the scheduler prints a summary instead
+
+        if timeout is not None:
+            Settings.TIMEOUT = timeout
+
+        res = enumerate_network(run.init_box, network, run.spec, stop_flag=stop_flag)
+        result_queue.put((run.index, res.result_str, time.perf_counter() - start, res.total_stars))
+    except:
+        traceback.print_exc()
+        result_queue.put((run.index, 'error', time.perf_counter() - start, None))
+
+def verify_boxes_parallel(spec_list, input_dtype, network, timeout):
+    '''verify all the (init_box, spec) pairs at the same time
+
+    returns the result string, which is "unsafe" if any box is violated, otherwise the worst of the others
+    ("error", "timeout", ...) or "safe"
+    '''
+
+    start = time.perf_counter()
+    num_cores = max(1, Settings.NUM_PROCESSES)
+
+    init_boxes = [np.array(init_box, dtype=input_dtype) for init_box, _ in spec_list]
+    volumes = get_relative_volumes(init_boxes)
+
+    runs = [BoxRun(i, init_box, spec, vol) for i, ((_, spec), init_box, vol) in \
+            enumerate(zip(spec_list, init_boxes, volumes))]
+    assign_workers(runs, num_cores)
+
+    # largest first, so that the longest boxes are not started last
+    pending = sorted(runs, key=lambda r: r.volume, reverse=True)
+    running = {}
+    free_cores = num_cores
+
+    stop_flag = multiprocessing.RawValue('i', 0)
+    result_queue = multiprocessing.Queue()
+
+    if Settings.PRINT_OUTPUT:
+        print(f"Verifying {len(runs)} input boxes in parallel on {num_cores} cores")
+
+    while pending or running:
+        # start boxes while there are enough free cores, the largest one that fits first
+        while pending and not stop_flag.value:
+            fits = [i for i, r in enumerate(pending) if r.num_workers <= free_cores]
+
+            if not fits:
+                break
+
+            run = pending.pop(fits[0])
+            run.start_time = time.perf_counter()
+            box_timeout = None if timeout is None else timeout - (run.start_time - start)
+
+            if box_timeout is not None and box_timeout <= 0:
+                run.result_str = 'timeout'
+                run.secs = 0
+                continue
+
+            run.process = multiprocessing.Process(target=run_box,
+                                                  args=(run, network, box_timeout, stop_flag, result_queue))
+            run.process.start()
+            running[run.index] = run
+            free_cores -= run.num_workers
+
+        if not running:
+            break
+
+        try:
+            index, result_str, secs, total_stars = result_queue.get(timeout=1.0)
+        except queue.Empty:
+            # check for boxes whose process died without a result
+            for run in list(running.values()):
+                if not run.process.is_alive() and result_queue.empty():
+                    print(f"Error: the process for box {run.index} exited unexpectedly")
+                    index, result_str, total_stars = run.index, 'error', None
+                    secs = time.perf_counter() - run.start_time
+                    break
+            else:
+                continue
+
+        run = running.pop(index)
+        run.process.join()
+        free_cores += run.num_workers
+
+        run.result_str = result_str
+        run.secs = secs
+        run.total_stars = total_stars
+
+        if 'unsafe' in result_str and not stop_flag.value:
+            if Settings.PRINT_OUTPUT:
+                print(f"Box {index} was violated; stopping the other boxes")
+
+            stop_flag.value = 1
+
+        if stop_flag.value:
+            # boxes that were never started are skipped
+            for skipped in pending:
+                skipped.result_str = 'skipped'
+                skipped.secs = 0
+
+            pending = []
+
+    rv = combine_results([r.result_str for r in runs])
+
+    if Settings.PRINT_OUTPUT:
+        print(f"\nParallel box results ({round(time.perf_counter() - start, 3)} sec total): {rv}")
+
+        for run in runs:
+            print(run)
+
+    return rv
+
+def combine_results(result_strs):
+    'get the overall result string from the box results'
+
+    unsafe = [s for s in result_strs if 'unsafe' in s]
+
+    if unsafe:
+        rv = unsafe[0]
+    else:
+        rv = 'safe'
+
+        for s in result_strs:
+            if s not in ['safe', 'skipped']:
+                rv = s
+
+                if s == 'error':
+                    break
+
+    return rv
@@ -12,7 +12,7 @@ import numpy as np
 from nnenum.settings import Settings
 from nnenum.util import Freezable
 from nnenum.zonotope import Zonotope
-from nnenum.timerutil import Timers
+from nnenum.timerutil import Timers, hot_timed
 
 from nnenum.network import nn_flatten, nn_unflatten
 from nnenum.lputil import update_bounds_lp
@@ -30,11 +30,10 @@ def prod(l):
 
     return rv
 
+@hot_timed('exec_relus_up_to')
 def exec_relus_up_to(state, index):
     'execute reluts on the passed in state vector up to index'
 
-    Timers.tic('exec_relus_up_to')
-
     for i in range(index):
         if state[i] < 0:
             state[i] = 0
@@ -42,8 +41,6 @@ def exec_relus_up_to(state, index):
     # clip is slower here, for some reason
     #state[:index] = np.clip(state[:index], 0, np.inf)
 
-    Timers.toc('exec_relus_up_to')
-
 def sort_splits(layer_bounds, splits):
     '''sort splitting neurons according to 
 
@@ -330,6 +327,64 @@ class Prefilter(Freezable):
 
         return rv
 
+    def split_relu_one_side(self, neuron_index, star, positive, row, bias, start_time, depth, replay=False):
+        '''like split_relu, but only update this prefilter, for a star that was already split along neuron_index
+        (with row and bias being the neuron's row and bias before the split). There is no prefilter for the other side.
+
+        this is used with compact frontiers (see lp_star_state.StarRecipe). When replaying several splits, pass
+        replay=True to skip the lp steps, and call replay_done() after the last one.
+        '''
+
+        i = neuron_index
+        ob = self.output_bounds
+
+        # the neuron may not be first when replaying, since the branching neurons are not recomputed between splits
+        ob.branching_neurons = ob.branching_neurons[ob.branching_neurons != i]
+
+        if positive:
+            ob.layer_bounds[i, 0] = 0
+        else:
+            ob.layer_bounds[i, 1] = 0
+
+        if Settings.CONTRACT_ZONOTOPE:
+            Timers.tic("contract_zonotope")
+
+            if positive:
+                self.zono.contract_domain(-row, bias)
+            else:
+                self.zono.contract_domain(row, -bias)
+
+            Timers.toc("contract_zonotope")
+
+        if Settings.CONTRACT_ZONOTOPE_LP and not replay:
+            Timers.tic("contract_zonotope_lp")
+
+            if positive:
+                self.zono.contract_lp(star, -row, bias)
+            else:
+                self.zono.contract_lp(star, row, -bias)
+
+            Timers.toc("contract_zonotope_lp")
+
+        if Settings.EAGER_BOUNDS and not replay:
+            self.domain_shrank(star, start_time, depth)
+
+    def replay_done(self, star, hyperplane_list, rhs_list, start_time, depth):
+        '''do the lp steps of split_relu_one_side() once for all the replayed splits
+
+        hyperplane_list and rhs_list are the constraints added to the star by the splits
+        '''
+
+        if Settings.CONTRACT_ZONOTOPE_LP and hyperplane_list:
+            Timers.tic("contract_zonotope_lp")
+            self.zono.contract_lp(star, hyperplane_list, rhs_list)
+            Timers.toc("contract_zonotope_lp")
+
+        if Settings.EAGER_BOUNDS:
+            self.domain_shrank(star, start_time, depth)
+        else:
+            self.simulation = None # like the other side in split_relu()
+
     def domain_shrank(self, star, start_time, depth):
         '''the domain star was contracted (from split or violation intersection)
 
@@ -0,0 +1,259 @@
+'''
+Deterministic record and replay of the enumeration tree, for comparing the performance of two builds
+
+With Settings.REPLAY_RECORD set to a filename, each worker logs the stars (nodes of the search tree) it processes:
+whether an overapproximation was tried and with which generator limit, the outcome, the neuron that was split (or None
+for a leaf) and the seconds spent on the node. After the enumeration, the per-worker logs are merged into the file,
+which holds one log per verification problem (like checkpoints, problems are identified by checkpoint.make_key()).
+Distributed workers write their parts next to the file, so it must be on a shared filesystem.
+
+With Settings.REPLAY_LOG set to a recorded file, the enumeration runs single-threaded and takes the decisions that
+depend on scheduling and timing (whether to overapproximate and the generator limit) from the log, and the
+overapproximation is not canceled by Settings.OVERAPPROX_LP_TIMEOUT, so the same tree is explored with the same work at
+each node. Whether a branch ends is always decided by this run's overapproximation, so the result stays sound: if the
+outcome differs from the log (for example, the log's overapproximation was canceled), the node is counted as a
+mismatch, and the tree may differ from the log below it. Nodes are identified by their branch path. Setting
+REPLAY_RECORD as well records the replay, and two logs can be compared node by node with:
+
+python3 -m nnenum.replay <log_file_a> <log_file_b>
+
+Stanley Bak
+'''
+
+import os
+import pickle
+import sys
+import time
+
+import numpy as np
+
+from nnenum.util import Freezable
+from nnenum.settings import Settings
+from nnenum.checkpoint import make_key, write_atomic
+
+def path_key(branch_tuples):
+    'get the int that identifies a node by its branch path (a leading 1 bit, then 1 for each positive branch)'
+
+    rv = 1
+
+    for _, _, is_positive in branch_tuples:
+        rv = 2 * rv + (1 if is_positive else 0)
+
+    return rv
+
+def path_str(key):
+    'get the branch string (like LpStarState.branch_str()) of a path key'
+
+    return ''.join('+' if c == '1' else '-' for c in bin(key)[3:])
+
+def problem_key(init, spec):
+    'get the key of a verification problem in a log file (None if init is not a box)'
+
+    rv = None
+
+    if isinstance(init, (list, tuple, np.ndarray)):
+        rv = make_key(init, spec)
+
+    return rv
+
+def part_filename(filename, worker_index):
+    'get the filename of a worker\'s part of a log that is being recorded'
+
+    return f'{filename}.part{worker_index}'
+
+class ReplayRecorder(Freezable):
+    '''records the nodes processed by one worker
+
+    nodes maps a path key to a list [overapprox, split, secs], where overapprox is None if no overapproximation was
+    tried, or a tuple (gen_limit, outcome) with outcome one of 'safe', 'unsafe', 'canceled' or 'concrete', and split is
+    the (layer, neuron) that was split, or None for a leaf
+    '''
+
+    def __init__(self, worker_index):
+        self.worker_index = worker_index
+        self.node_start = time.perf_counter()
+
+        self.nodes = {}
+
+        self.freeze_attrs()
+
+    def get_node(self, key):
+        'get the record of a node, creating it if needed'
+
+        rv = self.nodes.get(key)
+
+        if rv is None:
+            rv = self.nodes[key] = [None, None, 0.0]
+
+        return rv
+
+    def start_node(self):
+        'start timing a node, after it was popped from the local frontier or received from another worker'
+
+        self.node_start = time.perf_counter()
+
+    def overapprox(self, ss, gen_limit, outcome):
+        'log an overapproximation of the node ss'
+
+        self.get_node(path_key(ss.branch_tuples))[0] = (gen_limit, outcome)
+
+    def end_node(self, key, split):
+        'log the end of a node, which was split on the (layer, neuron) split or is a leaf (split is None)'
+
+        now = time.perf_counter()
+
+        rec = self.get_node(key)
+        rec[1] = split
+        rec[2] += now - self.node_start
+
+        self.node_start = now
+
+    def save(self, filename):
+        'save this worker\'s part of the log'
+
+        data = pickle.dumps(self.nodes)
+        write_atomic(part_filename(filename, self.worker_index), data)
+
+def merge_record(filename, num_workers, init, spec):
+    '''merge the workers' parts of a recorded log into filename, replacing any earlier log for the same problem
+
+    workers that saved no part (for example, due to an exception) are skipped
+    '''
+
+    nodes = {}
+
+    for i in range(num_workers):
+        part = part_filename(filename, i)
+
+        if not os.path.exists(part):
+            continue
+
+        with open(part, 'rb') as f:
+            part_nodes = pickle.load(f)
+
+        os.remove(part)
+
+        nodes.update(part_nodes)
+
+    logs = load_log_file(filename) if os.path.exists(filename) else {}
+    logs[problem_key(init, spec)] = {'nodes': nodes}
+
+    write_atomic(filename, pickle.dumps(logs))
+
+    if Settings.PRINT_OUTPUT:
+        print(f"Recorded {len(nodes)} nodes to {filename}")
+
+def load_log_file(filename):
+    'load a log file, a dict mapping problem keys to logs'
+
+    with open(filename, 'rb') as f:
+        rv = pickle.load(f)
+
+    return rv
+
+class ReplayLog(Freezable):
+    'a recorded log being replayed, used by the (single) worker'
+
+    def __init__(self, nodes):
+        self.nodes = nodes
+
+        self.num_missing = 0 # nodes that were not in the log
+        self.num_mismatches = 0 # nodes whose outcome or split differed from the log
+
+        self.freeze_attrs()
+
+    def get_node(self, ss):
+        'get the record of the node ss (see ReplayRecorder), or None if it\'s not in the log'
+
+        rv = self.nodes.get(path_key(ss.branch_tuples))
+
+        if rv is None:
+            self.num_missing += 1
+
+        return rv
+
+    def check_outcome(self, rec, outcome):
+        '''check the outcome of a replayed overapproximation against the log
+
+        the outcome is only compared: the branch ends based on this run's outcome, never the recorded one, since a
+        recorded 'safe' was not proven by this run
+        '''
+
+        if outcome != rec[0][1]:
+            self.num_mismatches += 1
+
+    def check_split(self, key, split):
+        'check the split (or None for a leaf) of a node against the log'
+
+        rec = self.nodes.get(key)
+
+        if rec is not None and rec[1] != split:
+            self.num_mismatches += 1
+
+    def print_summary(self):
+        'print the number of missing and mismatched nodes'
+
+        print(f"Replayed {len(self.nodes)} logged nodes: {self.num_missing} missing, " + \
+              f"{self.num_mismatches} mismatched")
+
+def load_replay(filename, init, spec):
+    'load the log of a problem from a log file for replay, returns a ReplayLog or None if the problem isn\'t in it'
+
+    logs = load_log_file(filename)
+    log = logs.get(problem_key(init, spec))
+
+    if log is None:
+        rv = None
+
+        if Settings.PRINT_OUTPUT:
+            print(f"Warning: {filename} has no log for this problem; not replaying")
+    else:
+        rv = ReplayLog(log['nodes'])
+
+    return rv
+
+def compare_logs(log_a, log_b, max_rows=10):
+    'print a node-by-node comparison of two logs of the same problem'
+
+    nodes_a = log_a['nodes']
+    nodes_b = log_b['nodes']
+    common = [key for key in nodes_a if key in nodes_b]
+
+    print(f"Nodes: {len(nodes_a)} in a, {len(nodes_b)} in b, {len(common)} in both")
+
+    if common:
+        secs_a = sum(nodes_a[key][2] for key in common)
+        secs_b = sum(nodes_b[key][2] for key in common)
+        diffs = [key for key in common if nodes_a[key][:2] != nodes_b[key][:2]]
+
+        print(f"Time on common nodes: {round(secs_a, 3)} sec in a, {round(secs_b, 3)} sec in b " + \
+              f"({round(100 * (secs_b - secs_a) / max(secs_a, 1e-9), 1)}%)")
+        print(f"Nodes with a different overapproximation or split: {len(diffs)}")
+
+        by_change = sorted(common, key=lambda key: abs(nodes_b[key][2] - nodes_a[key][2]), reverse=True)
+
+        print("\nLargest per-node differences (sec in a -> sec in b):")
+
+        for key in by_change[:max_rows]:
+            path = path_str(key) or '(root)'
+            print(f"{round(nodes_a[key][2], 4)} -> {round(nodes_b[key][2], 4)}: {path}")
+
+def main():
+    'compare two log files'
+
+    if len(sys.argv) != 3:
+        print('usage: "python3 -m nnenum.replay <log_file_a> <log_file_b>"')
+        sys.exit(1)
+
+    logs_a = load_log_file(sys.argv[1])
+    logs_b = load_log_file(sys.argv[2])
+
+    for key, log_a in logs_a.items():
+        log_b = logs_b.get(key)
+
+        if log_b is not None:
+            print(f"\nProblem {key}:")
+            compare_logs(log_a, log_b)
+
+if __name__ == '__main__':
+    main()
@@ -3,21 +3,17 @@
 This defines the object returned by enumerate_network
 '''
 
-import multiprocessing
-
 from nnenum.util import Freezable
+from nnenum.syncutil import ProcessSync
 
 class Result(Freezable):
     'computation result object'
 
-    manager = None # created on first init
-
     # possible result strings in result_str
     results = ["none", "error", "timeout", "safe", "unsafe (unconfirmed)", "unsafe"]
 
-    def __init__(self, nn, quick=False):
-        if Result.manager is None:
-            Result.manager = multiprocessing.Manager()
+    def __init__(self, nn, quick=False, sync=None):
+        # sync is the factory for the shared fields (a syncutil.ProcessSync is created if None)
         
         # result string, one of Result.results
         # can be safe/unsafe only if a spec is provided to verification problem
@@ -34,34 +30,77 @@ class Result(Freezable):
         # total number of times LP solver was called during enumeration and verification / plotting (statistic)
         self.total_lps = 0
 
+        # simplex calls and iterations (statistic, glpk/highs), and those starting from a basis kept from the parent lp
+        self.total_simplex_calls = 0
+        self.total_simplex_iterations = 0
+        self.inherited_basis_calls = 0
+        self.inherited_basis_iterations = 0
+
         # total number of stars explored during path enumeration
         self.total_stars = 0
 
+        # stars offloaded between processes (statistic): count, total bytes and total pack + unpack seconds
+        self.total_offload_count = 0
+        self.total_offload_bytes = 0
+        self.total_offload_secs = 0.0
+
+        # work stealing between processes (statistic): stolen stars, requests refused since the victim had no work
+        # to give, and total seconds from each request to its reply
+        self.total_steals = 0
+        self.total_steal_refusals = 0
+        self.total_steal_secs = 0.0
+
+        # stars spilled to disk due to Settings.MAX_FRONTIER_MEMORY (statistic): count, total bytes written and total
+        # write + read seconds
+        self.total_spilled_stars = 0
+        self.total_spill_bytes = 0
+        self.total_spill_secs = 0.0
+
+        # seconds each worker process spent without work (statistic)
+        self.worker_idle_secs = []
+
         # data (3-tuple) about problem progress: (finished_stars, unfinished_stars, finished_work_frac)
         self.progress_tuple = (0, 0, 0)
 
         ##### assigned if cls.RESULT_SAVE_TIMERS is nonempty. Map of timer_name -> total_seconds
         self.timers = {}
 
+        ##### assigned if Settings.TIMING_STATS is True. Timer trees as dicts (see TimerData.to_dict()) ######
+        self.timer_tree = None # all workers summed
+
+        ##### assigned if Settings.HOT_TIMERS is True. Map of hot timer name -> (num_calls, total_secs), see HotTimers
+        self.hot_timers = {} # all workers summed
+
         if not quick:
+            if sync is None:
+                sync = ProcessSync()
+
             ###### assigned if Settings.RESULT_SAVE_POLYS = True. Each entry is polygon (list of 2-d points), ######
-            self.polys = Result.manager.list()
+            self.polys = sync.list()
 
             ###### assigned if Settings.RESULT_SAVE_STARS = True. Each entry is an LpStar ######
-            self.stars = Result.manager.list()
+            self.stars = sync.list()
+
+            ###### assigned if Settings.TIMING_STATS = True. The timer tree of each worker, in worker order ######
+            self.worker_timer_trees = sync.list()
+
+            ###### assigned if Settings.HOT_TIMERS = True. The hot timers of each worker, in worker order ######
+            self.worker_hot_timers = sync.list()
 
             ###### below are assigned used if spec is not None and property is unsafe ######
             # counter-example boolean flags
-            self.found_counterexample = multiprocessing.Value('i', 0)
-            self.found_confirmed_counterexample = multiprocessing.Value('i', 0) # found counter-example with concrete input
+            self.found_counterexample = sync.Value('i', 0)
+            self.found_confirmed_counterexample = sync.Value('i', 0) # found counter-example with concrete input
 
             # concrete counter-example input and output
-            self.coutput = multiprocessing.Array('d', nn.get_num_outputs())
-            self.cinput = multiprocessing.Array('d', nn.get_num_inputs())
+            self.coutput = sync.Array('d', nn.get_num_outputs())
+            self.cinput = sync.Array('d', nn.get_num_inputs())
         else:
             # types may be different hmmm...
             self.polys = None
             self.stars = None
+            self.worker_timer_trees = []
+            self.worker_hot_timers = []
             self.found_counterexample = 0
             self.found_confirmed_counterexample = 0
             self.cinput = None
@@ -0,0 +1,185 @@
+'''
+nnenum verification daemon
+
+usage: "python3 -m nnenum.server <socket_file> [processes=<auto>]"
+
+The server stays resident so that each verification job does not pay the python, numpy, onnx and glpk import cost,
+and loaded networks are cached by the hash of their onnx file. Jobs are submitted over a unix socket, one job per
+connection, as a single line of json (see nnenum.client):
+
+{"onnx": <path>, "vnnlib": <path>, "timeout": <secs or null>, "settings": <"auto", "control", "image" or "exact">}
+
+The reply is a single line of json: {"result": <result string, same as nnenum.main()>, "secs": <runtime>}.
+Other commands are {"command": "ping"} and {"command": "shutdown"}.
+
+Stanley Bak
+'''
+
+import sys
+import os
+import time
+import json
+import socket
+import hashlib
+import traceback
+from collections import OrderedDict
+
+from nnenum.settings import Settings
+from nnenum.enumerate import Enumerator
+from nnenum.nnenum import load_network, verify
+from nnenum.vnnlib import get_num_inputs_outputs
+from nnenum.util import Freezable
+
+class VerificationServer(Freezable):
+    'resident verification server with a network cache'
+
+    MAX_CACHED_NETWORKS = 8
+
+    def __init__(self, socket_filename, num_processes=None):
+        self.socket_filename = socket_filename
+
+        if num_processes is None:
+            num_processes = Settings.NUM_PROCESSES
+
+        self.num_processes = num_processes
+
+        # onnx file hash -> (NeuralNetwork, io_sizes), least recently used first. io_sizes is the result of
+        # get_num_inputs_outputs(), so the onnx file is not loaded again for each job's spec
+        self.networks = OrderedDict()
+
+        # worker pool for the most recently used network
+        self.enumerator = None
+        self.enumerator_hash = None
+
+        self.freeze_attrs()
+
+    def get_network(self, onnx_filename):
+        '''get the network for the onnx file, loading it if it's not cached
+
+        returns a tuple: (file_hash, network, io_sizes)
+        '''
+
+        with open(onnx_filename, 'rb') as f:
+            file_hash = hashlib.sha256(f.read()).hexdigest()
+
+        entry = self.networks.get(file_hash)
+
+        if entry is None:
+            print(f"Loading network {onnx_filename}")
+            entry = load_network(onnx_filename), get_num_inputs_outputs(onnx_filename)
+            self.networks[file_hash] = entry
+
+            if len(self.networks) > VerificationServer.MAX_CACHED_NETWORKS:
+                self.networks.popitem(last=False)
+        else:
+            print(f"Using cached network for {onnx_filename}")
+            self.networks.move_to_end(file_hash)
+
+        network, io_sizes = entry
+
+        return file_hash, network, io_sizes
+
+    def get_enumerator(self, file_hash, network):
+        'get the worker pool for the network, replacing the pool of the previous network if needed'
+
+        if self.enumerator_hash != file_hash:
+            if self.enumerator is not None:
+                self.enumerator.close()
+
+            self.enumerator = Enumerator(network, self.num_processes)
+            self.enumerator_hash = file_hash
+
+        return self.enumerator
+
+    def run_job(self, job):
+        '''run a verification job
+
+        returns the reply dict
+        '''
+
+        start = time.perf_counter()
+        rv = {}
+
+        try:
+            # each job starts with default settings, other than the number of processes
+            Settings.reset()
+            Settings.NUM_PROCESSES = self.num_processes
+
+            file_hash, network, io_sizes = self.get_network(job['onnx'])
+            enumerator = self.get_enumerator(file_hash, network)
+
+            rv['result'] = verify(job['onnx'], job['vnnlib'], job.get('timeout'), job.get('settings', 'auto'),
+                                  network=network, enumerator=enumerator, io_sizes=io_sizes)
+        except Exception as e: # pylint: disable=broad-except
+            traceback.print_exc()
+            rv['result'] = 'error'
+            rv['message'] = str(e)
+
+        rv['secs'] = time.perf_counter() - start
+
+        return rv
+
+    def serve(self):
+        'accept and run jobs until a shutdown command is received'
+
+        if os.path.exists(self.socket_filename):
+            os.remove(self.socket_filename)
+
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server_sock:
+            server_sock.bind(self.socket_filename)
+            server_sock.listen()
+
+            print(f"nnenum server listening on {self.socket_filename} with {self.num_processes} processes", flush=True)
+
+            should_exit = False
+
+            while not should_exit:
+                conn, _ = server_sock.accept()
+
+                with conn:
+                    with conn.makefile('rw') as f:
+                        line = f.readline()
+
+                        try:
+                            job = json.loads(line)
+                        except ValueError:
+                            print(f"Ignoring malformed job: {line!r}")
+                            continue
+
+                        command = job.get('command', 'verify')
+
+                        if command == 'ping':
+                            reply = {'result': 'pong'}
+                        elif command == 'shutdown':
+                            reply = {'result': 'shutdown'}
+                            should_exit = True
+                        else:
+                            print(f"\nJob: {job}", flush=True)
+                            reply = self.run_job(job)
+                            print(f"Job result: {reply}", flush=True)
+
+                        try:
+                            f.write(json.dumps(reply) + "\n")
+                            f.flush()
+                        except OSError:
+                            print("Client disconnected before the reply was sent")
+
+        if self.enumerator is not None:
+            self.enumerator.close()
+
+        os.remove(self.socket_filename)
+
+def main():
+    'main entry point'
+
+    if len(sys.argv) < 2:
+        print('usage: "python3 -m nnenum.server <socket_file> [processes=<auto>]"')
+        sys.exit(1)
+
+    num_processes = int(sys.argv[2]) if len(sys.argv) >= 3 else None
+
+    server = VerificationServer(sys.argv[1], num_processes)
+    server.serve()
+
+if __name__ == '__main__':
+    main()
@@ -6,6 +6,7 @@ Settings.NUM_PROCESSES = 1
 '''
 
 import os
+import pickle
 import multiprocessing
 
 import numpy as np
@@ -21,12 +22,48 @@ class Settings(metaclass=FreezableMeta):
     BRANCH_OVERAPPROX, BRANCH_EGO, BRANCH_EGO_LIGHT, BRANCH_EXACT = range(4) # used for BRANCH_MODE
     SPLIT_LARGEST, SPLIT_ONE_NORM, SPLIT_SMALLEST, SPLIT_INORDER = range(4) # used for SPLIT_ORDER
     #TODO: one norm should acutally be called inf norm
+    FRONTIER_DFS, FRONTIER_BFS, FRONTIER_BEST_FIRST = range(3) # used for FRONTIER_ORDER
+    PRIORITY_DISTANCE, PRIORITY_WORK_FRAC, PRIORITY_DEPTH = range(3) # used for FRONTIER_PRIORITY
+    BACKEND_PROCESSES, BACKEND_THREADS = range(2) # used for WORKER_BACKEND
+
+    @classmethod
+    def snapshot(cls):
+        '''get a dict with the current value of every setting (used to send settings to running worker processes)
+
+        settings that can't be pickled (such as a lambda in TEST_FUNC_BEFORE_ASSIGNMENT) are left out, since they
+        would make the put() on a multiprocessing queue fail silently in its feeder thread
+        '''
+
+        rv = {}
+
+        for name in dir(cls):
+            if name.isupper() and not name.startswith('_'):
+                val = getattr(cls, name)
+
+                try:
+                    pickle.dumps(val)
+                except (pickle.PicklingError, TypeError, AttributeError):
+                    if cls.PRINT_OUTPUT:
+                        print(f"Warning: Settings.{name} can't be pickled, so it's not sent to the workers")
+
+                    continue
+
+                rv[name] = val
+
+        return rv
+
+    @classmethod
+    def restore(cls, values):
+        'assign settings from a dict created with snapshot()'
+
+        for name, val in values.items():
+            setattr(cls, name, val)
 
     @classmethod
     def reset(cls):
         'assign default settings'
         
-        cls.LP_SOLVER = "GLPK" # options: 'GLPK', 'Gurobi' 
+        cls.LP_SOLVER = "GLPK" # options: 'GLPK', 'Gurobi', 'HiGHS' (needs highspy)
 
         # settings / optimizations
         num_cores = multiprocessing.cpu_count()
@@ -37,6 +74,7 @@ class Settings(metaclass=FreezableMeta):
             pass
         
         cls.NUM_PROCESSES = num_cores # use multiple cores
+        cls.WORKER_BACKEND = cls.BACKEND_PROCESSES # threads avoid process startup and star pickling (small networks)
         cls.TIMEOUT = np.inf # verification timeout, in seconds (np.inf = no timeout)
 
         cls.SINGLE_SET = False # only do single-set overapproximation (no splitting)
@@ -57,6 +95,7 @@ class Settings(metaclass=FreezableMeta):
         cls.PRINT_PROGRESS = True # print periodic progress updates
         cls.PRINT_INTERVAL = 0.1 # print interval in seconds (0 = no printing)
         cls.TIMING_STATS = False # compute and print detailed timing stats
+        cls.HOT_TIMERS = True # cheap flat timers of hot paths, saved in Result.hot_timers (see timerutil.HotTimers)
 
         cls.CHECK_SINGLE_THREAD_BLAS = True
         # idea... replace this with threadpoolctl: https://github.com/joblib/threadpoolctl
@@ -101,8 +140,43 @@ class Settings(metaclass=FreezableMeta):
         
         cls.RESULT_SAVE_POLYS_EPSILON = 1e-7 # accuracy of vertices when projecting polygons for Kamenev method
 
+        # order in which each worker explores its pending stars, see frontier.py
+        cls.FRONTIER_ORDER = cls.FRONTIER_DFS # dfs keeps memory bounded, best-first can find counterexamples sooner
+        cls.FRONTIER_PRIORITY = cls.PRIORITY_DISTANCE # key used if FRONTIER_ORDER is FRONTIER_BEST_FIRST
+        cls.COMPACT_FRONTIER = False # store pending stars as an ancestor snapshot plus splits, rebuilt when popped
+        cls.COMPACT_FRONTIER_CACHE_SIZE = 8 # number of recently used ancestor snapshots kept unpickled per worker
+        cls.MAX_FRONTIER_MEMORY = None # per-worker bytes for pending stars, more are spilled to disk (None = no limit)
+        cls.FRONTIER_SPILL_DIR = None # directory for frontier spill files (None = the system temp directory)
+
+        # idle workers steal a star from a random busy worker. The steal is cooperative: the victim only answers
+        # between advancing its stars, so the latency (Result.total_steal_secs) depends on how long that takes
         cls.OFFLOAD_CLOSEST_TO_ROOT = True # when offloading work to other threads, use stars closest to root of search
 
+        cls.SHM_TRANSFER = True # send offloaded stars' numpy buffers through shared memory instead of the queue pipe
+        cls.SHM_TRANSFER_MIN_BYTES = 64 * 1024 # stars with fewer buffer bytes than this are pickled in-band
+
+        cls.DISTRIBUTED_WORKER_TIMEOUT = 30 # seconds without a heartbeat before a distributed worker is considered lost
+
+        cls.CHECKPOINT_DIR = None # directory for frontier checkpoints, see checkpoint.py (None = no checkpoints)
+        cls.CHECKPOINT_INTERVAL = 600 # seconds between checkpoints (a checkpoint is also saved on timeout)
+        cls.CHECKPOINT_RESUME = False # resume from the checkpoint in CHECKPOINT_DIR if it's for the same problem
+
+        cls.METRICS_FILE = None # file to append live metrics to as json lines ('-' = stdout), see metrics.py
+        cls.METRICS_PORT = None # localhost port serving live metrics in prometheus format at /metrics (0 = any port)
+        cls.METRICS_INTERVAL = 1.0 # seconds between live metrics samples
+
+        cls.TRACE_FILE = None # chrome trace and collapsed stacks of the Timers (needs TIMING_STATS), see trace.py
+        cls.TRACE_MAX_EVENTS = 10**6 # timer events recorded per worker for TRACE_FILE; later events are dropped
+
+        cls.TREE_SIZE_CONFIDENCE = 0.95 # confidence of the per-depth split probability intervals, see treesize.py
+        cls.TREE_SIZE_MAX_DEPTH = 1024 # deeper stars share the statistics of this depth in the tree size estimate
+        cls.TREE_SIZE_EXTRAPOLATE_DEPTHS = 8 # depths past the deepest star that the tree size estimate extrapolates
+
+        cls.REPLAY_RECORD = None # filename to record the search tree and per-node work to, see replay.py
+        cls.REPLAY_LOG = None # recorded filename to replay deterministically (single-threaded), see replay.py
+
+        cls.PARALLEL_BOXES = False # verify all input boxes of a vnnlib file at once, see parallel_boxes.py
+
         cls.SPLIT_TOLERANCE = 1e-8 # small outputs get rounded to zero when deciding if splitting is possible
         cls.TEST_FUNC_BEFORE_ASSIGNMENT = None # function to call before eager assignement, used for unit testing
 
@@ -113,6 +187,7 @@ class Settings(metaclass=FreezableMeta):
         cls.GLPK_TIMEOUT = 60 # maximum allowed seconds for each indivudal LP run
         cls.GLPK_FIRST_PRIMAL = True # first try primal LP... if that fails do dual
         cls.GLPK_RESET_BEFORE_MINIMIZE = False # reset the lp basis before minimize
+        cls.GLPK_INHERITED_DUAL = True # first lp after a copy or deserialize uses dual simplex from the kept basis
 
         cls.SKIP_COMPRESSED_CHECK = False # sanity check for compressed inputs when COMPRESS_INIT_BOX is False
         ####
@@ -122,6 +197,13 @@ class Settings(metaclass=FreezableMeta):
         ####
         cls.NUM_LP_PROCESSES = 1 # if > 1, then force multiprocessing during lp step
         cls.PARALLEL_ROOT_LP = True # near the root of the search, use parallel lp, override NUM_LP_PROCESES if true
+        cls.LP_POOL_PERSISTENT = True # keep the parallel lp processes alive between layers, see lputil.LpPool
+        cls.LP_BATCH_SIZE = 16 # neurons per batched lp call when computing bounds single-threaded (1 = no batching)
+        cls.LP_BATCH_EARLY_STOP = True # batched bound lps stop once the bound's sign is decided (uses dual simplex)
+        cls.PRUNE_LP_ROWS = False # remove redundant rows from the lps of split stars, see LpStar.prune_rows()
+        cls.PRUNE_LP_MIN_ROWS = 20 # prune once a star's lp has this many rows more than after its last pruning
+        cls.PRUNE_LP_MAX_LPS = 10 # lp redundancy tests per pruning, after the interval tests (0 = interval tests only)
+        cls.PRUNE_LP_TOLERANCE = 1e-6 # relative bloat of the input box for pruning, >= the lp solvers' feasibility tol
 
         ####
         # generally it should be safe to add any linear layers to the whitelist
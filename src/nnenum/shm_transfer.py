@@ -0,0 +1,188 @@
+'''
+Shared-memory transfer of star states between worker processes
+
+Offloaded LpStarState objects are pickled with protocol 5, so that the large numpy buffers (a_mat, bias, zonotope
+bounds, simulation vectors, ...) are produced out-of-band. Those buffers are copied into a single
+multiprocessing.shared_memory segment, and only a small StarDescriptor (the in-band pickle bytes and the segment
+name) goes through the work queue. The receiving process copies the buffers out and unlinks the segment.
+
+Stanley Bak
+'''
+
+import pickle
+import time
+
+from multiprocessing import shared_memory, resource_tracker
+
+from nnenum.util import Freezable
+from nnenum.timerutil import Timers
+from nnenum.settings import Settings
+
+class StarDescriptor(Freezable):
+    'small, picklable handle to an object whose out-of-band buffers live in a shared memory segment'
+
+    def __init__(self, payload, shm_name, buffer_sizes):
+        self.payload = payload # in-band pickle bytes
+        self.shm_name = shm_name # None if the object was pickled fully in-band
+        self.buffer_sizes = buffer_sizes # sizes in bytes of each out-of-band buffer, in order
+
+        self.freeze_attrs()
+
+    def num_bytes(self):
+        'total bytes described by this descriptor (in-band + out-of-band)'
+
+        return len(self.payload) + sum(self.buffer_sizes)
+
+    def unpack(self, release=True):
+        '''reconstruct the object and release the shared memory segment
+
+        this can only be called once per descriptor, unless release is False. Then the segment is kept for other
+        readers, and the process that packed the object releases it with discard() once they are done.
+
+        Only the packing process changes the segment's registration with the resource tracker (see pack()), since
+        forked readers share the tracker, and each reader unregistering the segment would fail after the first.
+        '''
+
+        Timers.tic('shm unpack')
+
+        if self.shm_name is None:
+            rv = pickle.loads(self.payload)
+        else:
+            total = sum(self.buffer_sizes)
+            shm = shared_memory.SharedMemory(name=self.shm_name)
+
+            # single copy out of the segment, so it can be unlinked right away
+            data = bytearray(shm.buf[:total])
+            shm.close()
+
+            if release:
+                shm.unlink()
+                self.shm_name = None
+
+            view = memoryview(data)
+            buffers = []
+            offset = 0
+
+            for size in self.buffer_sizes:
+                buffers.append(view[offset:offset + size])
+                offset += size
+
+            rv = pickle.loads(self.payload, buffers=buffers)
+
+        Timers.toc('shm unpack')
+
+        return rv
+
+    def discard(self):
+        'release the shared memory segment without reconstructing the object'
+
+        if self.shm_name is not None:
+            shm = shared_memory.SharedMemory(name=self.shm_name)
+            shm.close()
+            shm.unlink()
+            self.shm_name = None
+
+def pack(obj):
+    '''pack an object into a StarDescriptor
+
+    buffers go into a shared memory segment if their total size is at least Settings.SHM_TRANSFER_MIN_BYTES,
+    otherwise everything is pickled in-band
+
+    returns the StarDescriptor
+    '''
+
+    Timers.tic('shm pack')
+
+    buffers = []
+    payload = pickle.dumps(obj, protocol=5, buffer_callback=buffers.append)
+    raws = [b.raw() for b in buffers]
+    sizes = [r.nbytes for r in raws]
+    total = sum(sizes)
+    rv = None
+
+    if raws and total >= Settings.SHM_TRANSFER_MIN_BYTES:
+        try:
+            shm = shared_memory.SharedMemory(create=True, size=total)
+        except OSError as e:
+            # for example, /dev/shm is full (docker defaults to 64MB)
+            if Settings.PRINT_OUTPUT:
+                print(f"Warning: shared memory allocation of {total} bytes failed ({e}); sending star in-band")
+
+            shm = None
+
+        if shm is not None:
+            offset = 0
+
+            for raw, size in zip(raws, sizes):
+                shm.buf[offset:offset + size] = raw
+                offset += size
+
+            # the receiving process unlinks the segment, so don't let this process's tracker clean it up at exit
+            resource_tracker.unregister(shm._name, 'shared_memory') # pylint: disable=protected-access
+
+            rv = StarDescriptor(payload, shm.name, sizes)
+            shm.close()
+
+    for b in buffers:
+        b.release()
+
+    if rv is None:
+        rv = StarDescriptor(pickle.dumps(obj, protocol=5), None, [])
+
+    Timers.toc('shm pack')
+
+    return rv
+
+class TransferStats(Freezable):
+    'process-local measurements of star transfers, flushed to shared state by the worker'
+
+    def __init__(self):
+        self.num_sent = 0
+        self.bytes_sent = 0
+        self.send_secs = 0.0
+
+        self.num_received = 0
+        self.receive_secs = 0.0
+
+        self.freeze_attrs()
+
+    def record_send(self, descriptor, secs):
+        'record a packed star'
+
+        self.num_sent += 1
+        self.bytes_sent += descriptor.num_bytes()
+        self.send_secs += secs
+
+    def record_receive(self, secs):
+        'record an unpacked star'
+
+        self.num_received += 1
+        self.receive_secs += secs
+
+    def reset(self):
+        'reset all counts (after they were flushed)'
+
+        self.num_sent = 0
+        self.bytes_sent = 0
+        self.send_secs = 0.0
+
+        self.num_received = 0
+        self.receive_secs = 0.0
+
+def timed_pack(obj, stats):
+    'pack an object and record the transfer in stats'
+
+    start = time.perf_counter()
+    rv = pack(obj)
+    stats.record_send(rv, time.perf_counter() - start)
+
+    return rv
+
+def timed_unpack(descriptor, stats):
+    'unpack a descriptor and record the transfer in stats'
+
+    start = time.perf_counter()
+    rv = descriptor.unpack()
+    stats.record_receive(time.perf_counter() - start)
+
+    return rv
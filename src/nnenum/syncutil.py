@@ -0,0 +1,219 @@
+'''
+Factories for the shared objects used by SharedState and Result
+
+ProcessSync creates multiprocessing objects for worker processes on a single host (the default). ServedSync creates
+plain python objects, which the distributed coordinator serves to remote workers over TCP (see nnenum.distributed).
+ThreadSync creates the same plain objects for worker threads in one process (Settings.BACKEND_THREADS).
+Each factory remembers the objects it created, so they can be reset when the same workers run another job.
+
+Stanley Bak
+'''
+
+import multiprocessing
+from multiprocessing import managers
+import threading
+import queue
+
+from nnenum.util import Freezable
+
+class ProcessSync(Freezable):
+    'creates multiprocessing shared objects'
+
+    # can objects be sent through multiprocessing.shared_memory segments?
+    same_host = True
+
+    # do all workers share this address space, so stars can be passed without pickling them? (their lps are still
+    # serialized, since lps are confined to one thread)
+    same_address_space = False
+
+    manager = None # multiprocessing.Manager, created on first call to list()
+
+    def __init__(self):
+        # created objects, in creation order
+        self.locks = []
+        self.queues = []
+        self.values = []
+        self.arrays = []
+        self.lists = []
+
+        self.freeze_attrs()
+
+    def counts(self):
+        'get the number of objects of each kind that were created'
+
+        return (len(self.locks), len(self.queues), len(self.values), len(self.arrays), len(self.lists))
+
+    def Lock(self): # pylint: disable=invalid-name
+        'create a lock'
+
+        rv = multiprocessing.Lock()
+        self.locks.append(rv)
+
+        return rv
+
+    def Queue(self): # pylint: disable=invalid-name
+        'create a queue'
+
+        rv = multiprocessing.Queue()
+        self.queues.append(rv)
+
+        return rv
+
+    def Value(self, typecode, value=0): # pylint: disable=invalid-name
+        'create a shared value with a .value attribute'
+
+        rv = multiprocessing.Value(typecode, value)
+        self.values.append(rv)
+
+        return rv
+
+    def Array(self, typecode, size, lock=True): # pylint: disable=invalid-name
+        '''create a zero-initialized shared array
+
+        with lock=False, element accesses are not synchronized (for arrays where each process writes its own slot)
+        '''
+
+        rv = multiprocessing.Array(typecode, size, lock=lock)
+        self.arrays.append(rv)
+
+        return rv
+
+    def list(self):
+        'create a shared list'
+
+        if ProcessSync.manager is None:
+            ProcessSync.manager = multiprocessing.Manager()
+
+        rv = ProcessSync.manager.list()
+        self.lists.append(rv)
+
+        return rv
+
+    def reset(self):
+        'zero all values and arrays and clear all lists (call with no workers running)'
+
+        for val in self.values:
+            val.value = 0
+
+        for arr in self.arrays:
+            arr[:] = [0] * len(arr)
+
+        for lst in self.lists:
+            del lst[:]
+
+class ShardedCounter(Freezable):
+    '''a statistic with one slot per worker, so that workers can add to it without taking a lock
+
+    Each worker only writes its own slot, and readers sum all the slots. The last slot is the initial value, which is
+    assigned with the value property when no workers are running (for example, to restore a checkpoint).
+
+    Additions are kept locally until the worker calls flush(), which it does with its periodic shared variable update,
+    since each access to a served slot is a request to the coordinator (see nnenum.distributed).
+    '''
+
+    def __init__(self, sync, typecode, num_workers):
+        self.slots = sync.Array(typecode, num_workers + 1, lock=False)
+        self.pending = [0] * num_workers # local additions of each worker, not yet in its slot
+
+        self.freeze_attrs()
+
+    def add(self, worker_index, amount):
+        'add to a worker slot when flush() is next called (only call from that worker)'
+
+        self.pending[worker_index] += amount
+
+    def flush(self, worker_index):
+        'add the pending additions of a worker to its slot (only call from that worker)'
+
+        amount = self.pending[worker_index]
+
+        if amount:
+            self.pending[worker_index] = 0
+            add_to_item(self.slots, worker_index, amount)
+
+    @property
+    def value(self):
+        'the sum of the slots'
+
+        return sum(self.slots)
+
+    @value.setter
+    def value(self, val):
+        'assign the initial value and zero the worker slots (call with no workers running)'
+
+        num_slots = len(self.slots)
+
+        for i in range(num_slots - 1):
+            self.slots[i] = 0
+            self.pending[i] = 0
+
+        self.slots[num_slots - 1] = val
+
+def add_to_item(arr, index, amount):
+    '''add to an item of an array created by a sync object
+
+    served arrays (and proxies to them) do this in a single request, other arrays with a read and a write
+    '''
+
+    add_func = getattr(arr, 'add', None)
+
+    if add_func is not None:
+        add_func(index, amount)
+    else:
+        arr[index] += amount
+
+class ServedArray(list):
+    'list used as a shared array by ServedSync'
+
+    def add(self, index, amount):
+        'add to an item, which is a single request through a proxy (see add_to_item())'
+
+        self[index] += amount
+
+class ServedSync(ProcessSync):
+    '''creates plain objects, which the distributed coordinator serves to remote workers
+
+    these are only shared with other processes through proxies (see nnenum.distributed.RemoteSync)
+    '''
+
+    same_host = False
+
+    def Lock(self):
+        rv = threading.Lock()
+        self.locks.append(rv)
+
+        return rv
+
+    def Queue(self):
+        rv = queue.Queue()
+        self.queues.append(rv)
+
+        return rv
+
+    def Value(self, typecode, value=0):
+        rv = managers.Value(typecode, value)
+        self.values.append(rv)
+
+        return rv
+
+    def Array(self, typecode, size, lock=True):
+        zero = 0.0 if typecode in ['f', 'd'] else 0
+        rv = ServedArray([zero] * size)
+        self.arrays.append(rv)
+
+        return rv
+
+    def list(self):
+        rv = []
+        self.lists.append(rv)
+
+        return rv
+
+class ThreadSync(ServedSync):
+    '''creates plain objects used directly by worker threads in this process
+
+    stars are passed between the workers by reference, so they are not pickled (only their lps are serialized)
+    '''
+
+    same_host = True
+    same_address_space = True
@@ -7,6 +7,8 @@ September 2016
 '''
 
 import time
+import functools
+from time import perf_counter_ns
 
 from termcolor import cprint
 
@@ -23,18 +25,18 @@ class TimerData():
 
         self.parent = parent # parent TimerData, None for top-level timers
         self.children = [] # a list of child TimerData
+        self.child_map = {} # name -> child TimerData, for get_child()
 
-    def get_child(self, name):
-        'get a child timer with the given name'
+    def add_child(self, td):
+        'add a child timer'
 
-        rv = None
+        self.children.append(td)
+        self.child_map[td.name] = td
 
-        for child in self.children:
-            if child.name == name:
-                rv = child
-                break
+    def get_child(self, name):
+        'get a child timer with the given name'
 
-        return rv
+        return self.child_map.get(name)
 
     def get_children_recursive(self, name):
         'get all decendants with the given name (returns a list of TimerData)'
@@ -49,6 +51,17 @@ class TimerData():
 
         return rv
 
+    def to_dict(self, name=None):
+        '''get the timer tree rooted at this timer as plain dicts, which can be pickled (used for Result.timer_tree)
+
+        each dict has keys 'name', 'secs', 'calls' and 'children' (a list of dicts). name overrides this timer's name.
+        '''
+
+        return {'name': self.name if name is None else name,
+                'secs': self.total_secs,
+                'calls': self.num_calls,
+                'children': [child.to_dict() for child in self.children]}
+
     def full_name(self):
         'get the full name of the timer (including ancestors)'
 
@@ -78,6 +91,29 @@ class TimerData():
         self.total_secs += time.perf_counter() - self.last_start_time
         self.last_start_time = None
 
+def merge_timer_dicts(trees):
+    '''sum timer trees created with TimerData.to_dict(), matching children by name
+
+    returns the summed tree, or None if trees is empty
+    '''
+
+    rv = None
+
+    if trees:
+        rv = {'name': trees[0]['name'], 'secs': 0, 'calls': 0, 'children': []}
+        children = {} # name -> list of child trees, in order of first appearance
+
+        for tree in trees:
+            rv['secs'] += tree['secs']
+            rv['calls'] += tree['calls']
+
+            for child in tree['children']:
+                children.setdefault(child['name'], []).append(child)
+
+        rv['children'] = [merge_timer_dicts(child_list) for child_list in children.values()]
+
+    return rv
+
 class Timers():
     '''
     a static class for doing timer messuarements. Use
@@ -88,6 +124,11 @@ class Timers():
     top_level_timer = None
     stack = [] # stack of currently-running timers, parents at the start, children at the end
     enabled = True
+
+    # while recording (see record_events()), a list of (name, start_time, end_time) for each stopped timer
+    events = None
+    max_events = 0 # events past this many are dropped
+    dropped_events = 0
     
     def __init__(self):
         raise RuntimeError('Timers is a static class; should not be instantiated')
@@ -105,6 +146,26 @@ class Timers():
 
         Timers.enabled = False
 
+    @staticmethod
+    def enable():
+        'enables timing measurements'
+
+        Timers.enabled = True
+
+    @staticmethod
+    def record_events(max_events):
+        'start recording timer events (up to max_events), used for the timeline trace in trace.py'
+
+        Timers.events = []
+        Timers.max_events = max_events
+        Timers.dropped_events = 0
+
+    @staticmethod
+    def stop_recording():
+        'stop recording timer events and discard them'
+
+        Timers.events = None
+
     @staticmethod
     def tic(name):
         'start a timer'
@@ -132,7 +193,7 @@ class Timers():
                 if not Timers.stack:
                     Timers.top_level_timer = td
                 else:
-                    Timers.stack[-1].children.append(td)
+                    Timers.stack[-1].add_child(td)
 
             td.tic()
             Timers.stack.append(td)
@@ -150,8 +211,15 @@ class Timers():
             assert Timers.stack[-1].name == name, "Out of order toc(). Expected to first stop timer {}".format(
                 Timers.stack[-1].full_name())
 
-            Timers.stack[-1].toc()
-            Timers.stack.pop()
+            td = Timers.stack.pop()
+
+            if Timers.events is not None:
+                if len(Timers.events) < Timers.max_events:
+                    Timers.events.append((name, td.last_start_time, time.perf_counter()))
+                else:
+                    Timers.dropped_events += 1
+
+            td.toc()
         else:
             assert not Timers.stack, "Timers.enabled was False but Timers.stack non-empty: " + \
                                       f"{[t.name for t in Timers.stack]}"
@@ -267,3 +335,163 @@ class Timers():
 
                 other_print_func("{}Other ({}): {:.2f} sec{}".format(" " * (level + 1) * 2, td.name.capitalize(), \
                     other, percent_str))
+
+class HotTimers():
+    '''
+    a static class of cheap, flat timers for hot paths, which stay on when TIMING_STATS is False
+    (Settings.HOT_TIMERS, results are in Result.hot_timers)
+
+    Each timer is a preallocated slot addressed by the integer id that register(name) returns. Use hot_timed(name)
+    to time every call of a function, a HotTimer as a context manager, or inline code:
+
+        start = perf_counter_ns()
+        ...
+        HotTimers.add(timer_id, start)
+
+    When the Timers are enabled, hot_timed() and HotTimer also tic and toc a Timers timer with the same name, so the
+    detailed timing stats are unchanged.
+    '''
+
+    MAX_TIMERS = 256
+
+    names = [] # timer id -> name
+    ids = {} # name -> timer id
+    total_ns = [0] * MAX_TIMERS # these lists are modified in place, so functions can bind them
+    num_calls = [0] * MAX_TIMERS
+    enabled = True
+
+    def __init__(self):
+        raise RuntimeError('HotTimers is a static class; should not be instantiated')
+
+    @staticmethod
+    def register(name):
+        'get the id of the timer with the given name, adding it if needed'
+
+        rv = HotTimers.ids.get(name)
+
+        if rv is None:
+            rv = len(HotTimers.names)
+            assert rv < HotTimers.MAX_TIMERS, f"too many hot timers ({rv}), increase HotTimers.MAX_TIMERS"
+
+            HotTimers.names.append(name)
+            HotTimers.ids[name] = rv
+
+        return rv
+
+    @staticmethod
+    def reset():
+        'zero all timers (the registered ids stay valid)'
+
+        HotTimers.total_ns[:] = [0] * HotTimers.MAX_TIMERS
+        HotTimers.num_calls[:] = [0] * HotTimers.MAX_TIMERS
+
+    @staticmethod
+    def add(timer_id, start_ns):
+        'add a call to a timer, which started at the given perf_counter_ns() time'
+
+        if HotTimers.enabled:
+            HotTimers.total_ns[timer_id] += perf_counter_ns() - start_ns
+            HotTimers.num_calls[timer_id] += 1
+
+    @staticmethod
+    def get_stats():
+        'get a dict mapping the name of each called timer to (num_calls, total_secs)'
+
+        rv = {}
+
+        for timer_id, name in enumerate(HotTimers.names):
+            calls = HotTimers.num_calls[timer_id]
+
+            if calls > 0:
+                rv[name] = (calls, HotTimers.total_ns[timer_id] / 1e9)
+
+        return rv
+
+def merge_hot_timer_stats(stats_list):
+    'sum HotTimers.get_stats() dicts'
+
+    rv = {}
+
+    for stats in stats_list:
+        for name, (calls, secs) in stats.items():
+            prev_calls, prev_secs = rv.get(name, (0, 0.0))
+            rv[name] = (prev_calls + calls, prev_secs + secs)
+
+    return rv
+
+class HotTimer():
+    '''a context manager for a hot timer
+
+        EXAMPLE_TIMER = HotTimer('example')
+
+        with EXAMPLE_TIMER:
+            ...
+    '''
+
+    __slots__ = ['name', 'timer_id', 'starts']
+
+    def __init__(self, name):
+        self.name = name
+        self.timer_id = HotTimers.register(name)
+        self.starts = [] # stack of start times, so the timer can be nested in itself
+
+    def __enter__(self):
+        if Timers.enabled:
+            Timers.tic(self.name)
+
+        self.starts.append(perf_counter_ns())
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        start = self.starts.pop()
+
+        # like hot_timed(), a block that raises an exception is not counted
+        if exc_type is None:
+            if HotTimers.enabled:
+                HotTimers.total_ns[self.timer_id] += perf_counter_ns() - start
+                HotTimers.num_calls[self.timer_id] += 1
+
+            if Timers.enabled:
+                Timers.toc(self.name)
+
+def hot_timed(name):
+    '''decorator that times every call of a function with a hot timer
+
+    like a tic() and toc() around the whole function, a call that raises an exception is not counted (and its Timers
+    timer is left running, to be fixed by the handler)
+    '''
+
+    timer_id = HotTimers.register(name)
+    total_ns = HotTimers.total_ns
+    num_calls = HotTimers.num_calls
+
+    def decorator(func):
+        'the decorator'
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            'timed call'
+
+            if Timers.enabled:
+                Timers.tic(name)
+                start = perf_counter_ns()
+                rv = func(*args, **kwargs)
+                end = perf_counter_ns()
+                Timers.toc(name)
+
+                if HotTimers.enabled:
+                    total_ns[timer_id] += end - start
+                    num_calls[timer_id] += 1
+            elif HotTimers.enabled:
+                # the common case when TIMING_STATS is False
+                start = perf_counter_ns()
+                rv = func(*args, **kwargs)
+                total_ns[timer_id] += perf_counter_ns() - start
+                num_calls[timer_id] += 1
+            else:
+                rv = func(*args, **kwargs)
+
+            return rv
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,107 @@
+'''
+Timeline trace of the Timers (Settings.TRACE_FILE), for chrome://tracing / Perfetto and flamegraph tools
+
+While recording, every Timers.toc() also logs the timer's name, start and end time. Each worker records its own events
+and saves them next to the trace file when it finishes (like replay.py, distributed workers need a shared filesystem).
+After the enumeration, the parts are merged into TRACE_FILE in the Chrome trace-event json format, with one track per
+worker, and the self time of each timer path of each worker is written to TRACE_FILE + '.folded' in the collapsed-stack
+format used by flamegraph.pl, speedscope and inferno.
+
+Each call to enumerate_network() overwrites the files. Recording requires Settings.TIMING_STATS.
+
+Stanley Bak
+'''
+
+import json
+import os
+import pickle
+
+from nnenum.settings import Settings
+from nnenum.timerutil import Timers
+from nnenum.checkpoint import write_atomic
+
+def part_filename(filename, worker_index):
+    'get the filename of a worker\'s events, before they are merged'
+
+    return f'{filename}.part{worker_index}'
+
+def folded_filename(filename):
+    'get the filename of the collapsed stacks written along with a trace'
+
+    return f'{filename}.folded'
+
+def start_recording():
+    'start recording timer events in this process, if Settings.TRACE_FILE is set'
+
+    if Settings.TRACE_FILE is not None:
+        Timers.record_events(Settings.TRACE_MAX_EVENTS)
+
+def save_part(filename, worker_index, start_time):
+    '''stop recording and save this worker's events, as (name, start_us, duration_us) tuples
+
+    start_time is the enumeration's start time (perf_counter() is system-wide on linux, so the workers' tracks line up)
+    '''
+
+    events = [(name, 1e6 * (start - start_time), 1e6 * (end - start)) for name, start, end in Timers.events]
+    dropped = Timers.dropped_events
+
+    Timers.stop_recording()
+
+    write_atomic(part_filename(filename, worker_index), pickle.dumps((events, dropped)))
+
+def write_trace(filename, num_workers, worker_timer_trees):
+    '''merge the workers' events into a chrome trace file, and write the collapsed stacks of the timer trees
+
+    worker_timer_trees is Result.worker_timer_trees. Workers that saved no part (for example, due to an exception) are
+    skipped.
+    '''
+
+    trace_events = []
+    num_dropped = 0
+
+    for i in range(num_workers):
+        part = part_filename(filename, i)
+
+        if not os.path.exists(part):
+            continue
+
+        with open(part, 'rb') as f:
+            events, dropped = pickle.load(f)
+
+        os.remove(part)
+        num_dropped += dropped
+
+        trace_events.append({'name': 'process_name', 'ph': 'M', 'pid': i, 'args': {'name': f'Worker {i}'}})
+        trace_events.append({'name': 'process_sort_index', 'ph': 'M', 'pid': i, 'args': {'sort_index': i}})
+
+        for name, ts, dur in events:
+            trace_events.append({'name': name, 'ph': 'X', 'pid': i, 'tid': 0, 'ts': ts, 'dur': dur})
+
+    with open(filename, 'w') as f:
+        json.dump({'traceEvents': trace_events, 'displayTimeUnit': 'ms'}, f)
+
+    with open(folded_filename(filename), 'w') as f:
+        for i, tree in enumerate(worker_timer_trees):
+            write_folded(f, tree, f'Worker {i}')
+
+    if Settings.PRINT_OUTPUT:
+        print(f"Wrote {len(trace_events)} trace events to {filename}")
+
+        if num_dropped > 0:
+            print(f"Warning: {num_dropped} trace events were dropped (TRACE_MAX_EVENTS is {Settings.TRACE_MAX_EVENTS})")
+
+def write_folded(f, tree, stack):
+    '''write the collapsed stacks of a timer tree dict (see TimerData.to_dict()), in microseconds of self time
+
+    stack is the semicolon-separated path of the tree's root
+    '''
+
+    self_secs = tree['secs'] - sum(child['secs'] for child in tree['children'])
+    self_us = round(1e6 * self_secs)
+
+    if self_us > 0:
+        f.write(f"{stack} {self_us}\n")
+
+    for child in tree['children']:
+        # ';' separates the frames
+        write_folded(f, child, stack + ';' + child['name'].replace(';', ','))
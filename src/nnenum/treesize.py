@@ -0,0 +1,241 @@
+'''
+Online estimate of the size of the enumeration tree, used for the progress output and its ETA
+
+Every split is binary, so a star's depth is len(branch_tuples). Workers count, per depth, the stars that were split
+and the stars that finished (leaves, including stars proven safe by an overapproximation). From these, the split
+probability p_d at each depth is estimated, and the expected number of leaves below a star at depth d is
+
+    E_d = (1 - p_d) + 2 * p_d * E_{d+1}
+
+The stars that are still pending (anywhere in the frontiers) are counted per depth as created minus finished, so the
+expected number of remaining leaves is the sum of E_d over them. E_d is increasing in every p_d, so evaluating the
+recursion with the lower and upper ends of a Wilson score interval for each p_d gives an optimistic and a pessimistic
+estimate. These are not a confidence interval for the tree size: every depth is at its interval's end at once, and
+the split probabilities are not independent of the depth statistics they are pushed through.
+
+Depths where no star has finished yet use the statistics of the closest shallower depth, for at most
+Settings.TREE_SIZE_EXTRAPOLATE_DEPTHS depths past the deepest star seen so far. Stars at the last depth of the
+recursion are counted as leaves, which is exact at the network's number of relu neurons (every neuron is split).
+Depths at or past Settings.TREE_SIZE_MAX_DEPTH share the last bucket, which is treated as self-similar if it is
+reached: E = (1 - p) / (1 - 2p).
+
+Stanley Bak
+'''
+
+import math
+from statistics import NormalDist
+
+import numpy as np
+
+from nnenum.util import Freezable, to_time_str
+from nnenum.settings import Settings
+from nnenum.syncutil import add_to_item
+
+class TreeSizeStats(Freezable):
+    '''per-depth split and leaf counts, shared by the workers
+
+    like syncutil.ShardedCounter, each worker adds to its own row of the arrays without a lock. The roots (initial
+    stars, or the stars of a loaded checkpoint) are assigned with no workers running.
+    '''
+
+    def __init__(self, sync, num_workers, network):
+        num_relus = network.num_relu_neurons()
+        self.num_depths = min(num_relus, Settings.TREE_SIZE_MAX_DEPTH) + 1
+
+        # is the last depth a bucket for all the deeper stars, rather than the depth where every neuron is split?
+        self.last_self_similar = num_relus > Settings.TREE_SIZE_MAX_DEPTH
+
+        self.roots = sync.Array('i', self.num_depths, lock=False)
+        self.splits = sync.Array('i', num_workers * self.num_depths, lock=False)
+        self.leaves = sync.Array('i', num_workers * self.num_depths, lock=False)
+
+        self.freeze_attrs()
+
+    def bucket(self, depth):
+        'get the array index for a star depth'
+
+        return min(depth, self.num_depths - 1)
+
+    def set_roots(self, depths):
+        'assign the depths of the initial stars (call with no workers running)'
+
+        counts = [0] * self.num_depths
+
+        for depth in depths:
+            counts[self.bucket(depth)] += 1
+
+        self.roots[:] = counts
+
+    def add(self, worker_index, split_counts, leaf_counts):
+        'add a worker\'s counts, which are dicts mapping depth -> count (only call from that worker)'
+
+        offset = worker_index * self.num_depths
+
+        for depth, count in split_counts.items():
+            add_to_item(self.splits, offset + self.bucket(depth), count)
+
+        for depth, count in leaf_counts.items():
+            add_to_item(self.leaves, offset + self.bucket(depth), count)
+
+    def get_counts(self):
+        'get the (roots, splits, leaves) counts per depth, summed over the workers'
+
+        shape = (-1, self.num_depths)
+        splits = np.array(self.splits[:], dtype=float).reshape(shape).sum(axis=0)
+        leaves = np.array(self.leaves[:], dtype=float).reshape(shape).sum(axis=0)
+
+        return np.array(self.roots[:], dtype=float), splits, leaves
+
+    def estimate(self, elapsed, finished_stars):
+        '''estimate the tree size and the time remaining
+
+        elapsed is the number of seconds since the workers started, and finished_stars is the number of finished stars
+        (SharedState.finished_stars, which includes the stars finished by the run that saved a loaded checkpoint)
+
+        returns a TreeSizeEstimate, or None if no star has finished yet
+        '''
+
+        roots, splits, leaves = self.get_counts()
+        remaining = estimate_remaining_leaves(roots, splits, leaves, Settings.TREE_SIZE_CONFIDENCE,
+                                              self.last_self_similar)
+
+        rv = None
+
+        if remaining is not None:
+            secs_per_star = elapsed / max(1, leaves.sum())
+
+            rv = TreeSizeEstimate(finished_stars, remaining, secs_per_star, Settings.TREE_SIZE_CONFIDENCE)
+
+        return rv
+
+class TreeSizeEstimate(Freezable):
+    'the result of TreeSizeStats.estimate()'
+
+    def __init__(self, finished, remaining, secs_per_star, confidence):
+        self.finished = int(finished)
+        self.confidence = confidence
+
+        # (estimate, optimistic, pessimistic) tuples
+        self.remaining_stars = remaining
+        self.total_stars = tuple(self.finished + r for r in remaining)
+        self.eta = tuple(r * secs_per_star for r in remaining)
+
+        self.freeze_attrs()
+
+    def __str__(self):
+        stars = '/'.join(stars_str(s) for s in self.total_stars)
+        eta = '/'.join(time_str(s) for s in self.eta)
+
+        return f"expected {stars} stars, ETA {eta} (estimate/optimistic/pessimistic, " + \
+            f"{round(self.confidence * 100)}% per-depth intervals)"
+
+def stars_str(stars):
+    'string for a star count, which may be inf'
+
+    return 'inf' if math.isinf(stars) else str(round(stars))
+
+def time_str(secs):
+    'to_time_str, except that secs may be inf'
+
+    return 'inf' if math.isinf(secs) else to_time_str(secs)
+
+def wilson_interval(successes, trials, z):
+    'get the (low, high) wilson score interval for a binomial proportion'
+
+    p = successes / trials
+    denom = 1 + z * z / trials
+    center = (p + z * z / (2 * trials)) / denom
+    half = z * math.sqrt(p * (1 - p) / trials + z * z / (4 * trials * trials)) / denom
+
+    return max(0.0, center - half), min(1.0, center + half)
+
+def expected_leaves(split_probs, last_self_similar):
+    '''get the expected number of leaves below a star at each depth, given the split probability at each depth
+
+    if last_self_similar is True, the last depth is self-similar (its children are also in the last bucket),
+    otherwise stars at the last depth are leaves
+    '''
+
+    num_depths = len(split_probs)
+    rv = [0.0] * num_depths
+
+    if last_self_similar:
+        p = split_probs[-1]
+        rv[-1] = (1 - p) / (1 - 2 * p) if p < 0.5 else math.inf
+    else:
+        rv[-1] = 1.0
+
+    for d in range(num_depths - 2, -1, -1):
+        p = split_probs[d]
+
+        # avoid 0 * inf
+        rv[d] = 1.0 if p == 0 else (1 - p) + 2 * p * rv[d + 1]
+
+    return rv
+
+def estimate_remaining_leaves(roots, splits, leaves, confidence, last_self_similar=False):
+    '''estimate the number of leaves below the pending stars, from the per-depth counts
+
+    roots, splits and leaves are arrays indexed by depth. If last_self_similar is True, the last depth is a bucket for
+    all deeper stars (see TreeSizeStats). Returns an (estimate, optimistic, pessimistic) tuple, or None if no star has
+    finished.
+    '''
+
+    finished = splits + leaves
+
+    rv = None
+
+    if finished.sum() > 0:
+        z = NormalDist().inv_cdf(0.5 + confidence / 2)
+
+        # stars pending at each depth: the roots plus two children per split, minus the finished stars
+        created = roots.copy()
+        created[1:] += 2 * splits[:-1]
+        created[-1] += 2 * splits[-1]
+
+        pending = np.maximum(created - finished, 0)
+
+        # extrapolate the split probabilities only a few depths past the deepest star
+        deepest = np.nonzero(created + finished > 0)[0][-1]
+        num_depths = min(len(roots), deepest + 1 + Settings.TREE_SIZE_EXTRAPOLATE_DEPTHS)
+        last_self_similar = last_self_similar and num_depths == len(roots)
+
+        # split probabilities (estimate, optimistic, pessimistic) at each depth
+        probs = ([], [], [])
+        cur = None
+
+        for d in range(num_depths):
+            if finished[d] > 0:
+                p = splits[d] / finished[d]
+                cur = (p,) + wilson_interval(splits[d], finished[d], z)
+            elif cur is None:
+                # no stars finished at this depth or shallower; they are pending, so assume the deeper statistics
+                cur = next_observed(splits, finished, d, z)
+
+            for lst, val in zip(probs, cur):
+                lst.append(val)
+
+        pending = pending[:num_depths]
+        rv = []
+
+        for split_probs in probs:
+            exp_leaves = np.array(expected_leaves(split_probs, last_self_similar))
+            mask = pending > 0
+
+            rv.append(float(np.dot(pending[mask], exp_leaves[mask])))
+
+        rv = tuple(rv)
+
+    return rv
+
+def next_observed(splits, finished, depth, z):
+    'get the split probability (estimate, optimistic, pessimistic) of the first depth after depth with finished stars'
+
+    d = depth + 1
+
+    while finished[d] == 0:
+        d += 1
+
+    p = splits[d] / finished[d]
+
+    return (p,) + wilson_interval(splits[d], finished[d], z)
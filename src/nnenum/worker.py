@@ -6,8 +6,8 @@ Feb 2020
 '''
 
 import math
-import random
 import time
+import random
 
 import numpy as np
 
@@ -16,6 +16,12 @@ from nnenum.overapprox import do_overapprox_rounds, make_prerelu_sims, Overappro
 from nnenum.settings import Settings
 from nnenum.util import Freezable, to_time_str
 from nnenum.network import nn_unflatten, nn_flatten
+from nnenum.checkpoint import save_frontier, save_manifest, discard_frontier, STAT_NAMES
+from nnenum.lp_star_state import StarRecipe
+from nnenum.frontier import SpillFrontier
+from nnenum.replay import path_key
+from nnenum.metrics import get_rss_bytes
+from nnenum.lputil import SIMPLEX_STATS
 
 from nnenum.prefilter import LpCanceledException
 
@@ -45,9 +51,17 @@ class Worker(Freezable):
                 self.finished_star() # this sets self.priv.ss to None
 
                 if self.priv.work_list and Settings.BRANCH_MODE in [Settings.BRANCH_EGO, Settings.BRANCH_EGO_LIGHT]:
-                    self.priv.work_list[-1].should_try_overapprox = True
+                    self.priv.work_list.peek().should_try_overapprox = True
 
             timer_name = Timers.stack[-1].name if Timers.stack else None
+
+            # with checkpoints and a timeout, the star is backed up before each step, so a step interrupted by the
+            # timeout can be undone and the star saved in the final checkpoint
+            backup = None
+
+            if self.priv.ss and not self.has_timeout() and self.shared.checkpoint_info is not None and \
+                    math.isfinite(Settings.TIMEOUT):
+                backup = self.priv.ss.backup()
             
             try: # catch lp timeout
                 if self.priv.ss and not self.has_timeout():
@@ -72,6 +86,12 @@ class Worker(Freezable):
                 while Timers.stack and Timers.stack[-1].name != timer_name:
                     Timers.toc(Timers.stack[-1].name)
 
+                if backup is not None:
+                    # the star may have been partially propagated, so put its state from before the step back in the
+                    # frontier (the new star of a split is only pushed after its lps, so it's never in the frontier)
+                    self.priv.ss = None
+                    self.push_work(backup)
+
                 self.timeout()
 
             # pop queue before updating shared variables so it doesn't look like there's no work if queue is nonempty
@@ -79,31 +99,41 @@ class Worker(Freezable):
                 
                 if self.priv.work_list: # pop from local
                     self.priv.ss = self.priv.work_list.pop()
+
+                    if self.priv.recorder is not None:
+                        self.priv.recorder.start_node()
                     
-                else: # pop from global (shared)
+                else: # pop from global queue or steal
 
                     if self.priv.worker_index == 0 or self.shared.finished_initial_overapprox.value:
-                        self.priv.ss = self.shared.get_global_queue(timeout=0.01)
+                        self.priv.ss = self.get_more_work()
 
                     if self.priv.ss is not None:
                         
                         # make sure we tell other people we have work now
                         self.priv.shared_update_urgent = True
 
-                        if self.priv.fulfillment_requested_time is not None:
-                            diff = time.perf_counter() - self.priv.fulfillment_requested_time
-                            self.priv.fulfillment_requested_time = None
-                            self.priv.total_fulfillment_time += diff
-                            self.priv.total_fulfillment_count += 1
+                        if self.priv.recorder is not None:
+                            self.priv.recorder.start_node()
+
+            if isinstance(self.priv.ss, StarRecipe):
+                self.materialize_star()
+
+            self.update_idle_state()
 
             # shuffle (optional)
             if Settings.SHUFFLE_TIME is not None and time.perf_counter() > self.priv.next_shuffle_time:
                 self.shuffle_work() # todo: evaluate if this helps
 
             should_exit = self.update_shared_variables()
+            self.answer_steal_request()
             self.print_progress()
 
+            if not should_exit:
+                self.check_checkpoint()
+
         Timers.tic('post_loop')
+        self.save_final_checkpoint()
         self.update_final_stats()
         self.clear_remaining_work()
         Timers.toc('post_loop')
@@ -140,9 +170,16 @@ class Worker(Freezable):
         if do_overapprox and Settings.SPLIT_IF_IDLE and self.exists_idle_worker():
             do_overapprox = False
 
+        replay_rec = None if self.shared.replay is None else self.shared.replay.get_node(ss)
+
+        if replay_rec is not None:
+            # take the decision from the log rather than the scheduling-dependent checks, see replay.py
+            do_overapprox = replay_rec[0] is not None
+
         if do_overapprox:
             # todo: experiment global timeout vs per-round timeout
             start = time.perf_counter()
+            self.priv.overapprox_tries += 1
 
             def check_cancel_func():
                 'worker cancel func. can raise OverapproxCanceledException'
@@ -159,7 +196,8 @@ class Worker(Freezable):
                 if now - self.priv.start_time > Settings.TIMEOUT:
                     raise OverapproxCanceledException('timeout exceeded')
 
-                if now - start > Settings.OVERAPPROX_LP_TIMEOUT:
+                # during replay, the work at each node shouldn't depend on timing
+                if self.shared.replay is None and now - start > Settings.OVERAPPROX_LP_TIMEOUT:
                     raise OverapproxCanceledException('lp timeout exceeded')
 
             timer_name = 'do_overapprox_rounds'
@@ -167,6 +205,8 @@ class Worker(Freezable):
 
             # compute simulation first (and make sure it's safe)
             prerelu_sims = make_prerelu_sims(ss, network)
+            gen_limit = None
+            outcome = 'unsafe'
                         
             if prerelu_sims is None:
                 concrete_io_tuple = None
@@ -190,6 +230,7 @@ class Worker(Freezable):
 
                         self.found_unsafe(concrete_io_tuple)
                         self.add_branch_str('CONCRETE UNSAFE')
+                        outcome = 'concrete'
 
             if concrete_io_tuple is None:
                 # sim was safe, proceed with overapproximation
@@ -200,6 +241,9 @@ class Worker(Freezable):
                     if Settings.OVERAPPROX_GEN_LIMIT_MULTIPLIER is None:
                         gen_limit = np.inf
 
+                    if replay_rec is not None and replay_rec[0][0] is not None:
+                        gen_limit = replay_rec[0][0]
+
                     num_branches = len(ss.branch_tuples)
                     if num_branches > Settings.OVERAPPROX_NEAR_ROOT_MAX_SPLITS:
                         otypes = Settings.OVERAPPROX_TYPES
@@ -216,10 +260,12 @@ class Worker(Freezable):
 
                         self.found_unsafe(res.concrete_io_tuple)
                         self.add_branch_str('CONCRETE UNSAFE')
+                        outcome = 'concrete'
                     else:
 
                         is_safe = res.is_safe
                         safe_str = "safe" if is_safe else "unsafe"
+                        outcome = safe_str
                         self.add_branch_str(f"{safe_str} {res}")
 
                         if not is_safe:
@@ -241,9 +287,16 @@ class Worker(Freezable):
                     self.priv.max_approx_gen = 0 # reset limit
 
                     ss.should_try_overapprox = False
+                    outcome = 'canceled'
 
             Timers.toc(timer_name)
 
+            if self.priv.recorder is not None:
+                self.priv.recorder.overapprox(ss, gen_limit, outcome)
+
+            if replay_rec is not None and replay_rec[0] is not None and outcome != 'concrete':
+                self.shared.replay.check_outcome(replay_rec, outcome)
+
             ##### post overapproximation processing
             
             if Settings.PRINT_BRANCH_TUPLES:
@@ -262,11 +315,12 @@ class Worker(Freezable):
                 self.priv.update_stars += 1
                 self.priv.update_work_frac += ss.work_frac
                 self.priv.update_stars_in_progress -= 1
+                self.count_depth(self.priv.update_leaves, len(ss.branch_tuples))
+                self.end_node(ss, False)
                     
                 if not self.priv.work_list:
                     # urgently update shared variables to try to get more work
                     self.priv.shared_update_urgent = True
-                    self.priv.fulfillment_requested_time = time.perf_counter()
 
         return is_safe
         
@@ -303,10 +357,10 @@ class Worker(Freezable):
             #self.priv.work_list.append(self.priv.ss)
             self.priv.ss = None
 
-        self.priv.work_list += global_work
+        self.priv.work_list.extend(global_work)
 
         # shuffle remaining work and put it all into the queue
-        random.shuffle(self.priv.work_list)
+        self.priv.work_list.shuffle()
 
         #for ss in self.priv.work_list:
         #    self.shared.put_queue(ss)
@@ -327,11 +381,10 @@ class Worker(Freezable):
 
         # checking qsize here slows things down
 
-        for i, size in enumerate(self.shared.heap_sizes):
-            if i != self.priv.worker_index:
-                if size == 0:
-                    rv = True
-                    break
+        for i, is_idle in enumerate(self.shared.idle_workers):
+            if i != self.priv.worker_index and is_idle:
+                rv = True
+                break
 
         Timers.toc('exists_idle_worker')
 
@@ -353,71 +406,101 @@ class Worker(Freezable):
 
         if self.priv.shared_update_urgent or (self.priv.work_list and now > self.priv.next_shared_var_update):
             Timers.tic('update_shared_variables')
-            
-            windex = self.priv.worker_index
 
-            #######################################
-            Timers.tic('get mutex')
-            should_block = self.priv.shared_update_urgent
-            did_lock = self.shared.mutex.acquire(should_block)
-            Timers.toc('get mutex')
+            self.priv.shared_update_urgent = False
+            self.priv.next_shared_var_update = now + Settings.UPDATE_SHARED_VARS_INTERVAL
 
-            if did_lock:
-                self.priv.shared_update_urgent = False
+            self.flush_stats()
 
-            self.priv.next_shared_var_update = now + Settings.UPDATE_SHARED_VARS_INTERVAL
+            if self.priv.next_metrics_time is not None and now >= self.priv.next_metrics_time:
+                self.publish_metrics()
+                self.priv.next_metrics_time = now + Settings.METRICS_INTERVAL
 
-            # can be non-blocking
-            if did_lock:
-                # update in progress counts
-                self.shared.stars_in_progress.value += self.priv.stars_in_progress
-                self.priv.stars_in_progress = 0
+            # check if completed
+            if self.is_finished():
+                should_exit = True
 
-                # update heap info
-                self.shared.heap_sizes[windex] = len(self.priv.work_list)
+            Timers.toc('update_shared_variables')
 
-                if self.priv.ss:
-                    self.shared.heap_sizes[windex] += 1
-                    
-                num_zeros = 0
+        return should_exit
 
-                for i, size in enumerate(self.shared.heap_sizes):
-                    if i != self.priv.worker_index:
-                        if size == 0:
-                            num_zeros += 1
-                            self.shared.heap_sizes[i] = 0 # temp marker so other people don't give them work
-                    
-                #heap_sizes = list(self.shared.heap_sizes) # was comprehension
+    def flush_stats(self):
+        'add the local statistics to this worker\'s slots of the shared counters (no mutex needed)'
 
-                # update finished counts (these get set in finalized_star)
-                self.shared.finished_stars.value += self.priv.update_stars
-                self.shared.finished_work_frac.value += self.priv.update_work_frac
-                self.shared.stars_in_progress.value += self.priv.update_stars_in_progress
+        windex = self.priv.worker_index
 
-                self.shared.incorrect_overapprox_count.value += self.priv.incorrect_overapprox_count
-                self.shared.incorrect_overapprox_time.value += self.priv.incorrect_overapprox_time
+        # created stars must be counted before finished ones, see SharedState.count_stars_in_progress()
+        self.flush_created_stars()
 
-                self.priv.update_stars = 0
-                self.priv.update_work_frac = 0
-                self.priv.update_stars_in_progress = 0
-                self.priv.incorrect_overapprox_count = 0
-                self.priv.incorrect_overapprox_time = 0
+        # update finished counts (these get set in finalized_star)
+        self.shared.finished_stars.add(windex, self.priv.update_stars)
+        self.shared.finished_work_frac.add(windex, self.priv.update_work_frac)
+        self.shared.stars_done.add(windex, -self.priv.update_stars_in_progress)
 
-                # check if completed
-                if self.is_finished_with_lock():
-                    should_exit = True
+        self.shared.incorrect_overapprox_count.add(windex, self.priv.incorrect_overapprox_count)
+        self.shared.incorrect_overapprox_time.add(windex, self.priv.incorrect_overapprox_time)
 
-                self.shared.mutex.release()
-                #########################################
+        if self.priv.update_splits or self.priv.update_leaves:
+            self.shared.tree_size.add(windex, self.priv.update_splits, self.priv.update_leaves)
+            self.priv.update_splits.clear()
+            self.priv.update_leaves.clear()
 
-                if not should_exit:
-                    Timers.tic('load_balancing')
-                    self.do_load_balancing(num_zeros)
-                    Timers.toc('load_balancing')
+        self.priv.update_stars = 0
+        self.priv.update_work_frac = 0
+        self.priv.update_stars_in_progress = 0
+        self.priv.incorrect_overapprox_count = 0
+        self.priv.incorrect_overapprox_time = 0
 
-            Timers.toc('update_shared_variables')
+        self.shared.flush_counters(windex)
 
-        return should_exit
+    def publish_metrics(self):
+        'write this worker\'s row of shared.live_metrics (see metrics.py)'
+
+        priv = self.priv
+        idle_secs = priv.idle_secs
+
+        if priv.idle_start_time is not None:
+            idle_secs += time.perf_counter() - priv.idle_start_time
+
+        values = [priv.finished_stars + priv.finished_approx_stars, priv.num_lps, priv.num_lps_enum,
+                  priv.overapprox_tries, priv.finished_approx_stars, len(priv.work_list), priv.steal_count,
+                  priv.steal_secs, idle_secs, get_rss_bytes()]
+
+        offset = priv.worker_index * len(values)
+        self.shared.live_metrics[offset:offset + len(values)] = values
+
+    def flush_created_stars(self):
+        'count the stars this worker created in the shared state, call before they can be finished elsewhere'
+
+        self.shared.stars_created.add(self.priv.worker_index, self.priv.stars_in_progress)
+        self.shared.stars_created.flush(self.priv.worker_index)
+        self.priv.stars_in_progress = 0
+
+    @staticmethod
+    def count_depth(counts, depth):
+        'add one to the count for depth in counts, a dict of local tree size statistics'
+
+        counts[depth] = counts.get(depth, 0) + 1
+
+    def end_node(self, ss, was_split):
+        '''record (Settings.REPLAY_RECORD) or check (Settings.REPLAY_LOG) the end of a node of the search tree
+
+        if was_split, ss is the star that continues after the split, otherwise ss is a leaf
+        '''
+
+        if self.priv.recorder is not None or self.shared.replay is not None:
+            key = path_key(ss.branch_tuples)
+            split = None
+
+            if was_split:
+                split = ss.branch_tuples[-1][:2]
+                key >>= 1 # the parent's path
+
+            if self.priv.recorder is not None:
+                self.priv.recorder.end_node(key, split)
+
+            if self.shared.replay is not None:
+                self.shared.replay.check_split(key, split)
 
     def timeout(self):
         '''a timeout occured'''
@@ -439,8 +522,9 @@ class Worker(Freezable):
                 self.priv.last_print_time = now - Settings.PRINT_INTERVAL - 1 # force a print at start
 
             cur_time = now - self.priv.start_time
+            stop_flag = self.shared.stop_flag
 
-            if cur_time >= Settings.TIMEOUT:
+            if cur_time >= Settings.TIMEOUT or (stop_flag is not None and stop_flag.value):
                 self.timeout()
 
             if Settings.PRINT_OUTPUT and Settings.PRINT_PROGRESS and \
@@ -451,10 +535,7 @@ class Worker(Freezable):
                 self.priv.last_print_time = now
                 self.priv.num_prints += 1
 
-                ##############################
-                self.shared.mutex.acquire()
-                
-                in_progress = self.shared.stars_in_progress.value
+                in_progress = self.shared.count_stars_in_progress()
                 finished = self.shared.finished_stars.value
 
                 layers = list(self.shared.cur_layers)
@@ -467,8 +548,6 @@ class Worker(Freezable):
 
                 finished_frac = self.shared.finished_work_frac.value
 
-                self.shared.mutex.release()
-                ##############################
                 elapsed = now - self.priv.start_time
                 time_str = to_time_str(elapsed)
 
@@ -483,20 +562,17 @@ class Worker(Freezable):
                 status += "       "
                 total_stars = in_progress + finished
 
-                eta = '-'
-
-                delta_time = now - self.priv.start_time
+                # per-depth statistics, see treesize.py (the work fraction halves at each split regardless of
+                # subtree size, so it's a poor predictor on unbalanced trees)
+                estimate = self.shared.tree_size.estimate(elapsed, finished)
 
-                if finished_frac > 0:
-                    estimated_total = delta_time / finished_frac
-                    eta = max(estimated_total - elapsed, 0)
-                    eta = to_time_str(eta)
-
-                # don't divide by 0
-                expected_stars = round(1 if finished_frac < 1e-9 else finished / finished_frac)
+                if estimate is None:
+                    estimate_str = "ETA: -"
+                else:
+                    estimate_str = str(estimate)
 
                 print(f"({time_str}) Q: {qsize}, Sets: {finished}/{total_stars} " + \
-                      f" ({round(finished_frac * 100, 3)}%) ETA: {eta} (expected {expected_stars} stars)   ", end="\r")
+                      f" ({round(finished_frac * 100, 3)}%) {estimate_str}   ", end="\r")
 
                 log_prints = math.log(self.priv.num_prints, 2)
                 
@@ -506,13 +582,13 @@ class Worker(Freezable):
                 
                 Timers.toc("print_progress")
 
-    def is_finished_with_lock(self):
+    def is_finished(self):
         '''is the computation finished (should workers exit?)
 
-        call with mutex locked
+        the checks read monotone shared values, so no mutex is needed except to set should_exit
         '''
 
-        rv = self.shared.stars_in_progress.value == 0
+        rv = self.shared.count_stars_in_progress() == 0
 
         if not rv:
             rv = self.shared.result.found_confirmed_counterexample.value == 1
@@ -529,7 +605,12 @@ class Worker(Freezable):
             rv = True
 
         if rv and not self.shared.should_exit.value:
+            # steal() checks should_exit with the mutex held, so a steal request is never made after this is set
+            ##############################
+            self.shared.mutex.acquire()
             self.shared.should_exit.value = 1
+            self.shared.mutex.release()
+            ##############################
 
         return rv
                         
@@ -540,24 +621,28 @@ class Worker(Freezable):
         self.priv.shared_update_urgent = True
         self.update_shared_variables()
 
-        if self.priv.ss is not None or self.priv.stars_in_progress > 0:
-            #######################################
-            self.shared.mutex.acquire()
-
-            if self.priv.ss:
-                self.shared.stars_in_progress.value -= 1
-                self.shared.unfinished_stars.value += 1
-                self.priv.ss = None
+        windex = self.priv.worker_index
+        self.flush_created_stars()
 
-            self.shared.stars_in_progress.value += self.priv.stars_in_progress
-            self.priv.stars_in_progress = 0
-                
-            self.shared.mutex.release()
-            ########################################
+        if self.priv.ss is not None:
+            self.shared.unfinished_stars.add(windex, 1)
+            self.shared.stars_done.add(windex, 1)
+            self.shared.flush_counters(windex)
+            self.priv.ss = None
 
         should_exit = False
         count = len(self.priv.work_list)
 
+        # a star stolen by this worker may still be in transit
+        while self.priv.steal_victim is not None and not self.shared.had_exception.value:
+            self.answer_steal_request(can_give=False)
+
+            if self.receive_steal_reply(timeout=0.01, discard=True) is not None:
+                count += 1
+
+        # requests can't be made after should_exit is set, so this answers the last one
+        self.answer_steal_request(can_give=False)
+
         while not should_exit:
             
             # pop as many as possible
@@ -569,35 +654,263 @@ class Worker(Freezable):
                 else:
                     break
 
-            ########################################
-            self.shared.mutex.acquire()
-            self.shared.stars_in_progress.value -= count
-            self.shared.unfinished_stars.value += count
+            self.shared.unfinished_stars.add(windex, count)
+            self.shared.stars_done.add(windex, count)
+            self.shared.flush_counters(windex)
             count = 0
 
-            if self.shared.stars_in_progress.value <= 0:
-                assert self.shared.stars_in_progress.value == 0, \
-                    f"stars in progress should be 0, was {self.shared.stars_in_progress.value}"
-                should_exit = True
+            in_progress = self.shared.count_stars_in_progress()
 
-            self.shared.mutex.release()
-            ##########################################
+            if in_progress <= 0:
+                assert in_progress == 0, f"stars in progress should be 0, was {in_progress}"
+                should_exit = True
 
             # don't busy wait
             if not should_exit:
                 time.sleep(0.01)
 
+    def check_checkpoint(self):
+        'periodically start a checkpoint (worker 0), and join checkpoints started by worker 0'
+
+        if Settings.CHECKPOINT_DIR is None or self.shared.checkpoint_info is None:
+            return
+
+        now = time.perf_counter()
+
+        if now < self.priv.next_checkpoint_check:
+            return
+
+        self.priv.next_checkpoint_check = now + Settings.UPDATE_SHARED_VARS_INTERVAL
+
+        if self.priv.worker_index == 0 and now > self.priv.next_checkpoint_time:
+            self.priv.next_checkpoint_time = now + Settings.CHECKPOINT_INTERVAL
+
+            ##############################
+            self.shared.mutex.acquire()
+
+            # checkpoint_id doesn't change after should_exit is set, see save_final_checkpoint()
+            if not self.shared.should_exit.value:
+                self.shared.checkpoint_id.value += 1
+                self.shared.checkpoint_requested.value = 1
+
+            self.shared.mutex.release()
+            ##############################
+
+        if self.shared.checkpoint_requested.value:
+            ##############################
+            self.shared.mutex.acquire()
+            checkpoint_id = self.shared.checkpoint_id.value
+            self.shared.mutex.release()
+            ##############################
+
+            if self.shared.checkpoint_saved[self.priv.worker_index] != checkpoint_id:
+                self.save_checkpoint(checkpoint_id, final=False)
+
+    def save_final_checkpoint(self):
+        'after the main loop exits due to a timeout, save the remaining work in a checkpoint rather than dropping it'
+
+        if Settings.CHECKPOINT_DIR is None or self.shared.checkpoint_info is None:
+            return
+
+        ##############################
+        self.shared.mutex.acquire()
+
+        # the first worker to get here decides for everyone, so all workers join the checkpoint or none do
+        if self.shared.final_checkpoint.value == 0:
+            should_save = self.shared.had_timeout.value and not self.shared.had_exception.value and \
+                not self.shared.result.found_confirmed_counterexample.value
+
+            self.shared.final_checkpoint.value = 1 if should_save else 2
+
+        should_save = self.shared.final_checkpoint.value == 1
+        checkpoint_id = self.shared.checkpoint_id.value + 1
+
+        self.shared.mutex.release()
+        ##############################
+
+        if should_save:
+            self.save_checkpoint(checkpoint_id, final=True)
+
+    def save_checkpoint(self, checkpoint_id, final):
+        '''save this worker's stars in the checkpoint and wait until worker 0 finishes it
+
+        All workers pause while a checkpoint is saved, and a worker waits for the reply to its steal request before
+        saving its stars, so no stars are in transit. Worker 0 then saves the stars in the global queue and the
+        manifest. A periodic checkpoint is abandoned if the computation ends first. A final
+        checkpoint is saved after the main loop exits due to a timeout.
+        '''
+
+        Timers.tic('save_checkpoint')
+
+        windex = self.priv.worker_index
+
+        stolen_ss = self.finish_steal()
+
+        if stolen_ss is not None:
+            self.priv.work_list.push(stolen_ss)
+
+        # flush local counts so that the stars in progress match the saved stars
+        self.priv.shared_update_urgent = True
+        self.update_shared_variables()
+
+        work_list = self.priv.work_list
+        ss_list = list(work_list)
+
+        if self.priv.ss is not None:
+            ss_list.append(self.priv.ss)
+
+        # spilled stars are streamed from the spill file into the checkpoint, rather than read back into memory
+        num_spilled = len(work_list.spilled) if isinstance(work_list, SpillFrontier) else 0
+        spilled_records = work_list.spilled_records() if num_spilled > 0 else ()
+
+        # statistics that are only added to the shared state in update_final_stats()
+        stats = {'finished_approx_stars': self.priv.finished_approx_stars,
+                 'num_lps': self.priv.num_lps,
+                 'num_lps_enum': self.priv.num_lps_enum,
+                 'num_offloaded': self.priv.num_offloaded}
+
+        save_frontier(Settings.CHECKPOINT_DIR, checkpoint_id, f'worker_{windex}', ss_list, stats, spilled_records)
+
+        ##############################
+        self.shared.mutex.acquire()
+        self.shared.checkpoint_counts[windex] = len(ss_list) + num_spilled
+        self.shared.checkpoint_saved[windex] = checkpoint_id
+        self.shared.mutex.release()
+        ##############################
+
+        if windex == 0:
+            self.finish_checkpoint(checkpoint_id, final)
+        else:
+            while self.shared.checkpoint_done.value < checkpoint_id and not self.shared.had_exception.value:
+                if not final and self.shared.should_exit.value:
+                    break
+
+                self.answer_steal_request(can_give=False)
+                time.sleep(0.01)
+
+        Timers.toc('save_checkpoint')
+
+    def finish_checkpoint(self, checkpoint_id, final):
+        'worker 0: wait for all workers to save their stars, then save the global queue and the manifest'
+
+        all_saved = False
+
+        while not all_saved:
+            if self.shared.had_exception.value or (not final and self.shared.should_exit.value):
+                break
+
+            all_saved = all(saved_id == checkpoint_id for saved_id in self.shared.checkpoint_saved)
+
+            if not all_saved:
+                self.answer_steal_request(can_give=False)
+                time.sleep(0.01)
+
+        queued = []
+
+        if all_saved:
+            # all workers flushed their counts before saving, so these don't change until the checkpoint is done
+            num_stars = self.shared.count_stars_in_progress()
+            num_queued = num_stars - sum(self.shared.checkpoint_counts)
+            stats = {name: getattr(self.shared, name).value for name in STAT_NAMES}
+
+            # items put on a multiprocessing queue may take some time to arrive
+            last_get_time = time.perf_counter()
+
+            while len(queued) < num_queued:
+                ss = self.shared.get_global_queue(timeout=0.1)
+
+                if ss is not None:
+                    queued.append(ss)
+                    last_get_time = time.perf_counter()
+                elif time.perf_counter() - last_get_time > 10.0:
+                    print(f"\nWarning: abandoning checkpoint {checkpoint_id}; found {len(queued)} of the " + \
+                          f"{num_queued} stars expected in the work queue")
+                    all_saved = False
+                    break
+
+        if all_saved:
+            dirname = Settings.CHECKPOINT_DIR
+            save_frontier(dirname, checkpoint_id, 'queue', queued, {})
+
+            key, prior_secs = self.shared.checkpoint_info
+            names = [f'worker_{i}' for i in range(self.shared.num_workers)] + ['queue']
+
+            manifest = {'checkpoint_id': checkpoint_id,
+                        'key': key,
+                        'final': final,
+                        'total_secs': prior_secs + time.perf_counter() - self.priv.start_time,
+                        'num_workers': self.shared.num_workers,
+                        'num_stars': num_stars,
+                        'frontier_names': names,
+                        'stats': stats}
+
+            save_manifest(dirname, manifest)
+
+            if Settings.PRINT_OUTPUT:
+                frac = stats['finished_work_frac']
+                print(f"\nSaved checkpoint {checkpoint_id} with {num_stars} stars to {dirname} " + \
+                      f"({round(100 * frac, 3)}% finished)")
+        else:
+            discard_frontier(Settings.CHECKPOINT_DIR, checkpoint_id)
+
+        # put the global queue back
+        for ss in queued:
+            self.shared.put_queue(ss)
+
+        ##############################
+        self.shared.mutex.acquire()
+        self.shared.checkpoint_requested.value = 0
+        self.shared.checkpoint_done.value = checkpoint_id
+        self.shared.mutex.release()
+        ##############################
+
     def update_final_stats(self):
         'all processes finished, update global stats'
 
-        self.shared.mutex.acquire()
+        windex = self.priv.worker_index
+
+        self.shared.finished_approx_stars.add(windex, self.priv.finished_approx_stars)
 
-        self.shared.finished_approx_stars.value += self.priv.finished_approx_stars
+        self.shared.num_lps.add(windex, self.priv.num_lps)
+        self.shared.num_lps_enum.add(windex, self.priv.num_lps_enum)
 
-        self.shared.num_lps.value += self.priv.num_lps
-        self.shared.num_lps_enum.value += self.priv.num_lps_enum
+        self.shared.simplex_calls.add(windex, SIMPLEX_STATS.calls)
+        self.shared.simplex_iterations.add(windex, SIMPLEX_STATS.iterations)
+        self.shared.inherited_basis_calls.add(windex, SIMPLEX_STATS.inherited_calls)
+        self.shared.inherited_basis_iterations.add(windex, SIMPLEX_STATS.inherited_iterations)
         
-        self.shared.num_offloaded.value += self.priv.num_offloaded
+        self.shared.num_offloaded.add(windex, self.priv.num_offloaded)
+
+        if self.priv.idle_start_time is not None:
+            self.priv.idle_secs += time.perf_counter() - self.priv.idle_start_time
+            self.priv.idle_start_time = None
+
+        self.shared.idle_secs[windex] = self.priv.idle_secs
+        self.shared.steal_count.add(windex, self.priv.steal_count)
+        self.shared.steal_refusals.add(windex, self.priv.steal_refusals)
+        self.shared.steal_secs.add(windex, self.priv.steal_secs)
+
+        if self.priv.next_metrics_time is not None:
+            self.publish_metrics()
+
+        work_list = self.priv.work_list
+
+        if isinstance(work_list, SpillFrontier):
+            self.shared.spill_count.add(windex, work_list.spill_count)
+            self.shared.spill_bytes.add(windex, work_list.spill_bytes)
+            self.shared.spill_secs.add(windex, work_list.spill_secs)
+
+        stats = self.shared.transfer_stats
+        self.shared.offload_count.add(windex, stats.num_sent)
+        self.shared.offload_bytes.add(windex, stats.bytes_sent)
+        self.shared.offload_secs.add(windex, stats.send_secs + stats.receive_secs)
+        stats.reset()
+
+        self.shared.flush_counters(windex)
+
+        # the timer totals are shared by all workers, so these still need the mutex
+        ##############################
+        self.shared.mutex.acquire()
 
         for tindex, timer_name in enumerate(Settings.RESULT_SAVE_TIMERS):
             timer_list = Timers.top_level_timer.get_children_recursive(timer_name)
@@ -607,26 +920,150 @@ class Worker(Freezable):
                 self.shared.timer_counts[tindex] += t.num_calls
 
         self.shared.mutex.release()
+        ##############################
+
+    def get_more_work(self):
+        '''get a star for this idle worker from the global queue (which has the initial star and the stars of a loaded
+        checkpoint), or else by stealing one from another worker
+
+        returns the star or None
+        '''
+
+        rv = None
 
-    def do_load_balancing(self, num_zeros):
-        '''balance work across threads using a work-stealing strategy
+        if not self.shared.multithreaded:
+            rv = self.shared.get_global_queue(timeout=0.01)
+        else:
+            if self.priv.steal_victim is None:
+                rv = self.shared.get_global_queue(block=False)
+
+            if rv is None:
+                rv = self.steal()
+
+        return rv
+
+    def steal(self):
+        '''steal a star from a random worker that is not idle
+
+        The thief writes its index into the victim's slot in shared.steal_requests, and the victim replies through the
+        thief's inbox queue the next time it calls answer_steal_request(). Each thief has at most one outstanding
+        request, so every reply in its inbox is for the current request.
+
+        returns the stolen star, or None if there's no reply yet or the victim had no work to give
         '''
 
-        if self.priv.work_list:
-            #print(f". num_zeros: {num_zeros}")
-            if num_zeros > 0:
-                while num_zeros > 0 and len(self.priv.work_list) > 1 or \
-                  (len(self.priv.work_list) > 0 and self.priv.ss is not None):
-                    # push some work onto the queue
+        Timers.tic('steal')
 
-                    # min item is heaviest (closest to root)
-                    # heaviest will be first item on list
-                    new_ss = self.priv.work_list.pop(0)
+        windex = self.priv.worker_index
 
-                    self.priv.num_offloaded += 1
-                    num_zeros -= 1
+        if self.priv.steal_victim is None:
+            victims = [i for i, is_idle in enumerate(list(self.shared.idle_workers)) if i != windex and not is_idle]
 
-                    self.shared.put_queue(new_ss)
+            if victims:
+                victim = random.choice(victims)
+
+                ##############################
+                self.shared.mutex.acquire()
+
+                # no new requests after should_exit is set, so that clear_remaining_work() can answer all of them
+                if not self.shared.should_exit.value and self.shared.steal_requests[victim] == 0:
+                    self.shared.steal_requests[victim] = windex + 1
+                    self.priv.steal_victim = victim
+                    self.priv.steal_request_time = time.perf_counter()
+
+                self.shared.mutex.release()
+                ##############################
+
+        if self.priv.steal_victim is not None:
+            rv = self.receive_steal_reply(timeout=0.01)
+        else:
+            rv = None
+            time.sleep(0.01) # don't busy wait
+
+        Timers.toc('steal')
+
+        return rv
+
+    def receive_steal_reply(self, timeout, discard=False):
+        '''check for the reply to this worker's outstanding steal request
+
+        returns the stolen star, or None. If discard is True, the star is only counted, see get_global_queue().
+        '''
+
+        got_reply, rv = self.shared.get_steal_reply(self.priv.worker_index, timeout, skip_deserialize=discard)
+
+        if got_reply:
+            self.priv.steal_secs += time.perf_counter() - self.priv.steal_request_time
+            self.priv.steal_victim = None
+
+            if rv is None:
+                self.priv.steal_refusals += 1
+            else:
+                self.priv.steal_count += 1
+
+        return rv
+
+    def answer_steal_request(self, can_give=True):
+        '''reply to a steal request from an idle worker, if there is one
+
+        the star closest to the root of the frontier (or, without Settings.OFFLOAD_CLOSEST_TO_ROOT, the star this
+        worker would pop next) is given away, as long as this worker keeps one star for itself
+
+        stealing is cooperative: requests are only answered when this is called, once per main loop iteration, so the
+        thief waits for as long as the victim's current star takes to advance (an overapproximation or a split)
+        '''
+
+        if not self.shared.multithreaded:
+            return
+
+        windex = self.priv.worker_index
+        thief_index = self.shared.steal_requests[windex] - 1
+
+        if thief_index >= 0:
+            work_list = self.priv.work_list
+            ss = None
+
+            if can_give and (len(work_list) > 1 or (work_list and self.priv.ss is not None)):
+                ss = work_list.pop_heaviest() if Settings.OFFLOAD_CLOSEST_TO_ROOT else work_list.pop()
+                self.priv.num_offloaded += 1
+
+                # the thief may finish the star before this worker's next update_shared_variables()
+                self.flush_created_stars()
+
+            self.shared.send_steal_reply(thief_index, ss)
+
+            # thieves only write to a slot that is zero (with the mutex), so this doesn't need it
+            self.shared.steal_requests[windex] = 0
+
+    def finish_steal(self):
+        '''wait for the reply to this worker's outstanding steal request, if any, while refusing requests from others
+
+        returns the stolen star or None
+        '''
+
+        rv = None
+
+        while self.priv.steal_victim is not None and not self.shared.had_exception.value:
+            self.answer_steal_request(can_give=False)
+            rv = self.receive_steal_reply(timeout=0.01)
+
+        return rv
+
+    def update_idle_state(self):
+        'track the time this worker has no work, and publish it in shared.idle_workers (used to pick steal victims)'
+
+        is_idle = self.priv.ss is None
+
+        if is_idle != (self.priv.idle_start_time is not None):
+            now = time.perf_counter()
+
+            if is_idle:
+                self.priv.idle_start_time = now
+            else:
+                self.priv.idle_secs += now - self.priv.idle_start_time
+                self.priv.idle_start_time = None
+
+            self.shared.idle_workers[self.priv.worker_index] = 1 if is_idle else 0
 
     def save_star(self, ss):
         '''save the lp_star to the result
@@ -793,11 +1230,12 @@ class Worker(Freezable):
         self.priv.update_stars += 1
         self.priv.update_work_frac += ss.work_frac
         self.priv.update_stars_in_progress -= 1
+        self.count_depth(self.priv.update_leaves, len(ss.branch_tuples))
+        self.end_node(ss, False)
 
         if not self.priv.work_list:
             # urgently update shared variables to try to get more work
             self.priv.shared_update_urgent = True
-            self.priv.fulfillment_requested_time = time.perf_counter()
 
         if Settings.PRINT_BRANCH_TUPLES:
             print(self.priv.branch_tuples_list[-1])
@@ -827,19 +1265,76 @@ class Worker(Freezable):
         spec = self.shared.spec
 
         if not ss.is_finished(network):
+            depth = len(ss.branch_tuples)
             new_star = ss.do_first_relu_split(network, spec, self.priv.start_time)
 
             ss.propagate_up_to_split(network, self.priv.start_time)
 
             if new_star: # new_star can be null if it wasn't really a split (copy prefilter)
-                new_star.propagate_up_to_split(network, self.priv.start_time)
+                if not isinstance(new_star, StarRecipe): # recipes get propagated when they're materialized
+                    new_star.propagate_up_to_split(network, self.priv.start_time)
 
                 # note: new_star may be done... but for expected branching order we still add it
                 self.priv.stars_in_progress += 1
-                self.priv.work_list.append(new_star)
+                self.count_depth(self.priv.update_splits, depth)
+                self.end_node(ss, True)
+                self.push_work(new_star)
+
+                if Settings.FRONTIER_ORDER == Settings.FRONTIER_BEST_FIRST:
+                    # continue with whichever star has the best priority
+                    self.push_work(ss)
+                    self.priv.ss = None
 
         Timers.toc('advance')
 
+    def push_work(self, ss):
+        'add a star to the local frontier'
+
+        if Settings.FRONTIER_ORDER == Settings.FRONTIER_BEST_FIRST and \
+                Settings.FRONTIER_PRIORITY == Settings.PRIORITY_DISTANCE and not isinstance(ss, StarRecipe):
+            self.set_distance_to_unsafe(ss)
+
+        if isinstance(ss, StarRecipe):
+            self.priv.snapshot_cache.touch(ss.snapshot)
+
+        self.priv.work_list.push(ss)
+
+    def materialize_star(self):
+        '''rebuild self.priv.ss from a StarRecipe (see Settings.COMPACT_FRONTIER)
+
+        if an lp is canceled due to the timeout, the recipe is put back in the frontier, where it's still valid for a
+        checkpoint
+        '''
+
+        recipe = self.priv.ss
+        timer_name = Timers.stack[-1].name if Timers.stack else None
+
+        try:
+            self.priv.ss = recipe.materialize(self.shared.network, self.priv.start_time, self.priv.snapshot_cache)
+        except LpCanceledException:
+            while Timers.stack and Timers.stack[-1].name != timer_name:
+                Timers.toc(Timers.stack[-1].name)
+
+            self.priv.ss = None
+            self.priv.work_list.push(recipe)
+            self.timeout()
+
+    def set_distance_to_unsafe(self, ss):
+        'set ss.distance_to_unsafe, the spec distance of the output of the star\'s simulation point'
+
+        spec = self.shared.spec
+        network = self.shared.network
+
+        if spec is not None:
+            Timers.tic('set_distance_to_unsafe')
+
+            sims = make_prerelu_sims(ss, network)
+
+            if sims is not None:
+                ss.distance_to_unsafe = spec.distance(sims[len(network.layers)])
+
+            Timers.toc('set_distance_to_unsafe')
+
 def branch_list_in_branch_tuples(branch_list, branch_tuples):
     'does the passed in concrete-execution (branch_list) go down the same branches as the star (branch_tuples)?'
 
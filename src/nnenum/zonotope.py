@@ -7,7 +7,7 @@ Stanley Bak
 import numpy as np
 
 from nnenum.util import Freezable
-from nnenum.timerutil import Timers
+from nnenum.timerutil import Timers, hot_timed
 from nnenum import kamenev
 from nnenum.settings import Settings
 
@@ -169,11 +169,10 @@ class Zonotope(Freezable):
             self.neg1_gens[i] = lb
             self.pos1_gens[i] = ub
 
+    @hot_timed('zonotope.maximize')
     def maximize(self, vector):
         'get the maximum point of the zonotope in the passed-in direction'
 
-        Timers.tic('zonotope.maximize')
-
         rv = self.center.copy()
 
         # project vector (a generator) onto row, to check if it's positive or negative
@@ -186,18 +185,15 @@ class Zonotope(Freezable):
 
             rv += factor * row
 
-        Timers.toc('zonotope.maximize')
-
         return rv
 
+    @hot_timed('zonotope.minimize_val')
     def minimize_val(self, vector):
         '''get the minimum value of the zonotope projected onto the passed-in direction
 
         similar to zonotope.maximize but slightly faster
         '''
 
-        Timers.tic('zonotope.minimize_val')
-
         rv = self.center.dot(vector)
 
         # project vector (a generator) onto row, to check if it's positive or negative
@@ -221,18 +217,15 @@ class Zonotope(Freezable):
 
         rv += res.dot(res_vec)
 
-        Timers.toc('zonotope.minimize_val')
-
         return rv
 
+    @hot_timed('zono.box_bounds')
     def box_bounds(self):
         '''compute box bounds for the zonotope
 
         returns bounds
         '''
 
-        Timers.tic('zono.box_bounds')
-
         mat_t = self.mat_t
         size = self.center.size
 
@@ -255,8 +248,6 @@ class Zonotope(Freezable):
         rv[:, 0] = self.center + pos_neg + neg_pos
         rv[:, 1] = self.center + pos_pos + neg_neg
         
-        Timers.toc('zono.box_bounds')
-
         return rv
 
     def get_single_output_bounds(self, index):
@@ -280,6 +271,7 @@ class Zonotope(Freezable):
 
         return lb, ub
 
+    @hot_timed('zono.update_output_bounds')
     def update_output_bounds(self, layer_bounds, update_indices):
         '''
         update the passed-in bounds to the values in the zonotope outer approximation. 
@@ -289,8 +281,6 @@ class Zonotope(Freezable):
         returns split_indices (subset of update_indices)
         '''
 
-        Timers.tic('zono.update_output_bounds')
-
         split_indices = []
 
         if self.mat_t.size == 0:
@@ -334,8 +324,6 @@ class Zonotope(Freezable):
                     if c + lb < -tol and tol < c + ub:
                         split_indices.append(i)
 
-        Timers.toc('zono.update_output_bounds')
-
         return np.array(split_indices, dtype=int)
 
     def contract_domain(self, hyperplane_vec, rhs):
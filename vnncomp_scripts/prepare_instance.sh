@@ -18,8 +18,36 @@ VNNLIB_FILE=$4
 
 echo "Preparing $TOOL_NAME for benchmark instance in category '$CATEGORY' with onnx file '$ONNX_FILE' and vnnlib file '$VNNLIB_FILE'"
 
-# kill any zombie processes
-killall -q python3
+DIR=$(dirname $(dirname $(realpath $0)))
+export PYTHONPATH="$PYTHONPATH:$DIR/src"
+
+export OPENBLAS_NUM_THREADS=1
+export OMP_NUM_THREADS=1
+
+# set NNENUM_DAEMON=0 to run each instance in a fresh python process instead of a resident nnenum.server
+NNENUM_DAEMON=${NNENUM_DAEMON:-1}
+SOCKET_FILE=/tmp/nnenum_server.sock
+
+if [ "$NNENUM_DAEMON" == "1" ] && python3 -m nnenum.client "$SOCKET_FILE" --ping > /dev/null 2>&1; then
+	echo "Reusing running nnenum server at $SOCKET_FILE"
+else
+	# kill any zombie processes
+	killall -q python3
+
+	if [ "$NNENUM_DAEMON" == "1" ]; then
+		rm -f "$SOCKET_FILE"
+		nohup python3 -m nnenum.server "$SOCKET_FILE" > /tmp/nnenum_server.log 2>&1 &
+
+		# wait for the server to start listening
+		for i in $(seq 1 120); do
+			if python3 -m nnenum.client "$SOCKET_FILE" --ping > /dev/null 2>&1; then
+				break
+			fi
+
+			sleep 0.5
+		done
+	fi
+fi
 
 # script returns a 0 exit code if successful. If you want to skip a benchmark category you can return non-zero.
 exit 0
@@ -27,5 +27,20 @@ export PYTHONPATH="$PYTHONPATH:$DIR/src"
 export OPENBLAS_NUM_THREADS=1
 export OMP_NUM_THREADS=1
 
-# run the tool to produce the results file
+NNENUM_DAEMON=${NNENUM_DAEMON:-1}
+SOCKET_FILE=/tmp/nnenum_server.sock
+
+# run the tool to produce the results file, using the server started by prepare_instance.sh if it's running.
+# The job is only run directly if the server could not be reached (client exit code 2), not if it replied "error".
+if [ "$NNENUM_DAEMON" == "1" ] && [ -S "$SOCKET_FILE" ]; then
+	python3 -m nnenum.client "$SOCKET_FILE" "$ONNX_FILE" "$VNNLIB_FILE" "$TIMEOUT" "$RESULTS_FILE"
+	CLIENT_EXIT=$?
+
+	if [ $CLIENT_EXIT -ne 2 ]; then
+		exit $CLIENT_EXIT
+	fi
+
+	echo "nnenum server unavailable; running directly"
+fi
+
 python3 -m nnenum.nnenum "$ONNX_FILE" "$VNNLIB_FILE" "$TIMEOUT" "$RESULTS_FILE"